@@ -16,22 +16,82 @@ Tasks:
 [DONE]: command line arguments
 [TODO]: write usage function
 [TODO]: write an equivalent using pyaudio and pyaudio(WASPI patch)
+[DONE]: binary transport (--binary) that skips the JSON encoding of every chunk
+[DONE]: websocket transport (--websocket), one connection for audio in and settings out
+[DONE]: framed TCP stream transport (--tcp), see src/stream_ingest.py on the server
+[DONE]: UDP transport (--udp), see src/udp_ingest.py on the server
+[DONE]: record from a file, a generator or a pipe instead of a sound card (--file, --generate, --pipe),
+        see virtual_sources.py
 """
-import soundcard as sc
 import numpy as np
 import sys
 import requests
 import logging
+import json
+import select
+import socket
+import struct
+import time
+from urllib.parse import urlparse
+from virtual_sources import FileMicrophone, GeneratorMicrophone, PipeMicrophone, RAW_FORMATS
 logging.basicConfig(format='[%(levelname)s] %(message)s')
 logging.getLogger().setLevel(logging.DEBUG)
 session = requests.Session()
+# websocket transport, connected the first time a chunk is sent (see connect_websocket)
+websocket = None
+# what the server pushed over the websocket since the last chunk
+websocket_events = {'settings': None, 'slow': False}
+# chunks sent over the websocket so far, the ones skipped while the server is slow are not numbered
+# (the server would count them as missed)
+websocket_seq = 0
+# tcp stream transport, connected the first time a chunk is sent (see connect_stream)
+stream = None
+stream_buffer = bytearray()
+# chunks sent so far, keeps counting across settings changes: the websocket and tcp stream stay open
+# and the server drops a chunk whose seq is not newer than the last one on the connection
+chunk_seq = 0
 
+# stream protocol, has to match src/stream_ingest.py
+STREAM_MAGIC = b"COAS"
+STREAM_VERSION = 1
+STREAM_HEADER = struct.Struct("<4sBBI")
+STREAM_AUDIO_HEADER = struct.Struct("<IdBBI")
+STREAM_HELLO, STREAM_WELCOME, STREAM_AUDIO, STREAM_SETTINGS, STREAM_ERROR = range(1, 6)
+STREAM_FLOAT32 = 1
+
+# udp transport, has to match src/udp_ingest.py
+udp_socket = None
+# datagrams sent so far, the server's jitter buffer orders by this
+udp_seq = 0
+UDP_MAGIC = b"COAU"
+UDP_VERSION = 1
+UDP_HEADER = struct.Struct("<4sBIIBBBBId")
+# stay well under the 1472 bytes that fit in one ethernet frame
+UDP_MAX_DATAGRAM = 1400
 
 
 def usage(return_val: int):
     print("""
-please write this...
+usage: python local_audio_client.py [options]
+
+    -ip URL                 server to send to (default http://127.0.0.1:8000/)
+    -s, --source ID         microphone to record from
+    --loopback              also offer loopback devices
+    -b, --blocksize N       frames per chunk (default 2048)
+    --samplerate N          samples per second (default 48000)
+    --binary, --websocket, --tcp, --udp
+                            transport (default: JSON over HTTP)
+    --stream-port N         port of the server's tcp ingest (default 4242)
+    --udp-port N            port of the server's udp ingest (default 4243)
 
+instead of a sound card (see virtual_sources.py):
+    --file PATH             play a .wav or raw PCM file
+    --generate SPEC         tone:<Hz>,noise:<amplitude>,click:<seconds>, any combination
+    --pipe PATH             raw PCM from a FIFO, - for stdin
+    --format NAME           sample format of raw files and pipes: float32, int16, int32 (default float32)
+    --channels N            channels of raw files, pipes and the generator (default 1)
+    --fast                  do not wait for files and the generator to play in real time
+    --loop                  start the file over when it ends
 """)
     sys.exit(return_val)
 
@@ -71,6 +131,198 @@ def update_settings(ip: str, settings: dict) -> bool:
 
 
 
+def post_json_chunk(data, ip: str, settings: dict, seq: int, captured: float) -> dict:
+    """
+    Send one chunk to /audio_in as JSON (the original format)
+    """
+    data = np.abs(data)
+    payload = {
+        "avg": float(np.average(data)),
+        "peak": float(np.max(data)),
+        "data": data.tolist(),
+        "capture_time": captured,
+    }
+    return session.post(ip + "audio_in", json=payload).json()
+
+def post_binary_chunk(data, ip: str, settings: dict, seq: int, captured: float) -> dict:
+    """
+    Send one chunk to /audio_in/binary as raw float32 bytes
+
+    The server computes avg/peak itself, so this only has to describe the samples
+    """
+    data = np.ascontiguousarray(data, dtype=np.float32)
+    headers = {
+        "Content-Type": "application/octet-stream",
+        "X-Audio-Dtype": "float32",
+        "X-Audio-Channels": str(data.shape[1] if data.ndim == 2 else 1),
+        "X-Audio-Samplerate": str(settings['samplerate']),
+        "X-Audio-Seq": str(seq),
+        "X-Audio-Source": str(settings['source']),
+        "X-Audio-Capture-Time": repr(captured),
+    }
+    return session.post(ip + "audio_in/binary", data=data.tobytes(), headers=headers).json()
+
+def connect_websocket(ip: str, settings: dict):
+    """
+    Open the socket.io connection to the server's /audio namespace and send our settings
+
+    The server pushes 'settings' when they change and 'flow' when it cannot keep up,
+    the handlers just note them down for post_websocket_chunk
+    """
+    global websocket
+    # only needed for --websocket, so the other transports do not need python-socketio installed
+    import socketio
+
+    websocket = socketio.Client(reconnection=False)
+
+    @websocket.on('settings', namespace='/audio')
+    def on_settings(new_settings):
+        websocket_events['settings'] = new_settings
+
+    @websocket.on('flow', namespace='/audio')
+    def on_flow(message):
+        websocket_events['slow'] = message.get('state') == 'slow'
+        logging.info(f"server asked us to go {'slower' if websocket_events['slow'] else 'back to normal'}")
+
+    @websocket.on('error', namespace='/audio')
+    def on_error(message):
+        logging.warning(f"server rejected a chunk: {message}")
+
+    try:
+        websocket.connect(ip, namespaces=['/audio'], transports=['websocket'])
+    except socketio.exceptions.ConnectionError as error:
+        raise ConnectionError(f"could not open websocket to {ip}") from error
+    websocket.emit('settings', settings, namespace='/audio')
+
+def post_websocket_chunk(data, ip: str, settings: dict, seq: int, captured: float) -> dict:
+    """
+    Send one chunk over the websocket as raw float32 bytes, nothing comes back per chunk
+
+    New settings pushed by the server are applied to settings here
+    """
+    global websocket_seq
+    if websocket is None or not websocket.connected:
+        connect_websocket(ip, settings)
+    if websocket_events['slow'] and seq % 2:
+        # the server is behind, only send every other chunk until it says otherwise
+        return {}
+    data = np.ascontiguousarray(data, dtype=np.float32)
+    meta = {
+        "dtype": "float32",
+        "channels": data.shape[1] if data.ndim == 2 else 1,
+        "samplerate": settings['samplerate'],
+        "seq": websocket_seq,
+        "source": str(settings['source']),
+        "capture_time": captured,
+    }
+    websocket.emit('audio_chunk', (meta, data.tobytes()), namespace='/audio')
+    websocket_seq += 1
+    if websocket_events['settings'] is not None:
+        settings.update(websocket_events['settings'])
+        websocket_events['settings'] = None
+        return {"change_settings": True}
+    return {}
+
+def stream_frame(frame_type: int, payload: bytes) -> bytes:
+    return STREAM_HEADER.pack(STREAM_MAGIC, STREAM_VERSION, frame_type, len(payload)) + payload
+
+def read_stream_frames(block: bool) -> list:
+    """
+    Read whatever the server sent and return the complete (frame type, payload) frames
+
+    With block=False this only reads if something is waiting, so it does not hold up the audio
+    """
+    frames = []
+    while not frames:
+        if not block and not select.select([stream], [], [], 0)[0]:
+            break
+        data = stream.recv(65536)
+        if not data:
+            raise ConnectionError("server closed the stream")
+        stream_buffer.extend(data)
+        # TCP does not keep message boundaries, only take the frames that have fully arrived
+        while len(stream_buffer) >= STREAM_HEADER.size:
+            _, _, frame_type, length = STREAM_HEADER.unpack_from(stream_buffer)
+            end = STREAM_HEADER.size + length
+            if len(stream_buffer) < end:
+                break
+            frames.append((frame_type, bytes(stream_buffer[STREAM_HEADER.size:end])))
+            del stream_buffer[:end]
+    return frames
+
+def connect_stream(ip: str, settings: dict):
+    """
+    Open the TCP stream to the server and do the HELLO/WELCOME handshake
+    """
+    global stream
+    stream_buffer.clear()
+    stream = socket.create_connection((urlparse(ip).hostname, settings['stream_port']))
+    # chunks are small and latency matters more than packing them together
+    stream.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    hello = {"mics": settings['mics'], "settings": settings}
+    stream.sendall(stream_frame(STREAM_HELLO, json.dumps(hello).encode()))
+    for frame_type, payload in read_stream_frames(block=True):
+        if frame_type == STREAM_ERROR:
+            raise ConnectionError(f"server refused the stream: {json.loads(payload)['message']}")
+        if frame_type == STREAM_WELCOME:
+            logging.info(f"stream connected, server speaks version {json.loads(payload)['version']}")
+
+def post_stream_chunk(data, ip: str, settings: dict, seq: int, captured: float) -> dict:
+    """
+    Send one chunk over the TCP stream as raw float32 bytes, nothing comes back per chunk
+
+    New settings pushed by the server are applied to settings here
+    """
+    if stream is None:
+        connect_stream(ip, settings)
+    data = np.ascontiguousarray(data, dtype=np.float32)
+    channels = data.shape[1] if data.ndim == 2 else 1
+    header = STREAM_AUDIO_HEADER.pack(seq, captured, STREAM_FLOAT32, channels, settings['samplerate'])
+    stream.sendall(stream_frame(STREAM_AUDIO, header + data.tobytes()))
+    response = {}
+    for frame_type, payload in read_stream_frames(block=False):
+        if frame_type == STREAM_SETTINGS:
+            settings.update(json.loads(payload))
+            response['change_settings'] = True
+        elif frame_type == STREAM_ERROR:
+            raise ConnectionError(f"server closed the stream: {json.loads(payload)['message']}")
+    return response
+
+def post_udp_chunk(data, ip: str, settings: dict, seq: int, captured: float) -> dict:
+    """
+    Send one chunk as UDP datagrams, split into fragments that fit under the MTU
+
+    Nothing comes back: lost datagrams are not resent and settings changes are not pushed,
+    the server's jitter buffer deals with late and missing datagrams
+    """
+    global udp_socket
+    global udp_seq
+    if udp_socket is None:
+        udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        udp_socket.connect((urlparse(ip).hostname, settings['udp_port']))
+    data = np.ascontiguousarray(data, dtype=np.float32)
+    channels = data.shape[1] if data.ndim == 2 else 1
+    frame_size = 4 * channels
+    fragment_size = (UDP_MAX_DATAGRAM - UDP_HEADER.size) // frame_size * frame_size
+    pcm = memoryview(data.tobytes())
+    fragments = max(1, -(-len(pcm) // fragment_size))
+    for fragment in range(fragments):
+        header = UDP_HEADER.pack(UDP_MAGIC, UDP_VERSION, udp_seq, seq, fragment, fragments,
+                                 STREAM_FLOAT32, channels, settings['samplerate'], captured)
+        udp_socket.send(header + pcm[fragment * fragment_size:(fragment + 1) * fragment_size])
+        udp_seq += 1
+    return {}
+
+TRANSPORTS = {
+    'json': post_json_chunk,
+    'binary': post_binary_chunk,
+    'websocket': post_websocket_chunk,
+    'tcp': post_stream_chunk,
+    'udp': post_udp_chunk,
+}
+# transports the server pushes new settings over, no need to ask for them
+PUSH_TRANSPORTS = ('websocket', 'tcp')
+
 def send_audio(chosen_mic, ip: str, settings: dict) -> bool:
     """
     Continuously send audio from the current settings until the server responds with new settings
@@ -82,29 +334,49 @@ def send_audio(chosen_mic, ip: str, settings: dict) -> bool:
     the system cannot process the audio fast enough
 
     this function should block until the server turns off or sends new settings
+
+    settings['transport'] picks how each chunk is sent (see TRANSPORTS)
+    every chunk is sent with the time its last sample was recorded, for the server's latency breakdown (/latency)
     """
+    global chunk_seq
     logging.info(f"listening to {chosen_mic.id} : {chosen_mic.name}")
+    post_chunk = TRANSPORTS[settings['transport']]
     with chosen_mic.recorder(samplerate=settings['samplerate'], blocksize=settings['blocksize']) as mic:
             while True:
-                data = np.abs(mic.record(numframes=None))
-                avg = np.average(np.abs(data))
-                peak = np.max(np.abs(data))
-
-                payload = {
-                    "avg": float(avg),
-                    "peak": float(peak),
-                    "data": data.tolist(),
-                }
                 try:
-                    response = session.post(ip + "audio_in", json=payload).json()
-                except requests.exceptions.ConnectionError:
+                    data = mic.record(numframes=None)
+                except EOFError as error:
+                    # a file or pipe ran out (see virtual_sources.py)
+                    logging.info(f"stopping, {error}")
+                    return False
+                # the last sample went through the sound card's buffer before we got it
+                # (not every soundcard backend knows its latency)
+                captured = time.time() - getattr(mic, 'latency', 0.0)
+                try:
+                    response = post_chunk(data, ip, settings, chunk_seq, captured)
+                except (requests.exceptions.ConnectionError, ConnectionError):
                     logging.error("server did not respond, exiting...")
                     return False
-                
+                chunk_seq += 1
+
                 if "change_settings" in response:
                     logging.info("stopping because new settings are available")
                     return True
 
+def virtual_microphone(kind: str, argument: str, settings: dict, options: dict):
+    """
+    The virtual_sources.py mic for --file, --generate or --pipe
+    """
+    if kind == '--file':
+        mic = FileMicrophone(argument, format=options['format'], channels=options['channels'],
+                             samplerate=settings['samplerate'], realtime=options['realtime'], loop=options['loop'])
+        # played at its own rate, the server has to know
+        settings['samplerate'] = mic.samplerate
+        return mic
+    if kind == '--generate':
+        return GeneratorMicrophone(argument, channels=options['channels'], realtime=options['realtime'])
+    return PipeMicrophone(argument, format=options['format'], channels=options['channels'])
+
 def main():
     """
     main function, wrangles send_audio and send_settings
@@ -118,9 +390,15 @@ def main():
         'loopback': loopback,
         'blocksize': 2048,
         'samplerate': 48000,
-        'mics': {m.id: m.name for m in sc.all_microphones(include_loopback=loopback)},
-        'source': sc.default_microphone().id
+        'mics': None,
+        'source': None,
+        'transport': 'json',
+        'stream_port': 4242,
+        'udp_port': 4243,
     }
+    # --file/--generate/--pipe: (kind, argument) of the source to use instead of a sound card
+    virtual = None
+    virtual_options = {'format': 'float32', 'channels': 1, 'realtime': True, 'loop': False}
     args = sys.argv[1:]
     while args:
         next = args.pop(0)
@@ -144,27 +422,90 @@ def main():
             except:
                 logging.error("failed to parse command line arguments - bad samplerate")
                 usage(1)
+        elif next == '--binary':
+            settings['transport'] = 'binary'
+        elif next == '--websocket':
+            settings['transport'] = 'websocket'
+        elif next == '--tcp':
+            settings['transport'] = 'tcp'
+        elif next == '--udp':
+            settings['transport'] = 'udp'
+        elif next == '--stream-port':
+            try:
+                settings['stream_port'] = int(args.pop(0))
+            except:
+                logging.error("failed to parse command line arguments - bad stream port")
+                usage(1)
+        elif next == '--udp-port':
+            try:
+                settings['udp_port'] = int(args.pop(0))
+            except:
+                logging.error("failed to parse command line arguments - bad udp port")
+                usage(1)
         elif next == '-s' or next == '--source':
             try:
                 settings['source'] = args.pop(0)
             except:
                 logging.error("failed to parse command line arguments - no source given")
                 usage(1)
+        elif next in ('--file', '--generate', '--pipe'):
+            try:
+                virtual = (next, args.pop(0))
+            except:
+                logging.error(f"failed to parse command line arguments - {next} needs an argument")
+                usage(1)
+        elif next == '--format':
+            try:
+                virtual_options['format'] = args.pop(0)
+                assert virtual_options['format'] in RAW_FORMATS
+            except:
+                logging.error(f"failed to parse command line arguments - format must be one of {list(RAW_FORMATS)}")
+                usage(1)
+        elif next == '--channels':
+            try:
+                virtual_options['channels'] = int(args.pop(0))
+            except:
+                logging.error("failed to parse command line arguments - bad channels")
+                usage(1)
+        elif next == '--fast':
+            virtual_options['realtime'] = False
+        elif next == '--loop':
+            virtual_options['loop'] = True
+        elif next == '-h' or next == '--help':
+            usage(0)
         else:
             usage(1)
+
+    if virtual is not None:
+        try:
+            mic = virtual_microphone(*virtual, settings, virtual_options)
+        except (OSError, ValueError) as error:
+            logging.error(f"could not open {virtual[1]}: {error}")
+            return
+        # the only mic there is, whatever the server asks for
+        settings['mics'] = {mic.id: mic.name}
+        settings['source'] = mic.id
+        get_microphone = lambda source, include_loopback: mic
+    else:
+        # only needed to record, so the senders can be imported without a sound card (testing/transport_benchmark.py)
+        import soundcard as sc
+        settings['mics'] = {m.id: m.name for m in sc.all_microphones(include_loopback=settings['loopback'])}
+        if settings['source'] is None:
+            settings['source'] = sc.default_microphone().id
+        get_microphone = sc.get_microphone
     
     if not send_settings(DOCKER_IP, settings):
         return
         
     while True:
-        chosen_mic = sc.get_microphone(settings['source'], include_loopback=settings['loopback'])
+        chosen_mic = get_microphone(settings['source'], include_loopback=settings['loopback'])
         # send_audio should block
         if not send_audio(chosen_mic, DOCKER_IP, settings):
             return
         
         # if send_audio stopped and returned true then the settings need to be
-        # updated
-        if not update_settings(DOCKER_IP, settings):
+        # updated (push transports already got them from the server)
+        if settings['transport'] not in PUSH_TRANSPORTS and not update_settings(DOCKER_IP, settings):
             return
 
 
@@ -17,6 +17,7 @@ Tasks:
 [TODO] make sure we are asking to keep the connection alive
 [TODO] check if we actually need shlex
 [DONE] update try/except statements to only catch the specific error that might happen
+[DONE] send the outputs that are ready at the same time in one request (/general_bulk)
 
 
 Passing in commands:
@@ -56,8 +57,12 @@ running = True
 session = requests.Session()
 session.verify = True
 # TODO: quality of life: multicast server detection
-# http://0.0.0.0:8000/general_in
+# http://0.0.0.0:8000/general_bulk
 DOCKER_IP="http://127.0.0.1:8000/"
+# outputs that come in within this many seconds of each other are sent in one request
+COALESCE_WINDOW = 0.05
+# key -> (output, type) waiting for the next send
+pending_updates = dict()
 
 
 def usage(return_val: int):
@@ -92,29 +97,51 @@ async def command_thread(key, sleep_period, command,  command_type) -> bool:
     """
     Thread that processes a given command.
 
-    Calls the command, sends it to the server, and sleeps for the specified time
+    Calls the command, queues the output for send_thread, and sleeps for the specified time
 
     Returns a boolean - true if the process was killed normally, false if the process ended
     prematurely (e.g. if the server did not respond)
     """
-    global running
     while running:
         result = process_command(command)
-        jresult = {
-            key: result,
-            'type': command_type
-        }
-        try:
-            # at the moment, we ignore the response
-            # might be interesting to let the server add/remove commands but for now
-            # that is not an option
-            _ = session.post(DOCKER_IP + 'general_in', json=jresult)
-            logging.debug(f"sent: {jresult}")
-        except requests.exceptions.ConnectionError:
-            logging.warning("The server did not respond, exiting...")
-            running = False
-            return False
+        # a newer output replaces one that was not sent yet
+        pending_updates[key] = (result, command_type)
         await asyncio.sleep(sleep_period)
+    return running
+
+async def send_thread() -> bool:
+    """
+    Thread that sends the queued outputs to the server
+
+    Every COALESCE_WINDOW seconds everything that is waiting goes out in one /general_bulk request
+    (one per type), so the number of requests depends on how often commands are due, not on how many keys there are
+
+    Returns false if the server did not respond
+    """
+    global running
+    while running:
+        await asyncio.sleep(COALESCE_WINDOW)
+        if not pending_updates:
+            continue
+        by_type = dict()
+        for key, (result, command_type) in pending_updates.items():
+            by_type.setdefault(command_type, dict())[key] = result
+        pending_updates.clear()
+        for command_type, values in by_type.items():
+            jresult = {
+                'values': values,
+                'type': command_type
+            }
+            try:
+                # at the moment, we ignore the response
+                # might be interesting to let the server add/remove commands but for now
+                # that is not an option
+                _ = session.post(DOCKER_IP + 'general_bulk', json=jresult)
+                logging.debug(f"sent: {jresult}")
+            except requests.exceptions.ConnectionError:
+                logging.warning("The server did not respond, exiting...")
+                running = False
+                return False
     return True
 
 def parse_file(file: str) -> dict:
@@ -201,7 +228,7 @@ async def main():
 
 
     async with asyncio.TaskGroup() as tg:
-        tasks = []
+        tasks = [send_thread()]
         for key in commands:
             sleep_period, output_type, command = commands[key]
             tasks.append(command_thread(key, sleep_period, command, output_type))
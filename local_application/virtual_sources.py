@@ -0,0 +1,247 @@
+"""
+Capture sources that are not a sound card, for running the client headless (tests, benchmarks, soak runs)
+
+Each one looks like a soundcard microphone as far as local_audio_client.py is concerned:
+    mic.id, mic.name
+    with mic.recorder(samplerate=48000, blocksize=1024) as recorder:
+        block = recorder.record(numframes=None)   # (frames, channels) float32 in [-1, 1]
+        recorder.latency                          # seconds, always 0 here
+
+    FileMicrophone: a WAV file (16/32 bit PCM) or raw PCM file, paced like a real mic or as fast as possible
+    GeneratorMicrophone: tones, noise and clicks, e.g. "tone:440,noise:0.05,click:0.5"
+    PipeMicrophone: raw PCM from stdin or a FIFO, paced by whatever writes it, e.g.
+        sox -d -r 48k -c 2 -b 32 -e signed-integer -t raw - | python local_audio_client.py --pipe - --format int32 --channels 2
+
+record() raises EOFError once a file (without loop) or pipe runs out.
+"""
+import abc
+import math
+import sys
+import time
+import wave
+
+import numpy as np
+
+# raw PCM formats: name -> (dtype, value that counts as full scale)
+RAW_FORMATS = {
+    'float32': (np.float32, 1.0),
+    'int16': (np.int16, 32768.0),
+    'int32': (np.int32, 2147483648.0),
+}
+
+
+class VirtualRecorder(abc.ABC):
+    """
+    Base of the recorders, subclasses implement read(frames) -> (frames, channels) float32
+
+    realtime: record() waits until the block would have been recorded, like a sound card does
+    """
+    latency = 0.0
+
+    def __init__(self, samplerate: int, blocksize: int, channels: int, realtime: bool = True):
+        self.samplerate = samplerate
+        self.blocksize = blocksize
+        self.channels = channels
+        self.realtime = realtime
+        self.start = None
+        self.frames = 0
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        pass
+
+    def record(self, numframes: int = None):
+        frames = numframes or self.blocksize
+        block = self.read(frames)
+        self.frames += len(block)
+        if self.realtime:
+            delay = self.start + self.frames / self.samplerate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        return block
+
+    @abc.abstractmethod
+    def read(self, frames: int):
+        """
+        Up to frames frames as (frames, channels) float32, raises EOFError when there is nothing left
+        """
+
+
+class VirtualMicrophone(abc.ABC):
+    def __init__(self, id: str, name: str):
+        self.id = id
+        self.name = name
+
+    @abc.abstractmethod
+    def recorder(self, samplerate: int, blocksize: int = None) -> VirtualRecorder:
+        """
+        A recorder to use in a with block, like soundcard's
+        """
+
+
+class FileRecorder(VirtualRecorder):
+    def __init__(self, samples, samplerate: int, blocksize: int, realtime: bool, loop: bool):
+        super().__init__(samplerate, blocksize, samples.shape[1], realtime)
+        self.samples = samples
+        self.loop = loop
+        self.position = 0
+
+    def read(self, frames: int):
+        if self.position >= len(self.samples):
+            if not self.loop or len(self.samples) == 0:
+                raise EOFError("end of the audio file")
+            self.position = 0
+        block = self.samples[self.position:self.position + frames]
+        self.position += len(block)
+        return block
+
+
+class FileMicrophone(VirtualMicrophone):
+    def __init__(self, path: str, format: str = 'float32', channels: int = 1, samplerate: int = 48000,
+                 realtime: bool = True, loop: bool = False):
+        """
+        path: a .wav file (its own format, channels and samplerate are used) or raw interleaved PCM
+        format, channels, samplerate: describe a raw file
+        """
+        super().__init__(f"file:{path}", f"file {path}")
+        if path.lower().endswith(".wav"):
+            self.samples, self.samplerate = read_wav(path)
+        else:
+            dtype, full_scale = RAW_FORMATS[format]
+            samples = np.fromfile(path, dtype=dtype)
+            samples = samples[:len(samples) // channels * channels].reshape(-1, channels)
+            self.samples = (samples / full_scale).astype(np.float32)
+            self.samplerate = samplerate
+        self.realtime = realtime
+        self.loop = loop
+
+    def recorder(self, samplerate: int, blocksize: int = None) -> FileRecorder:
+        # the file is played at its own rate, the client takes its samplerate from the mic (see main)
+        return FileRecorder(self.samples, self.samplerate, blocksize or 1024, self.realtime, self.loop)
+
+
+def read_wav(path: str) -> tuple:
+    """
+    (samples as (frames, channels) float32 in [-1, 1], samplerate) of a 16/32 bit PCM wav file
+    """
+    with wave.open(path, 'rb') as file:
+        width = file.getsampwidth()
+        channels = file.getnchannels()
+        samplerate = file.getframerate()
+        data = file.readframes(file.getnframes())
+    if width == 2:
+        samples = np.frombuffer(data, dtype=np.int16) / 32768.0
+    elif width == 4:
+        samples = np.frombuffer(data, dtype=np.int32) / 2147483648.0
+    else:
+        raise ValueError(f"{path}: only 16 and 32 bit samples are supported, not {8 * width} bit")
+    return samples.reshape(-1, channels).astype(np.float32), samplerate
+
+
+class GeneratorRecorder(VirtualRecorder):
+    def __init__(self, parts: list, samplerate: int, blocksize: int, channels: int, realtime: bool):
+        super().__init__(samplerate, blocksize, channels, realtime)
+        self.parts = parts
+        self.rng = np.random.default_rng(0)
+
+    def read(self, frames: int):
+        # sample index since the start, so tones and clicks carry on across blocks
+        t = (self.frames + np.arange(frames)) / self.samplerate
+        mono = np.zeros(frames)
+        for kind, value in self.parts:
+            if kind == 'tone':
+                mono += 0.3 * np.sin(2 * np.pi * value * t)
+            elif kind == 'noise':
+                mono += value * self.rng.standard_normal(frames)
+            elif kind == 'click':
+                # decaying click at the start of every interval
+                since = np.mod(t, value)
+                mono += 0.6 * np.exp(-since / 0.002) * (since < 0.01)
+        mono = np.clip(mono, -1.0, 1.0).astype(np.float32)
+        return np.repeat(mono[:, None], self.channels, axis=1)
+
+
+class GeneratorMicrophone(VirtualMicrophone):
+    # default values of each part
+    PARTS = {'tone': 440.0, 'noise': 0.05, 'click': 0.5}
+
+    def __init__(self, spec: str, channels: int = 1, realtime: bool = True):
+        """
+        spec: comma separated parts, each kind[:value]
+            tone:<Hz>, noise:<amplitude>, click:<seconds between clicks>
+        """
+        super().__init__(f"generator:{spec}", f"generator {spec}")
+        self.parts = parse_generator(spec)
+        self.channels = channels
+        self.realtime = realtime
+
+    def recorder(self, samplerate: int, blocksize: int = None) -> GeneratorRecorder:
+        return GeneratorRecorder(self.parts, samplerate, blocksize or 1024, self.channels, self.realtime)
+
+
+def parse_generator(spec: str) -> list:
+    """
+    [(kind, value)] of a generator spec, raises ValueError if it makes no sense
+    """
+    parts = []
+    for part in spec.split(","):
+        kind, _, value = part.strip().partition(":")
+        if kind not in GeneratorMicrophone.PARTS:
+            raise ValueError(f"unknown generator {kind!r}, expected some of {list(GeneratorMicrophone.PARTS)}")
+        value = float(value) if value else GeneratorMicrophone.PARTS[kind]
+        if not math.isfinite(value) or value <= 0:
+            raise ValueError(f"{kind} needs a positive value, not {value}")
+        parts.append((kind, value))
+    return parts
+
+
+class PipeRecorder(VirtualRecorder):
+    def __init__(self, stream, dtype, full_scale: float, samplerate: int, blocksize: int, channels: int):
+        # the writer sets the pace (sox records in real time), no waiting here
+        super().__init__(samplerate, blocksize, channels, realtime=False)
+        self.stream = stream
+        self.dtype = np.dtype(dtype)
+        self.full_scale = full_scale
+
+    def read(self, frames: int):
+        frame_size = self.channels * self.dtype.itemsize
+        size = frames * frame_size
+        data = bytearray()
+        # a pipe hands out whatever is there, keep reading until the block is full
+        while len(data) < size:
+            more = self.stream.read(size - len(data))
+            if not more:
+                if len(data) < frame_size:
+                    raise EOFError("the pipe was closed")
+                # what is left, like the last block of a file
+                del data[len(data) // frame_size * frame_size:]
+                break
+            data.extend(more)
+        samples = np.frombuffer(bytes(data), dtype=self.dtype).reshape(-1, self.channels)
+        return (samples / self.full_scale).astype(np.float32)
+
+    def close(self):
+        if self.stream is not sys.stdin.buffer:
+            self.stream.close()
+
+
+class PipeMicrophone(VirtualMicrophone):
+    def __init__(self, path: str, format: str = 'float32', channels: int = 1):
+        """
+        path: a FIFO (or any file that is written as it is read), '-' for stdin
+        """
+        super().__init__(f"pipe:{path}", "stdin" if path == '-' else f"pipe {path}")
+        self.path = path
+        self.dtype, self.full_scale = RAW_FORMATS[format]
+        self.channels = channels
+
+    def recorder(self, samplerate: int, blocksize: int = None) -> PipeRecorder:
+        # opened here: opening a FIFO blocks until somebody opens the other end
+        stream = sys.stdin.buffer if self.path == '-' else open(self.path, 'rb', buffering=0)
+        return PipeRecorder(stream, self.dtype, self.full_scale, samplerate, blocksize or 1024, self.channels)
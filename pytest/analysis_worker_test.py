@@ -0,0 +1,32 @@
+# tests for the analysis worker process
+import queue
+
+import numpy as np
+
+from analysis_worker import AnalysisWorker
+import flask_server
+
+
+def test_worker_analyses_chunks_in_order():
+    records = queue.Queue()
+    config = dict(flask_server.flask_app.config, ANALYSIS_WARM_UP=False, ANALYSIS_WORKER_FEATURES=['rms', 'bands', 'pulse'])
+    worker = AnalysisWorker(config, records.put, slots=8, chunk_size=4096 * 2)
+    worker.start()
+    try:
+        sine = np.sin(2 * np.pi * 1000 * np.arange(1024) / 48000)
+        for seq in range(5):
+            chunk = (sine * 16384).astype(np.int16)
+            assert worker.submit(chunk, seq, 1, 48000, 32768.0, 100.0 + seq)
+        # too big for a slot
+        assert not worker.submit(np.zeros(8192, dtype=np.int16), 5, 1, 48000, 32768.0, 105.0)
+        received = [records.get(timeout=30) for _ in range(5)]
+    finally:
+        worker.stop()
+    assert [record.seq for record in received] == list(range(5))
+    record = received[-1]
+    assert record['received'] == 104.0
+    assert abs(record['rms'] - 0.5 / np.sqrt(2)) < 0.01
+    assert abs(record['peak'] - 0.5) < 0.01
+    assert len(record['bands']) == flask_server.flask_app.config['FFT_BANDS']
+    assert 'bpm' in record['pulse']
+    assert record['centroid'] is None
@@ -0,0 +1,82 @@
+# tests for the asgi entry point, run against a real uvicorn server
+import socket
+import threading
+import time
+
+import numpy as np
+import pytest
+import requests
+import uvicorn
+
+import asgi_server
+import flask_server
+
+
+@pytest.fixture(scope="module")
+def base_url():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(asgi_server.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.time() + 5
+    while not server.started and time.time() < deadline:
+        time.sleep(0.01)
+    yield f"http://127.0.0.1:{port}/"
+    server.should_exit = True
+    thread.join(5)
+
+
+def test_flask_routes_and_keep_alive(base_url):
+    with requests.Session() as session:
+        for _ in range(3):
+            response = session.get(base_url + "general_keys")
+            assert response.status_code == 200
+            assert response.json() == {"keys": list(flask_server.general_data)}
+        assert response.headers.get("connection", "keep-alive").lower() != "close"
+
+
+def test_binary_ingest_and_stream(base_url):
+    with requests.get(base_url + "audio_stream", stream=True, timeout=5) as stream:
+        lines = (line for line in stream.iter_lines() if line)
+        assert next(lines).startswith(b"retry:")
+        while len(flask_server.audio_hub) == 0:
+            time.sleep(0.01)
+        before = flask_server.audio_seq
+        samples = np.full(1024, 0.5, dtype=np.float32)
+        response = requests.post(base_url + "audio_in/binary", data=samples.tobytes(), headers={"X-Audio-Seq": "1"})
+        assert response.status_code == 200
+        assert "bars" in response.json()
+        assert flask_server.audio_seq == before + 1
+        assert next(lines) == b"event: audio"
+        assert next(lines) == b"id: %d" % flask_server.audio_seq
+    deadline = time.time() + 5
+    while len(flask_server.audio_hub) and time.time() < deadline:
+        time.sleep(0.01)
+    assert len(flask_server.audio_hub) == 0
+
+
+def test_general_changes_polls_do_not_hold_the_worker_threads(base_url):
+    version = flask_server.general_data.version
+    # more waiting polls than there are threads for the flask routes
+    polls = asgi_server.flask_app.config['ASGI_WSGI_WORKERS'] + 4
+    results = [None] * polls
+
+    def poll(index):
+        results[index] = requests.get(base_url + "general_changes", params={"since": version, "timeout": 5},
+                                      timeout=10).json()
+
+    threads = [threading.Thread(target=poll, args=(index,)) for index in range(polls)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.2)
+    # a flask route still gets a thread, and its write wakes up every poll
+    response = requests.post(base_url + "general_in", json={"type": "int", "asgi_poll": 7}, timeout=2)
+    assert response.status_code == 200
+    for thread in threads:
+        thread.join(5)
+    assert all(result is not None and result["changes"] == {"asgi_poll": 7} for result in results)
+
+    response = requests.get(base_url + "general_changes", params={"since": results[0]["version"], "timeout": 0.05})
+    assert response.json() == {"version": results[0]["version"], "changes": {}}
@@ -0,0 +1,40 @@
+# tests for the fft band engine
+import numpy as np
+import pytest
+
+from band_analysis import band_energies, band_layout
+
+
+@pytest.mark.parametrize("blocksize", [1000, 1024, 2048, 441])
+def test_any_blocksize(blocksize):
+    bands = band_energies(np.random.default_rng(0).standard_normal(blocksize), 48000)
+    assert bands.shape == (8,)
+
+
+def test_tone_lands_in_the_right_band():
+    samplerate = 48000
+    t = np.arange(2048) / samplerate
+    for freq, expected in ((60, 0), (15000, 7)):
+        bands = band_energies(np.sin(2 * np.pi * freq * t), samplerate)
+        assert np.argmax(bands) == expected
+
+
+def test_full_scale_sine_is_about_one():
+    samplerate = 48000
+    t = np.arange(4096) / samplerate
+    # exactly on bin 85, and the only bin in the band
+    freq = 85 * samplerate / 4096
+    bands = band_energies(np.sin(2 * np.pi * freq * t), samplerate, num_bands=1, fmin=freq - 1, fmax=freq + 1)
+    assert bands[0] == pytest.approx(1.0, rel=0.1)
+
+
+@pytest.mark.parametrize("scale", ["log", "mel"])
+def test_every_band_has_a_bin(scale):
+    _, starts, stop, counts, _ = band_layout(256, 48000, 16, 20.0, 20000.0, scale)
+    assert np.all(np.diff(starts) >= 1)
+    assert stop > starts[-1]
+    assert np.all(counts >= 1)
+
+
+def test_layout_is_cached():
+    assert band_layout(2048, 48000) is band_layout(2048, 48000)
@@ -0,0 +1,48 @@
+# tests for the broadcast hub behind /audio_stream
+import json
+import queue
+
+import pytest
+
+from broadcast import BroadcastHub, sse_frame
+
+
+def test_sse_frame():
+    assert sse_frame({"a": 1}, event="audio", id=3) == b'event: audio\nid: 3\ndata: {"a":1}\n\n'
+
+
+def test_publish_reaches_every_subscriber():
+    hub = BroadcastHub()
+    first, second = hub.subscribe(), hub.subscribe()
+    assert hub.publish({"seq": 1}) == 2
+    assert first.get(timeout=1) == second.get(timeout=1)
+    hub.unsubscribe(first)
+    assert hub.publish({"seq": 2}) == 1
+
+
+def test_slow_subscriber_only_keeps_the_latest_frames():
+    hub = BroadcastHub(queue_size=2)
+    subscriber = hub.subscribe()
+    for seq in range(10):
+        hub.publish({"seq": seq})
+    assert subscriber.dropped == 8
+    frames = [subscriber.get(timeout=1), subscriber.get(timeout=1)]
+    assert [json.loads(frame.split(b"data: ")[1]) for frame in frames] == [{"seq": 8}, {"seq": 9}]
+    # still counted after it leaves
+    hub.unsubscribe(subscriber)
+    assert hub.dropped() == 8
+    with pytest.raises(queue.Empty):
+        subscriber.get(timeout=0)
+
+
+def test_no_subscribers_no_work():
+    assert BroadcastHub().publish({"seq": 1}) == 0
+
+
+def test_publish_many_takes_one_mailbox_slot():
+    hub = BroadcastHub(queue_size=1)
+    subscriber = hub.subscribe()
+    hub.publish_many([({"seq": 1}, "audio", 1), ({"id": 1}, "onset", None)])
+    frame = subscriber.get(timeout=1)
+    assert frame == sse_frame({"seq": 1}, "audio", 1) + sse_frame({"id": 1}, "onset")
+    assert subscriber.dropped == 0
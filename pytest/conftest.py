@@ -0,0 +1,13 @@
+# the server modules live in src/ and import each other by name
+# (flask --app src/flask_server puts src/ on the path), so do the same for the tests
+import os
+import sys
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO, "src"))
+# same for the capture client's modules (virtual_sources.py)
+sys.path.insert(1, os.path.join(REPO, "local_application"))
+
+# tests start the socket listeners they need themselves, on free ports
+os.environ.setdefault("FLASK_STREAM_INGEST_PORT", "0")
+os.environ.setdefault("FLASK_UDP_INGEST_PORT", "0")
@@ -0,0 +1,93 @@
+# tests for the per-chunk feature pipeline
+import numpy as np
+import pytest
+
+from feature_pipeline import FeaturePipeline, add_standard_stages
+
+
+def sine(freq: float, samplerate: int = 48000, blocksize: int = 4096):
+    return np.sin(2 * np.pi * freq * np.arange(blocksize) / samplerate).astype(np.float32)
+
+
+def run(pipeline, chunk, seq: int = 1, **known):
+    record = pipeline.run(seq, known or None, chunk=chunk, mono=chunk, samplerate=48000, channels=1,
+                          full_scale=1.0, received=0.0)
+    return pipeline.finish(record)
+
+
+def test_shared_intermediates_are_computed_once():
+    pipeline = FeaturePipeline()
+    add_standard_stages(pipeline)
+    calls = []
+    inputs, compute = pipeline.intermediates['spectrum']
+    pipeline.add_intermediate('spectrum', inputs, lambda *args: calls.append(1) or compute(*args))
+    pipeline.subscribe('centroid', 'rolloff', 'flatness')
+    record = run(pipeline, sine(1000))
+    assert len(calls) == 1
+    # asking again, or for something else that needs the spectrum, does not redo it
+    record['centroid']
+    record['magnitude']
+    assert len(calls) == 1
+
+
+def test_only_subscribed_stages_run_the_rest_on_request():
+    pipeline = FeaturePipeline()
+    add_standard_stages(pipeline)
+    pipeline.subscribe('rms')
+    record = run(pipeline, sine(1000))
+    assert 'rms' in record
+    assert 'centroid' not in record
+    assert 'spectrum' not in record.inputs
+    assert record['centroid'] == pytest.approx(1000, rel=0.02)
+    assert 'centroid' in record
+    pipeline.unsubscribe('rms')
+    assert pipeline.subscribed() == []
+
+
+def test_stateful_stages_only_run_at_ingest():
+    pipeline = FeaturePipeline()
+    chunks = []
+    pipeline.add_stage('count', ('chunk',), lambda chunk: chunks.append(chunk) or len(chunks), stateful=True)
+    assert run(pipeline, sine(1000))['count'] is None
+    pipeline.subscribe('count')
+    assert run(pipeline, sine(1000))['count'] == 1
+    assert len(chunks) == 1
+
+
+def test_known_values_are_not_recomputed():
+    pipeline = FeaturePipeline()
+    add_standard_stages(pipeline)
+    pipeline.subscribe('peak', 'avg')
+    record = run(pipeline, sine(1000), peak=0.25, avg=0.125)
+    assert (record['peak'], record['avg']) == (0.25, 0.125)
+    assert 'abs' not in record.inputs
+
+
+def test_feature_values():
+    pipeline = FeaturePipeline()
+    add_standard_stages(pipeline)
+    tone = run(pipeline, sine(3000))
+    noise = run(pipeline, np.random.default_rng(0).uniform(-1, 1, 4096).astype(np.float32))
+    assert tone['rms'] == pytest.approx(np.sqrt(0.5), rel=0.01)
+    assert tone['peak'] == pytest.approx(1.0, rel=0.01)
+    assert tone['rolloff'] == pytest.approx(3000, rel=0.02)
+    assert tone['flatness'] < 0.05 < noise['flatness']
+    assert noise['centroid'] == pytest.approx(12000, rel=0.1)
+
+
+def test_empty_chunk():
+    pipeline = FeaturePipeline()
+    add_standard_stages(pipeline)
+    record = run(pipeline, np.zeros(0, dtype=np.float32))
+    assert record.as_dict(['rms', 'peak', 'avg', 'centroid', 'rolloff', 'flatness']) == {
+        'rms': 0.0, 'peak': 0.0, 'avg': 0.0, 'centroid': 0.0, 'rolloff': 0.0, 'flatness': 0.0}
+
+
+def test_full_scale_int16():
+    pipeline = FeaturePipeline()
+    add_standard_stages(pipeline)
+    chunk = np.array([-32768, 0, 16384, -16384], dtype=np.int16)
+    record = pipeline.finish(pipeline.run(1, None, chunk=chunk, mono=chunk / 32768.0, samplerate=48000,
+                                          channels=1, full_scale=32768.0, received=0.0))
+    assert record['peak'] == 1.0
+    assert record['avg'] == 0.5
@@ -0,0 +1,296 @@
+# tests for the flask server routes
+# test funcs must always start with test_
+import json
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import flask_server
+
+
+@pytest.fixture
+def client():
+    flask_server.flask_app.config['TESTING'] = True
+    return flask_server.flask_app.test_client()
+
+
+def test_audio_in_json(client):
+    payload = {"avg": 0.25, "peak": 0.5, "data": [[0.5], [-0.25], [0.0], [0.5]]}
+    response = client.post("/audio_in", json=payload)
+    assert response.status_code == 200
+    assert response.json['bars'] == "#" * 12 + "-" * 12
+    assert flask_server.audio_snapshot.chunk.shape == (4,)
+
+
+def test_audio_in_binary_float32(client):
+    samples = np.array([0.5, -1.0, 0.25, 0.0], dtype=np.float32)
+    before = flask_server.audio_seq
+    response = client.post("/audio_in/binary", data=samples.tobytes(), headers={
+        "X-Audio-Dtype": "float32",
+        "X-Audio-Channels": "2",
+        "X-Audio-Samplerate": "44100",
+        "X-Audio-Seq": "7",
+        "X-Audio-Source": "test mic",
+    })
+    assert response.status_code == 200
+    assert flask_server.audio_seq == before + 1
+    assert flask_server.audio_snapshot.channels == 2
+    assert flask_server.audio_snapshot.samplerate == 44100
+    np.testing.assert_array_equal(flask_server.audio_snapshot.chunk, samples)
+    assert flask_server.audio_snapshot.raw_max == 1.0
+
+    response = client.get("/audio_in")
+    assert response.json['source'] == "test mic"
+
+
+def test_audio_in_binary_int16_is_normalized(client):
+    samples = np.array([16384, -16384], dtype=np.int16)
+    response = client.post("/audio_in/binary", data=samples.tobytes(), headers={"X-Audio-Dtype": "int16"})
+    assert response.status_code == 200
+    assert flask_server.audio_snapshot.raw_max == 0.5
+
+
+def test_audio_in_binary_rejects_bad_bodies(client):
+    assert client.post("/audio_in/binary", data=b"\x00" * 4, headers={"X-Audio-Dtype": "float64"}).status_code == 400
+    assert client.post("/audio_in/binary", data=b"\x00" * 6, headers={"X-Audio-Dtype": "float32"}).status_code == 400
+
+
+def test_audio_history_is_mono_and_normalized(client):
+    samples = np.array([16384, 0, -16384, -16384], dtype=np.int16)
+    response = client.post("/audio_in/binary", data=samples.tobytes(), headers={
+        "X-Audio-Dtype": "int16",
+        "X-Audio-Channels": "2",
+    })
+    assert response.status_code == 200
+    np.testing.assert_allclose(flask_server.audio_history.latest(2), [0.25, -0.5])
+    assert flask_server.audio_stats.latest(1)[0, 1] == 0.5
+
+
+def test_tempo_follows_the_binary_audio(client):
+    samplerate = 48000
+    samples = np.random.default_rng(0).normal(0, 0.01, 10 * samplerate).astype(np.float32)
+    click = np.sin(np.arange(400) * 0.3) * np.exp(-np.arange(400) / 80)
+    for start in range(0, len(samples) - 400, samplerate // 2):
+        samples[start:start + 400] += click
+    for start in range(0, len(samples), 1024):
+        client.post("/audio_in/binary", data=samples[start:start + 1024].tobytes(),
+                    headers={"X-Audio-Dtype": "float32", "X-Audio-Samplerate": str(samplerate)})
+    response = client.get("/tempo")
+    assert response.status_code == 200
+    assert response.json['bpm'] == pytest.approx(120, rel=0.02)
+
+
+def test_onsets_are_polled_and_streamed(client):
+    samples = np.random.default_rng(0).normal(0, 0.01, 48000).astype(np.float32)
+    samples[30000:32000] += np.sin(np.arange(2000) * 0.3) * np.exp(-np.arange(2000) / 300)
+    since = client.get("/onsets").json['last']
+    response = client.get("/audio_stream")
+    events = iter(response.response)
+    next(events)
+    streamed = []
+    for start in range(0, len(samples), 1024):
+        client.post("/audio_in/binary", data=samples[start:start + 1024].tobytes(),
+                    headers={"X-Audio-Dtype": "float32", "X-Audio-Samplerate": "48000"})
+        frame = next(events)
+        if b"event: onset" in frame:
+            streamed.append(json.loads(frame.split(b"event: onset\n")[1].split(b"data: ")[1]))
+    response.close()
+
+    polled = client.get("/onsets", query_string={"since": since}).json
+    assert len(polled['onsets']) == 1
+    assert polled['onsets'][0]['id'] == polled['last']
+    assert streamed == polled['onsets']
+    assert client.get("/onsets", query_string={"since": polled['last']}).json['onsets'] == []
+
+
+def test_fft_is_computed_once_per_chunk(client, monkeypatch):
+    calls = []
+    inputs, compute, stateful = flask_server.features.stages['bands']
+    monkeypatch.setitem(flask_server.features.stages, 'bands',
+                        (inputs, lambda *args: calls.append(1) or compute(*args), stateful))
+    samples = np.sin(np.linspace(0, 100, 1024)).astype(np.float32)
+    client.post("/audio_in/binary", data=samples.tobytes())
+    first = client.get("/fft_audio").json
+    assert client.get("/fft_audio").json == first
+    assert len(first['frequencies']) == 8
+    assert len(calls) == 1
+    client.post("/audio_in/binary", data=samples.tobytes())
+    client.get("/fft_audio")
+    assert len(calls) == 2
+
+
+def test_features_route_reads_the_latest_record(client):
+    samples = np.sin(2 * np.pi * 1000 * np.arange(4096) / 48000).astype(np.float32)
+    client.post("/audio_in/binary", data=samples.tobytes(), headers={"X-Audio-Samplerate": "48000"})
+    response = client.get("/features", query_string={"names": "rms,centroid,bands"})
+    assert response.json['seq'] == flask_server.audio_seq
+    assert response.json['time'] == flask_server.audio_snapshot.received
+    assert response.json['rms'] == pytest.approx(np.sqrt(0.5), rel=0.01)
+    assert response.json['centroid'] == pytest.approx(1000, rel=0.02)
+    assert response.json['bands'] == client.get("/fft_audio").json['frequencies']
+    assert client.get("/features", query_string={"names": "nope"}).status_code == 400
+
+
+def test_audio_stream_pushes_one_frame_per_chunk(client):
+    response = client.get("/audio_stream")
+    assert response.mimetype == "text/event-stream"
+    events = iter(response.response)
+    # the first message subscribes
+    assert next(events).startswith(b"retry:")
+    samples = np.sin(np.linspace(0, 100, 1024)).astype(np.float32)
+    client.post("/audio_in/binary", data=samples.tobytes())
+    frame = next(events)
+    assert frame.startswith(b"event: audio\nid: %d\n" % flask_server.audio_seq)
+    data = json.loads(frame.split(b"data: ")[1])
+    assert data['seq'] == flask_server.audio_seq
+    assert len(data['frequencies']) == 8
+    response.close()
+    assert len(flask_server.audio_hub) == 0
+
+
+def test_websocket_audio_and_settings_push(client):
+    websocket = flask_server.socketio.test_client(flask_server.flask_app, namespace='/audio')
+    assert websocket.is_connected('/audio')
+    before = flask_server.audio_seq
+    websocket.emit('audio_chunk', {"dtype": "float32", "seq": 0}, np.full(256, 0.5, np.float32).tobytes(), namespace='/audio')
+    assert flask_server.audio_seq == before + 1
+    assert flask_server.audio_snapshot.raw_max == 0.5
+
+    websocket.emit('audio_chunk', {"dtype": "float32"}, b"\x00" * 3, namespace='/audio')
+    assert websocket.get_received('/audio')[0]['name'] == 'error'
+
+    client.post("/audio_settings", data={"settings": "b", "b": "512"})
+    pushed = websocket.get_received('/audio')
+    assert pushed[0]['name'] == 'settings'
+    assert pushed[0]['args'][0]['b'] == "512"
+    websocket.disconnect(namespace='/audio')
+
+
+def test_readers_never_see_a_torn_chunk(client):
+    stop = threading.Event()
+
+    def ingest():
+        level = 0.2
+        while not stop.is_set():
+            flask_server.ingest_binary(np.full(256, level, np.float32).tobytes())
+            level = 1.0 - level
+
+    writer = threading.Thread(target=ingest)
+    writer.start()
+    try:
+        for _ in range(2000):
+            snapshot = flask_server.audio_snapshot
+            assert len(snapshot.chunk) == 0 or snapshot.raw_max == float(snapshot.chunk.max())
+            assert snapshot.features is None or snapshot.features.seq == snapshot.seq
+    finally:
+        stop.set()
+        writer.join()
+    with pytest.raises(AttributeError):
+        flask_server.audio_snapshot.bars = ""
+
+
+def test_general_data_versions_and_long_poll(client):
+    response = client.post("/general_in", json={"etag test": 1, "type": "int"})
+    version = response.json['version']
+    response = client.get("/general_keys/etag test")
+    assert response.json == {"etag test": 1}
+    etag = response.headers['ETag']
+    assert client.get("/general_keys/etag test", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/general_keys/missing").status_code == 404
+
+    # nothing newer: waits for the timeout and comes back empty
+    response = client.get(f"/general_changes?since={version}&timeout=0.01")
+    assert response.json == {"version": version, "changes": {}}
+    threading.Timer(0.05, client.post, args=("/general_in",), kwargs={"json": {"etag test": 2, "type": "int"}}).start()
+    response = client.get(f"/general_changes?since={version}&timeout=5")
+    assert response.json == {"version": version + 1, "changes": {"etag test": 2}}
+    assert client.get("/general_keys/etag test", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_general_data_in_bulk(client):
+    response = client.post("/general_bulk", json={"type": "int", "values": {"bulk.cpu": 10, "bulk.gpu": 20, "other": 5}})
+    version = response.json['version']
+    assert client.get("/general_keys/bulk.gpu").json == {"bulk.gpu": 20}
+
+    response = client.get("/general_bulk?prefix=bulk.")
+    assert response.json == {"version": version, "values": {"bulk.cpu": 10, "bulk.gpu": 20}}
+    response = client.get("/general_bulk?keys=other,missing")
+    assert response.json['values'] == {"other": 5}
+    assert client.post("/general_bulk", json={"bulk.cpu": 1}).status_code == 400
+
+
+def test_general_history_route(client):
+    for value in (10, 20, 30):
+        client.post("/general_in", json={"history test": value, "type": "int"})
+    response = client.get("/general_history/history test?resolution=60")
+    assert response.json['key'] == "history test"
+    assert sum(response.json['count']) == 3
+    assert min(response.json['min']) == 10 and max(response.json['max']) == 30
+    assert client.get("/general_history/history test?start=0&end=100000&resolution=1").status_code == 400
+    assert client.get("/general_history/missing").status_code == 404
+
+
+def test_metrics(client):
+    samples = np.array([0.5, -0.5], dtype=np.float32)
+    before = flask_server.chunks_received.value
+    assert client.post("/audio_in/binary", data=samples.tobytes()).status_code == 200
+    assert client.get("/general_keys/nothing_here").status_code == 404
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    text = response.get_data(as_text=True)
+    assert f"audio_chunks_received_total {before + 1}\n" in text
+    assert 'http_request_seconds_count{route="/audio_in/binary"}' in text
+    # by rule, not by path
+    assert 'http_request_seconds_count{route="/general_keys/<string:key>"}' in text
+    assert 'audio_ingest_seconds_count{stage="decode"}' in text
+    assert 'feature_seconds_count{feature="peak"}' in text
+    assert 'ring_buffer_fill{ring="audio_stats"}' in text
+
+
+def test_latency_breakdown(client, monkeypatch):
+    monkeypatch.setattr(flask_server, "latency", flask_server.LatencyTracker())
+    monkeypatch.setattr(flask_server, "LATENCY_ACK_EVERY", 1)
+    subscriber = flask_server.audio_hub.subscribe()
+    try:
+        samples = np.zeros(480, dtype=np.float32)
+        response = client.post("/audio_in/binary", data=samples.tobytes(), headers={
+            "X-Audio-Samplerate": "48000",
+            "X-Audio-Source": "latency mic",
+            "X-Audio-Capture-Time": repr(time.time() - 0.01),
+        })
+        assert response.status_code == 200
+        frame = json.loads(subscriber.get(timeout=1).split(b"data: ")[1].split(b"\n")[0])
+        assert frame["ack"]
+    finally:
+        flask_server.audio_hub.unsubscribe(subscriber)
+    # sent as text/plain by the frontend
+    response = client.post("/audio_ack", data=json.dumps({"seq": frame["seq"]}), content_type="text/plain")
+    assert response.json == {"known": True}
+    assert client.post("/audio_ack", data="nope").status_code == 400
+
+    breakdown = client.get("/latency").json["latency mic"]
+    assert breakdown["block"]["p50"] == pytest.approx(0.01)
+    assert breakdown["transport"]["p50"] >= 0.01
+    assert set(breakdown) == {"block", "transport", "analysis", "delivery", "total"}
+
+
+def test_missed_chunks_are_counted_per_source(client):
+    samples = np.zeros(16, dtype=np.float32).tobytes()
+
+    def post(source, seq):
+        response = client.post("/audio_in/binary", data=samples, headers={"X-Audio-Seq": str(seq),
+                                                                           "X-Audio-Source": source})
+        assert response.status_code == 200
+
+    before = flask_server.chunks_missed.value
+    # two clients interleaved, neither misses anything
+    for seq in range(5):
+        post("missed a", seq)
+        post("missed b", 1000 + seq)
+    # a restart numbers from 0 again, then one chunk of b goes missing
+    post("missed a", 0)
+    post("missed b", 1006)
+    assert flask_server.chunks_missed.value == before + 1
@@ -0,0 +1,33 @@
+# tests for the general data time series
+import numpy as np
+
+from general_history import GeneralHistory
+
+
+def test_buckets_from_raw_values():
+    history = GeneralHistory()
+    history.record({"cpu": 10, "name": "not a number"}, 100.2)
+    history.record({"cpu": "30"}, 100.7)
+    history.record({"cpu": 20}, 101.5)
+    assert "name" not in history
+    buckets = history.query("cpu", 100, 102, 1)
+    assert buckets == {"time": [100, 101], "min": [10, 20], "max": [30, 20], "mean": [20, 20], "count": [2, 1]}
+
+
+def test_long_ranges_come_from_the_coarse_tiers():
+    history = GeneralHistory(raw=64, tiers=((1, 60), (10, 60), (60, 60)))
+    # an hour of one value a second, the raw values and 1s buckets only have the last minute
+    times = np.arange(3600.0)
+    for when in times:
+        history.record({"temp": when % 100}, when)
+    series = history.series["temp"]
+    assert history.pick_tier(series, 3590, 0.5) == -1
+    assert history.pick_tier(series, 3590, 1) == 0
+    assert history.pick_tier(series, 3000, 1) == 1
+    assert history.pick_tier(series, 0, 600) == 2
+    buckets = history.query("temp", 0, 3600, 600)
+    assert buckets["time"] == [0, 600, 1200, 1800, 2400, 3000]
+    assert buckets["count"] == [600] * 6
+    assert buckets["min"][0] == 0 and buckets["max"][0] == 99
+    # memory stays the same however long it runs
+    assert len(series.raw) == 64 and all(len(ring) == 60 for _, ring in series.tiers[:2])
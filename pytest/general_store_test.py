@@ -0,0 +1,33 @@
+# tests for the versioned general data store
+import threading
+
+from general_store import GeneralStore
+
+
+def test_versions_and_changes():
+    store = GeneralStore()
+    assert store.changes(0) == (0, {})
+    assert store.update({"cpu": 10, "gpu": 20}) == 1
+    assert store.update({"cpu": 15}) == 2
+    assert store.get("cpu") == (2, 15)
+    assert store.get("gpu") == (1, 20)
+    assert store.changes(1) == (2, {"cpu": 15})
+    assert store.changes(0) == (2, {"gpu": 20, "cpu": 15})
+    # nothing to write, nothing changes
+    assert store.update({}) == 2
+    # a version from before a restart
+    assert store.changes(10) == (2, {"gpu": 20, "cpu": 15})
+
+    copy = GeneralStore()
+    copy.load(store.to_dict())
+    assert copy.changes(1) == (2, {"cpu": 15})
+    assert list(copy) == ["gpu", "cpu"]
+
+
+def test_wait_wakes_up_on_update():
+    store = GeneralStore()
+    assert not store.wait(0, timeout=0.01)
+    timer = threading.Timer(0.05, store.update, args=({"cpu": 1},))
+    timer.start()
+    assert store.wait(0, timeout=5)
+    timer.join()
@@ -0,0 +1,42 @@
+# tests for the latency breakdown
+import pytest
+
+from latency import LatencyTracker
+
+
+def test_stages():
+    tracker = LatencyTracker(capacity=100)
+    tracker.chunk(1, "mic", block=0.04, captured=100.0, received=100.01, analysed=100.015, ack=True)
+    tracker.chunk(2, "mic", block=0.04, captured=None, received=100.05, analysed=100.06)
+    assert tracker.ack(1, 100.025)
+    # never asked for
+    assert not tracker.ack(2, 100.07)
+    breakdown = tracker.breakdown()["mic"]
+    assert breakdown["block"]["count"] == 2
+    assert breakdown["analysis"]["count"] == 2
+    assert breakdown["transport"]["count"] == 1
+    assert breakdown["transport"]["p50"] == pytest.approx(0.01)
+    assert breakdown["delivery"]["p99"] == pytest.approx(0.01)
+    # from the first sample of the block to the ack
+    assert breakdown["total"]["mean"] == pytest.approx(0.04 + 0.025)
+
+
+def test_percentiles_are_per_source():
+    tracker = LatencyTracker(capacity=10)
+    for seq in range(20):
+        tracker.chunk(seq, "a", block=0.01, captured=None, received=seq, analysed=seq + 0.001 * (seq % 10))
+        tracker.chunk(seq, "b", block=0.01, captured=None, received=seq, analysed=seq + 0.5)
+    breakdown = tracker.breakdown()
+    # only the last 10 are kept
+    assert breakdown["a"]["analysis"]["count"] == 10
+    assert breakdown["a"]["analysis"]["p50"] == pytest.approx(0.0045)
+    assert breakdown["b"]["analysis"]["p90"] == pytest.approx(0.5)
+    assert "delivery" not in breakdown["a"]
+
+
+def test_old_chunks_are_not_acked():
+    tracker = LatencyTracker()
+    for seq in range(100):
+        tracker.chunk(seq, "mic", block=0.01, captured=None, received=0.0, analysed=0.0, ack=True)
+    assert not tracker.ack(0, 1.0)
+    assert tracker.ack(99, 1.0)
@@ -0,0 +1,32 @@
+# tests for the analysis backends, librosa itself is not needed for these
+import sys
+
+import numpy as np
+
+import librosa_analysis
+
+
+def test_tracker_backend_never_imports_librosa():
+    analyzer = librosa_analysis.Analyzer(backend="tracker", report=False)
+    result = analyzer.readData(np.zeros(1024, dtype=np.float32), 48000)
+    assert set(result) >= {"bpm", "beat_phase", "pulse", "pulse_bar"}
+    assert librosa_analysis.librosa is None
+    assert "librosa" not in sys.modules
+
+
+def test_jit_cache_is_persistent_and_versioned(monkeypatch, tmp_path):
+    monkeypatch.setenv("ANALYSIS_CACHE_DIR", str(tmp_path))
+    cache = librosa_analysis.jit_cache_dir()
+    assert cache.startswith(str(tmp_path))
+    assert f"py{sys.version_info.major}{sys.version_info.minor}" in cache
+    assert "librosa" in cache and "numba" in cache
+
+
+def test_warm_up_and_first_feature_are_timed(monkeypatch):
+    monkeypatch.setattr(librosa_analysis, "timings", dict())
+    librosa_analysis.start_warm_up("tracker").join()
+    assert librosa_analysis.timings['warm_up'] > 0
+    # the warm up does not count as the first feature
+    assert 'first_feature' not in librosa_analysis.timings
+    librosa_analysis.Analyzer().readData(np.zeros(1024, dtype=np.float32), 48000)
+    assert librosa_analysis.timings['first_feature'] <= librosa_analysis.timings['first_feature_after']
@@ -0,0 +1,66 @@
+# tests for the capture client's transports
+import time
+
+import numpy as np
+
+import local_audio_client as client
+from stream_ingest import StreamIngestServer
+from virtual_sources import GeneratorMicrophone
+
+
+def test_seq_keeps_counting_after_pushed_settings():
+    chunks = []
+
+    def on_audio(pcm, **meta):
+        chunks.append(meta['seq'])
+        # push new settings every few chunks, send_audio returns on each push and is called again like main() does
+        if len(chunks) % 5 == 0:
+            server.send_settings({"blocksize": 256})
+
+    server = StreamIngestServer(on_audio=on_audio, get_settings=lambda: {}, host="127.0.0.1", port=0)
+    server.start()
+    settings = {'loopback': False, 'blocksize': 512, 'samplerate': 48000, 'mics': {}, 'source': "test",
+                'transport': 'tcp', 'stream_port': server.port}
+    mic = GeneratorMicrophone("tone", realtime=False)
+    try:
+        first = client.chunk_seq
+        # send audio, get settings pushed, send audio again over the same connection
+        assert client.send_audio(mic, "http://127.0.0.1/", settings)
+        assert settings['blocksize'] == 256
+        assert client.send_audio(mic, "http://127.0.0.1/", settings)
+        deadline = time.time() + 2
+        while len(chunks) < client.chunk_seq - first and time.time() < deadline:
+            time.sleep(0.01)
+        # none of the chunks after the push were dropped as stale
+        assert chunks == list(range(first, client.chunk_seq))
+    finally:
+        if client.stream is not None:
+            client.stream.close()
+            client.stream = None
+        server.stop()
+
+
+class RecordingWebsocket:
+    connected = True
+
+    def __init__(self):
+        self.chunks = []
+
+    def emit(self, event, data, namespace=None):
+        self.chunks.append(data[0]['seq'])
+
+
+def test_websocket_slow_mode_only_numbers_the_chunks_it_sends(monkeypatch):
+    websocket = RecordingWebsocket()
+    monkeypatch.setattr(client, 'websocket', websocket)
+    monkeypatch.setattr(client, 'websocket_events', {'settings': None, 'slow': False})
+    settings = {'samplerate': 48000, 'source': "test"}
+    block = np.zeros((256, 1), dtype=np.float32)
+    first = client.websocket_seq
+    for seq in range(4):
+        client.post_websocket_chunk(block, "http://127.0.0.1/", settings, seq, 0.0)
+    client.websocket_events['slow'] = True
+    for seq in range(4, 10):
+        client.post_websocket_chunk(block, "http://127.0.0.1/", settings, seq, 0.0)
+    # every other chunk is skipped while slow, the server still sees no gaps
+    assert websocket.chunks == list(range(first, first + 7))
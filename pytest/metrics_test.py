@@ -0,0 +1,47 @@
+# tests for the metrics registry
+import metrics
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = metrics.Registry()
+    histogram = registry.histogram("request_seconds", "Time per request", buckets=(0.1, 1.0), route="/a")
+    for value in (0.05, 0.1, 0.5, 5.0):
+        histogram.observe(value)
+    lines = registry.render().splitlines()
+    assert lines[0] == "# HELP request_seconds Time per request"
+    assert lines[1] == "# TYPE request_seconds histogram"
+    assert 'request_seconds_bucket{route="/a",le="0.1"} 2' in lines
+    assert 'request_seconds_bucket{route="/a",le="1.0"} 3' in lines
+    assert 'request_seconds_bucket{route="/a",le="+Inf"} 4' in lines
+    assert 'request_seconds_count{route="/a"} 4' in lines
+    assert 'request_seconds_sum{route="/a"} 5.65' in lines
+
+
+def test_same_labels_same_metric():
+    registry = metrics.Registry()
+    registry.counter("chunks_total", "Chunks").inc()
+    registry.counter("chunks_total", "Chunks").inc(2)
+    registry.counter("dropped_total", "Dropped", reason="a").inc()
+    registry.counter("dropped_total", "Dropped", reason="b")
+    text = registry.render()
+    assert "chunks_total 3\n" in text
+    assert 'dropped_total{reason="a"} 1\n' in text
+    assert 'dropped_total{reason="b"} 0\n' in text
+    assert text.count("# TYPE dropped_total counter") == 1
+
+
+def test_gauges_are_read_when_rendered():
+    registry = metrics.Registry()
+    queue = [1, 2]
+    registry.gauge("queue_depth", "Items waiting", lambda: len(queue))
+    # a gauge whose source is missing is left out instead of failing the whole page
+    registry.gauge("worker_backlog", "Chunks at the worker", lambda: None.count)
+    assert "queue_depth 2\n" in registry.render()
+    queue.append(3)
+    text = registry.render()
+    assert "queue_depth 3\n" in text
+    assert "\nworker_backlog " not in text
+
+
+def test_label_values_are_escaped():
+    assert metrics.format_labels({"route": 'a"b\\c\nd'}) == '{route="a\\"b\\\\c\\nd"}'
@@ -0,0 +1,74 @@
+# tests for the streaming onset detector
+import numpy as np
+
+import flask_config
+from feature_pipeline import server_pipeline
+from onset_detector import OnsetDetector
+
+
+def clicks_over_noise(hits, seconds: float = 6, samplerate: int = 48000):
+    samples = np.random.default_rng(0).normal(0, 0.01, int(seconds * samplerate)).astype(np.float32)
+    click = (np.sin(np.arange(2000) * 0.3) * np.exp(-np.arange(2000) / 300)).astype(np.float32)
+    for hit in hits:
+        samples[hit:hit + 2000] += click
+    return samples
+
+
+def detect(samples, blocksize: int = 1024, samplerate: int = 48000):
+    detector = OnsetDetector(samplerate)
+    events = []
+    for start in range(0, len(samples), blocksize):
+        event = detector.process(samples[start:start + blocksize], samplerate, received=100.0)
+        if event is not None:
+            events.append(event)
+    return events
+
+
+def test_clicks_are_found_to_the_sample():
+    # not lined up with the blocks
+    hits = [24000 + i * 17760 + (i * 97) % 1024 for i in range(12)]
+    events = detect(clicks_over_noise(hits))
+    assert len(events) == len(hits)
+    for hit, event in zip(hits, events):
+        assert abs(event['sample'] - hit) <= 4
+    assert [event['id'] for event in events] == list(range(1, len(hits) + 1))
+
+
+def test_event_time_counts_back_from_when_the_chunk_arrived():
+    events = detect(clicks_over_noise([48000 + 100]), blocksize=1024)
+    (event,) = events
+    assert abs(event['sample'] - 48100) <= 4
+    # the click is right at the end of the chunk ending at sample 48127, the hann window hides it there,
+    # so it is found with the next chunk, which ends at sample 49151 and arrived at t=100
+    assert event['time'] == 100.0 - (49151 - event['sample']) / 48000
+
+
+def test_steady_sounds_are_not_onsets():
+    samplerate = 48000
+    t = np.arange(5 * samplerate) / samplerate
+    assert detect((0.5 * np.sin(2 * np.pi * 440 * t)).astype(np.float32)) == []
+    assert detect(np.random.default_rng(1).normal(0, 0.1, 5 * samplerate).astype(np.float32)) == []
+    assert detect(np.zeros(5 * samplerate, dtype=np.float32)) == []
+
+
+def test_the_pipeline_shares_its_spectrum(monkeypatch):
+    config = {name: value for name, value in vars(flask_config).items() if name.isupper()}
+    config.update(TEMPO_TRACKING=False, ONSET_DETECTION=True)
+    pipeline, _, _ = server_pipeline(config)
+    ffts = []
+    rfft = np.fft.rfft
+    monkeypatch.setattr(np.fft, 'rfft', lambda *args, **kwargs: ffts.append(1) or rfft(*args, **kwargs))
+    samples = clicks_over_noise([24000 + 300], seconds=1)
+    events = []
+    for seq, start in enumerate(range(0, len(samples), 1024)):
+        chunk = samples[start:start + 1024]
+        record = pipeline.run(seq, None, chunk=chunk, mono=chunk, samplerate=48000, channels=1,
+                              full_scale=1.0, received=100.0)
+        pipeline.finish(record)
+        record['bands']
+        if record['onset'] is not None:
+            events.append(record['onset'])
+    # one rfft per chunk, for the bands and the onsets
+    assert len(ffts) == seq + 1
+    assert len(events) == 1
+    assert abs(events[0]['sample'] - 24300) <= 4
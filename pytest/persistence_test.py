@@ -0,0 +1,101 @@
+# tests for saving/restoring the server state
+import time
+
+import numpy as np
+
+import flask_server
+from general_history import GeneralHistory
+from general_store import GeneralStore
+from persistence import Persistence, read_snapshot, write_snapshot
+
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "state.snapshot")
+    assert read_snapshot(path) is None
+    stats = np.arange(15, dtype=np.float64).reshape(5, 3)
+    write_snapshot(path, {"settings": {"b": 512}}, {"stats": stats, "empty": np.zeros((0, 4))})
+    values, arrays = read_snapshot(path)
+    assert values == {"settings": {"b": 512}}
+    assert np.array_equal(arrays["stats"], stats)
+    assert arrays["empty"].shape == (0, 4)
+
+
+def test_log_and_compaction(tmp_path):
+    store = GeneralStore()
+    persistence = Persistence(str(tmp_path))
+    persistence.start(lambda: ({"general": store.to_dict()}, {}))
+    for value in range(3):
+        version = store.update({"cpu": value})
+        persistence.record('general', {"version": version, "values": {"cpu": value}})
+    # a second process on the same directory only restores
+    assert not Persistence(str(tmp_path)).writer
+
+    def restored():
+        copy = GeneralStore()
+        Persistence(str(tmp_path)).restore(lambda values, arrays: copy.load(values["general"]),
+                                           lambda kind, when, data: copy.merge(data["values"], data["version"]))
+        return copy
+
+    deadline = time.monotonic() + 5
+    while restored().changes(0) != (3, {"cpu": 2}) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert restored().changes(0) == (3, {"cpu": 2})
+
+    # compacting leaves the same state in the snapshot, replaying the log again changes nothing
+    persistence.compact(open(persistence.log_path, "ab"))
+    with open(persistence.log_path, "ab") as log:
+        log.write(Persistence.encode(('general', 0.0, {"version": 2, "values": {"cpu": 1}})))
+        # torn write
+        log.write(b'["general",')
+    assert restored().changes(0) == (3, {"cpu": 2})
+
+
+def test_server_state_survives_a_restart(tmp_path, monkeypatch):
+    persistence = Persistence(str(tmp_path))
+    monkeypatch.setattr(flask_server, "persistence", persistence)
+    client = flask_server.flask_app.test_client()
+    client.post("/general_in", json={"saved key": 42, "type": "int"})
+    flask_server.ingest_binary(np.full(256, 0.25, np.float32).tobytes())
+    values, arrays = flask_server.capture_state()
+    write_snapshot(persistence.snapshot_path, values, arrays)
+
+    # a fresh server
+    monkeypatch.setattr(flask_server, "general_data", GeneralStore())
+    monkeypatch.setattr(flask_server, "general_history", GeneralHistory())
+    monkeypatch.setattr(flask_server, "audio_stats", flask_server.RingBuffer(16, dtype=np.float64, width=3))
+    flask_server.restore_state()
+    assert client.get("/general_keys/saved key").json == {"saved key": 42}
+    assert flask_server.audio_stats.latest(1)[0, 1] == 0.25
+    assert "saved key" in flask_server.general_history
+
+
+def test_a_bad_snapshot_is_moved_aside(tmp_path):
+    persistence = Persistence(str(tmp_path))
+    write_snapshot(persistence.snapshot_path, {"general": {}}, {})
+    with open(persistence.snapshot_path, "r+b") as file:
+        # header cut short
+        file.truncate(20)
+    with open(persistence.log_path, "wb") as log:
+        log.write(Persistence.encode(('general', 0.0, {"version": 1, "values": {"cpu": 5}})))
+    store = GeneralStore()
+    persistence.restore(lambda values, arrays: store.load(values["general"]),
+                        lambda kind, when, data: store.merge(data["values"], data["version"]))
+    # the log is still replayed
+    assert store.changes(0) == (1, {"cpu": 5})
+    assert (tmp_path / "state.snapshot.bad").exists()
+    assert read_snapshot(persistence.snapshot_path) is None
+
+
+def test_an_entry_json_cannot_take_does_not_stop_the_log(tmp_path):
+    persistence = Persistence(str(tmp_path))
+    persistence.start(lambda: ({}, {}))
+    persistence.record('general', {"values": {"bad": object()}})
+    persistence.record('general', {"version": 1, "values": {"cpu": 1}})
+    deadline = time.monotonic() + 5
+    while not (tmp_path / "state.log").exists() or not (tmp_path / "state.log").read_bytes():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    with open(persistence.log_path, "rb") as log:
+        lines = log.read().splitlines()
+    assert len(lines) == 1
+    assert persistence.thread.is_alive()
@@ -0,0 +1,41 @@
+# tests for the numpy ring buffer
+import numpy as np
+
+from ring_buffer import RingBuffer
+
+
+def test_append_and_read_in_order():
+    ring = RingBuffer(5)
+    ring.append([1, 2, 3])
+    np.testing.assert_array_equal(ring.latest(), [1, 2, 3])
+    ring.append([4, 5, 6, 7])
+    assert len(ring) == 5
+    assert ring.total == 7
+    np.testing.assert_array_equal(ring.latest(), [3, 4, 5, 6, 7])
+    np.testing.assert_array_equal(ring.latest(2), [6, 7])
+
+
+def test_views_split_at_the_wrap_point_without_copying():
+    ring = RingBuffer(4)
+    ring.append([1, 2, 3])
+    ring.append([4, 5])
+    first, second = ring.views()
+    np.testing.assert_array_equal(first, [2, 3, 4])
+    np.testing.assert_array_equal(second, [5])
+    assert np.shares_memory(first, ring.buffer)
+    assert np.shares_memory(second, ring.buffer)
+
+
+def test_block_larger_than_capacity_keeps_the_newest_rows():
+    ring = RingBuffer(3)
+    ring.append(np.arange(10))
+    np.testing.assert_array_equal(ring.latest(), [7, 8, 9])
+    ring.append([10])
+    np.testing.assert_array_equal(ring.latest(), [8, 9, 10])
+
+
+def test_rows():
+    ring = RingBuffer(2, dtype=np.float64, width=3)
+    ring.append((1, 2, 3))
+    ring.append([(4, 5, 6), (7, 8, 9)])
+    np.testing.assert_array_equal(ring.latest(), [[4, 5, 6], [7, 8, 9]])
@@ -0,0 +1,39 @@
+# tests for the shared memory ring
+import numpy as np
+import pytest
+
+from shared_ring import SharedRing
+
+
+@pytest.fixture
+def ring():
+    ring = SharedRing(4, 64, create=True)
+    yield ring
+    ring.close()
+    ring.unlink()
+
+
+def test_write_and_read_from_another_handle(ring):
+    assert ring.latest() is None
+    assert ring.write(b"abc", np.arange(3, dtype=np.uint8)) == 0
+    other = SharedRing(4, 64, name=ring.name)
+    assert other.count == 1
+    assert other.read(0) == b"abc\x00\x01\x02"
+    assert other.latest() == (0, b"abc\x00\x01\x02")
+    # not written yet
+    assert other.read(1) is None
+    other.close()
+
+
+def test_lapped_slots_read_as_none(ring):
+    for seq in range(6):
+        ring.write(str(seq).encode())
+    assert ring.read(1) is None
+    assert ring.read(2) == b"2"
+    assert ring.latest() == (5, b"5")
+
+
+def test_too_big(ring):
+    with pytest.raises(ValueError):
+        ring.write(bytes(65))
+    assert ring.count == 0
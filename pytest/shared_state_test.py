@@ -0,0 +1,68 @@
+# tests for the state shared between server processes
+import pytest
+
+import flask_server
+from general_store import GeneralStore
+from shared_state import SharedState
+
+RINGS = {'features': (4, 256), 'general': (2, 256)}
+
+
+def test_processes_see_each_others_writes(tmp_path):
+    path = str(tmp_path / "state")
+    first = SharedState(path, RINGS)
+    second = SharedState(path, RINGS)
+    assert second.latest_json('general', {}) == {}
+    with first.writing():
+        # nested, e.g. a read-modify-write
+        first.write_json('general', {"volume": 50})
+    assert second.latest_json('general') == {"volume": 50}
+    assert second.latest_json('general') is second.latest_json('general')
+    first.write_json('general', {"volume": 60})
+    assert second.latest_json('general') == {"volume": 60}
+    first.close()
+    second.close()
+
+
+def test_layout_has_to_match(tmp_path):
+    path = str(tmp_path / "state")
+    SharedState(path, RINGS).close()
+    with pytest.raises(ValueError):
+        SharedState(path, {'features': (8, 256), 'general': (2, 256)})
+
+
+@pytest.fixture
+def shared(tmp_path, monkeypatch):
+    state = SharedState(str(tmp_path / "state"), {
+        'audio': (8, 64 * 1024), 'features': (8, 64 * 1024), 'general': (4, 1024), 'settings': (4, 1024)})
+    flask_server.shared_state = state
+    # as if the state was on from the start
+    monkeypatch.setattr(flask_server, "audio_seq", 0)
+    monkeypatch.setattr(flask_server, "general_data", GeneralStore())
+    flask_server.shared_seen = {'features': 0, 'settings': 0}
+    yield state
+    flask_server.shared_state = None
+    state.close()
+
+
+def test_chunks_from_another_process_are_served_here(shared):
+    client = flask_server.flask_app.test_client()
+    # what another process ingesting a chunk leaves behind
+    samples = flask_server.np.full(256, 0.5, dtype=flask_server.np.float32)
+    seq = flask_server.share_chunk(samples, 1, 1.0, 100.0)
+    shared.write_json('features', {"seq": seq, "received": 100.0, "source": "other mic", "pid": -1,
+                                   "peak": 0.5, "avg": 0.5, "bands": [0.25] * 8, "onset": None})
+    shared.write_json('general', {"version": 1, "entries": [["volume", 1, 50]]})
+    flask_server.sync_shared_state()
+    assert flask_server.audio_seq == seq
+    assert flask_server.audio_snapshot.source == "other mic"
+    assert client.get("/fft_audio").json == {"frequencies": [0.25] * 8}
+    assert client.get("/general_keys/volume").json == {"volume": 50}
+    # this process' own chunks are not applied twice
+    before = len(flask_server.audio_stats)
+    client.post("/audio_in/binary", data=samples.tobytes())
+    flask_server.sync_shared_state()
+    assert len(flask_server.audio_stats) == before + 1
+    assert flask_server.audio_seq == seq + 1
+    client.post("/general_in", json={"brightness": 20, "type": "int"})
+    assert shared.latest_json('general') == {"version": 2, "entries": [["volume", 1, 50], ["brightness", 2, 20]]}
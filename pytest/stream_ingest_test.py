@@ -0,0 +1,87 @@
+# tests for the framed TCP audio stream
+import json
+import socket
+import time
+
+import numpy as np
+import pytest
+
+import stream_ingest
+from stream_ingest import FrameDecoder, ProtocolError, SequenceTracker, StreamIngestServer
+
+
+def test_decoder_reassembles_frames_split_anywhere():
+    pcm = np.arange(8, dtype=np.float32).tobytes()
+    data = (stream_ingest.encode_json_frame(stream_ingest.HELLO, {"mics": {}})
+            + stream_ingest.encode_audio_frame(pcm, seq=3, capture_time=1.5, channels=2))
+    decoder = FrameDecoder()
+    frames = []
+    for i in range(0, len(data), 7):
+        frames += decoder.feed(data[i:i + 7])
+    assert [frame_type for frame_type, _ in frames] == [stream_ingest.HELLO, stream_ingest.AUDIO]
+    meta, decoded = stream_ingest.decode_audio_payload(frames[1][1])
+    assert meta == {'seq': 3, 'capture_time': 1.5, 'dtype': 'float32', 'channels': 2, 'samplerate': 48000}
+    assert bytes(decoded) == pcm
+    assert len(decoder.buffer) == 0
+
+
+def test_decoder_rejects_other_versions():
+    with pytest.raises(ProtocolError):
+        FrameDecoder().feed(stream_ingest.HEADER.pack(stream_ingest.MAGIC, 2, stream_ingest.HELLO, 0))
+
+
+def test_sequence_tracker():
+    tracker = SequenceTracker()
+    assert [tracker.update(seq) for seq in (0, 1, 4, 3, 4, 5)] == [True, True, True, False, False, True]
+    assert tracker.lost == 2
+    assert tracker.stale == 2
+
+
+def read_frame(sock):
+    decoder = FrameDecoder()
+    while True:
+        frames = decoder.feed(sock.recv(65536))
+        if frames:
+            return frames[0]
+
+
+def test_server_handshake_audio_and_settings_push():
+    chunks = []
+    hellos = []
+    server = StreamIngestServer(on_audio=lambda pcm, **meta: chunks.append((bytes(pcm), meta)),
+                                on_hello=lambda mics, settings: hellos.append((mics, settings)),
+                                get_settings=lambda: {"blocksize": 1024},
+                                host="127.0.0.1", port=0)
+    server.start()
+    try:
+        with socket.create_connection(("127.0.0.1", server.port)) as sock:
+            sock.sendall(stream_ingest.encode_json_frame(stream_ingest.HELLO, {"mics": {"1": "mic"}, "settings": {"source": "1"}}))
+            frame_type, payload = read_frame(sock)
+            assert frame_type == stream_ingest.WELCOME
+            assert json.loads(payload) == {"version": stream_ingest.PROTOCOL_VERSION, "settings": {"blocksize": 1024}}
+            assert hellos == [({"1": "mic"}, {"source": "1"})]
+
+            pcm = np.ones(16, dtype=np.float32).tobytes()
+            for seq in (0, 1, 1, 3):
+                sock.sendall(stream_ingest.encode_audio_frame(pcm, seq=seq, capture_time=0.0))
+            server.send_settings({"blocksize": 512})
+            frame_type, payload = read_frame(sock)
+            assert frame_type == stream_ingest.SETTINGS
+            assert json.loads(payload) == {"blocksize": 512}
+
+            deadline = time.time() + 2
+            while len(chunks) < 3 and time.time() < deadline:
+                time.sleep(0.01)
+            assert [meta['seq'] for _, meta in chunks] == [0, 1, 3]
+            assert chunks[0] == (pcm, {'seq': 0, 'capture_time': 0.0, 'dtype': 'float32', 'channels': 1,
+                                       'samplerate': 48000, 'source': "1"})
+    finally:
+        server.stop()
+
+
+def test_a_listener_has_to_open_a_socket():
+    class NoSocket(stream_ingest.IngestListener):
+        pass
+
+    with pytest.raises(TypeError):
+        NoSocket(on_audio=None, host="127.0.0.1", port=0)
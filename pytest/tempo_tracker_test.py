@@ -0,0 +1,58 @@
+# tests for the incremental tempo tracker
+import numpy as np
+import pytest
+
+from tempo_tracker import TempoTracker
+
+
+def click_track(bpm: float, seconds: float = 12, samplerate: int = 48000):
+    """
+    Decaying 2.3 kHz clicks every beat over quiet noise, returns (samples, sample index of every click)
+    """
+    samples = np.random.default_rng(0).normal(0, 0.01, int(seconds * samplerate)).astype(np.float32)
+    clicks = np.arange(0, len(samples) - 400, int(samplerate * 60 / bpm))
+    click = np.sin(np.arange(400) * 0.3) * np.exp(-np.arange(400) / 80)
+    for start in clicks:
+        samples[start:start + 400] += click
+    return samples, clicks
+
+
+@pytest.mark.parametrize("bpm", [72, 100, 128, 150, 174])
+def test_finds_the_tempo_of_a_click_track(bpm):
+    samples, _ = click_track(bpm)
+    tracker = TempoTracker(48000)
+    for start in range(0, len(samples), 1024):
+        tempo = tracker.update(samples[start:start + 1024])
+    assert tempo["bpm"] == pytest.approx(bpm, rel=0.02)
+    assert tempo["confidence"] > 0.2
+
+
+def test_beat_phase_is_zero_on_the_clicks():
+    samples, clicks = click_track(128)
+    tracker = TempoTracker(48000)
+    for start in range(0, len(samples), 512):
+        tempo = tracker.update(samples[start:start + 512])
+        if start > 8 * 48000 and np.any((clicks >= start) & (clicks < start + 512)):
+            # distance to the nearest beat, in beats
+            assert min(tempo["beat_phase"], 1 - tempo["beat_phase"]) < 0.1
+            assert tempo["pulse"] > 0.9
+
+
+def test_noise_has_no_confidence():
+    tracker = TempoTracker(48000)
+    rng = np.random.default_rng(1)
+    for _ in range(500):
+        tempo = tracker.update(rng.normal(0, 0.1, 1024))
+    assert tempo["confidence"] < 0.1
+
+
+def test_block_size_does_not_matter():
+    samples, _ = click_track(100, seconds=8)
+    results = []
+    for blocksize in (1024, 700, 4096):
+        tracker = TempoTracker(48000)
+        for start in range(0, len(samples), blocksize):
+            tracker.update(samples[start:start + blocksize])
+        results.append(tracker.state())
+    for result in results[1:]:
+        assert result == pytest.approx(results[0])
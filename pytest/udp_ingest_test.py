@@ -0,0 +1,119 @@
+# tests for the udp jitter buffer, block reassembly and the listener
+import socket
+import time
+
+import numpy as np
+
+from udp_ingest import BlockAssembler, JitterBuffer, UdpIngestServer, decode_datagram, encode_datagrams, MAX_DATAGRAM
+
+
+def test_jitter_buffer_reorders_and_drops_stale():
+    jitter = JitterBuffer(depth=4, max_delay=0.02)
+    for seq in (0, 2, 1):
+        jitter.push(seq, seq, now=0.0)
+    assert jitter.pop_ready(0.0) == [0, 1, 2]
+    assert jitter.reordered == 1
+    jitter.push(1, 1, now=0.0)
+    assert jitter.stale == 1
+
+
+def test_jitter_buffer_gives_up_on_missing_packets_after_the_delay():
+    jitter = JitterBuffer(depth=4, max_delay=0.02)
+    jitter.push(0, 0, now=0.0)
+    jitter.push(2, 2, now=0.0)
+    assert jitter.pop_ready(0.01) == [0]
+    assert jitter.pop_ready(0.03) == [2]
+    assert jitter.lost == 1
+    # too late now
+    jitter.push(1, 1, now=0.04)
+    assert jitter.stale == 1
+
+
+def test_jitter_buffer_gives_up_when_full():
+    jitter = JitterBuffer(depth=2, max_delay=10)
+    jitter.push(0, 0, now=0.0)
+    for seq in (2, 3, 4):
+        jitter.push(seq, seq, now=0.0)
+    assert jitter.pop_ready(0.0) == [0, 2, 3, 4]
+    assert jitter.lost == 1
+
+
+def test_jitter_buffer_duplicates_and_restart():
+    jitter = JitterBuffer()
+    jitter.push(5000, 1, now=0.0)
+    jitter.push(5000, 1, now=0.0)
+    assert jitter.duplicates == 1
+    jitter.pop_ready(0.0)
+    jitter.push(0, 2, now=0.0)
+    assert jitter.pop_ready(0.0) == [2]
+
+
+def test_blocks_are_split_under_the_mtu_and_put_back_together():
+    pcm = np.arange(2048 * 2, dtype=np.float32).tobytes()
+    datagrams = encode_datagrams(pcm, seq=10, block=3, capture_time=1.0, channels=2)
+    assert all(len(datagram) <= MAX_DATAGRAM for datagram in datagrams)
+    assembler = BlockAssembler()
+    results = [assembler.add(*decode_datagram(datagram)) for datagram in datagrams]
+    assert all(result is None for result in results[:-1])
+    meta, data = results[-1]
+    assert meta['block'] == 3 and meta['seq'] == 10
+    assert bytes(data) == pcm
+
+
+def test_block_missing_a_fragment_is_dropped():
+    pcm = np.zeros(2048, dtype=np.float32).tobytes()
+    assembler = BlockAssembler()
+    first = encode_datagrams(pcm, seq=0, block=0, capture_time=0.0)
+    second = encode_datagrams(pcm, seq=len(first), block=1, capture_time=0.0)
+    for datagram in first[:2] + first[3:] + second:
+        result = assembler.add(*decode_datagram(datagram))
+    assert result is not None and result[0]['block'] == 1
+    assert assembler.incomplete == 1
+    assert assembler.complete == 1
+
+
+def test_server_receives_blocks_on_its_own_thread():
+    blocks = []
+    server = UdpIngestServer(on_audio=lambda pcm, **meta: blocks.append((bytes(pcm), meta)), host="127.0.0.1",
+                             port=0, max_delay=0.01)
+    assert UdpIngestServer(on_audio=None).port == 4243
+    thread = server.start()
+    try:
+        assert thread.name == "udp-ingest"
+        pcm = np.arange(1024, dtype=np.float32).tobytes()
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            for datagram in encode_datagrams(pcm, seq=0, block=5, capture_time=1.5):
+                sock.sendto(datagram, ("127.0.0.1", server.port))
+        deadline = time.time() + 2
+        while not blocks and time.time() < deadline:
+            time.sleep(0.01)
+        assert blocks == [(pcm, {'seq': 5, 'capture_time': 1.5, 'dtype': 'float32', 'channels': 1,
+                                 'samplerate': 48000, 'source': blocks[0][1]['source']})]
+    finally:
+        server.stop()
+
+
+def test_idle_sources_are_forgotten_but_still_counted():
+    blocks = []
+    server = UdpIngestServer(on_audio=lambda pcm, **meta: blocks.append(meta['source']), host="127.0.0.1",
+                             port=0, max_delay=0.01, idle_timeout=0.1)
+    server.start()
+    try:
+        pcm = np.zeros(256, dtype=np.float32).tobytes()
+        # two runs of a client, each from its own port, the second skips datagram 1
+        for seqs in ((0, 1, 2), (0, 2, 3)):
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+                for block, seq in enumerate(seqs):
+                    for datagram in encode_datagrams(pcm, seq=seq, block=block, capture_time=0.0):
+                        sock.sendto(datagram, ("127.0.0.1", server.port))
+                time.sleep(0.05)
+        deadline = time.time() + 2
+        while server.sources and time.time() < deadline:
+            time.sleep(0.01)
+        assert server.sources == {}
+        assert len(set(blocks)) == 2
+        totals = server.totals()
+        assert totals['received'] == 6
+        assert totals['lost'] == 1
+    finally:
+        server.stop()
@@ -0,0 +1,96 @@
+# tests for the capture client's virtual sources (local_application/virtual_sources.py)
+import os
+import threading
+import time
+import wave
+
+import numpy as np
+import pytest
+
+from virtual_sources import (FileMicrophone, GeneratorMicrophone, PipeMicrophone, VirtualMicrophone,
+                             VirtualRecorder, parse_generator)
+
+
+def test_wav_file_blocks(tmp_path):
+    path = str(tmp_path / "clip.wav")
+    samples = (np.arange(2500 * 2) % 200 - 100).astype(np.int16) * 100
+    with wave.open(path, 'wb') as file:
+        file.setnchannels(2)
+        file.setsampwidth(2)
+        file.setframerate(8000)
+        file.writeframes(samples.tobytes())
+    mic = FileMicrophone(path, realtime=False)
+    assert mic.samplerate == 8000
+    with mic.recorder(samplerate=48000, blocksize=1000) as recorder:
+        blocks = [recorder.record(numframes=None) for _ in range(3)]
+        with pytest.raises(EOFError):
+            recorder.record(numframes=None)
+    assert [block.shape for block in blocks] == [(1000, 2), (1000, 2), (500, 2)]
+    assert blocks[0].dtype == np.float32
+    np.testing.assert_allclose(np.concatenate(blocks).reshape(-1), samples / 32768.0)
+
+
+def test_raw_file_loops_in_real_time(tmp_path):
+    path = str(tmp_path / "clip.raw")
+    np.linspace(-1, 1, 100, dtype=np.float32).tofile(path)
+    mic = FileMicrophone(path, samplerate=1000, loop=True)
+    start = time.monotonic()
+    with mic.recorder(samplerate=1000, blocksize=60) as recorder:
+        first = recorder.record()
+        second = recorder.record()
+        third = recorder.record()
+    # 160 frames at 1000 Hz
+    assert time.monotonic() - start >= 0.15
+    assert [len(first), len(second), len(third)] == [60, 40, 60]
+    np.testing.assert_array_equal(third, first)
+
+
+def test_generator_is_continuous_across_blocks():
+    mic = GeneratorMicrophone("tone:1000", channels=2, realtime=False)
+    with mic.recorder(samplerate=48000, blocksize=480) as recorder:
+        blocks = np.concatenate([recorder.record() for _ in range(4)])
+    assert blocks.shape == (1920, 2)
+    expected = 0.3 * np.sin(2 * np.pi * 1000 * np.arange(1920) / 48000)
+    np.testing.assert_allclose(blocks[:, 1], expected, atol=1e-6)
+    with pytest.raises(ValueError):
+        parse_generator("tone:440,hum")
+    with pytest.raises(ValueError):
+        parse_generator("click:0")
+
+
+def test_pipe_fills_whole_blocks(tmp_path):
+    path = str(tmp_path / "audio_pipe")
+    os.mkfifo(path)
+    samples = np.arange(300, dtype=np.int32) * 2 ** 20
+
+    def write():
+        with open(path, 'wb', buffering=0) as pipe:
+            # in pieces that do not line up with the blocks
+            for piece in np.array_split(samples.view(np.uint8), 7):
+                pipe.write(piece.tobytes())
+                time.sleep(0.01)
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    mic = PipeMicrophone(path, format='int32', channels=2)
+    with mic.recorder(samplerate=48000, blocksize=100) as recorder:
+        block = recorder.record()
+        rest = recorder.record()
+        with pytest.raises(EOFError):
+            recorder.record()
+    writer.join()
+    assert block.shape == (100, 2)
+    np.testing.assert_allclose(np.concatenate([block, rest]).reshape(-1), samples / 2 ** 31)
+
+
+def test_sources_have_to_implement_the_recording():
+    class NoRecorder(VirtualMicrophone):
+        pass
+
+    class NoRead(VirtualRecorder):
+        pass
+
+    with pytest.raises(TypeError):
+        NoRecorder("none", "none")
+    with pytest.raises(TypeError):
+        NoRead(48000, 1024, 1)
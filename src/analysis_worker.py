@@ -0,0 +1,235 @@
+"""
+Audio analysis in a separate process
+
+Every numpy/librosa call used to run in the request handler that received the chunk, holding the GIL
+while viewers' GET requests waited. With ANALYSIS_WORKER on, the server only copies each chunk into a
+shared memory ring (shared_ring.py) and returns. A worker process runs the feature pipeline on the chunks
+in order and writes each finished feature record (json) into a second shared memory ring, which a thread
+in the server reads to update the state the routes serve and to push /audio_stream frames.
+
+    server (ingest) --chunks ring--> worker process --results ring--> server (results thread)
+
+Chunk slots: CHUNK_META followed by the raw PCM
+    seq (u64) | dtype code (u8) | channels (u8) | samplerate (u32) | full_scale, received, peak, avg (f64)
+peak/avg are NaN if the client did not send them.
+
+Semaphores tell the other side there is something new, nobody polls.
+"""
+import json
+import logging
+import math
+import multiprocessing
+import struct
+import threading
+import time
+
+import numpy as np
+
+from shared_ring import SharedRing
+from stream_ingest import DTYPE_CODES, DTYPE_NAMES
+
+# padded so the PCM after it starts 8 byte aligned
+CHUNK_META = struct.Struct("<QBBxxIdddd")
+# config settings the worker needs to build its pipeline
+CONFIG_PREFIXES = ("FFT_", "TEMPO_", "ONSET_", "ANALYSIS_")
+
+logger = logging.getLogger(__name__)
+
+
+def worker_config(config) -> dict:
+    """
+    The part of the flask config the worker needs, plain values only so it can be sent to the process
+    """
+    return {key: value for key, value in config.items() if key.startswith(CONFIG_PREFIXES)}
+
+
+def pack_chunk(chunk, seq: int, channels: int, samplerate: int, full_scale: float, received: float,
+               peak: float = None, avg: float = None) -> tuple:
+    """
+    (meta, samples) to write into a chunk slot, the shared state audio ring (flask_server.py) uses the same slots
+    """
+    if chunk.dtype.name not in DTYPE_NAMES:
+        # e.g. the float64 chunks of the json route
+        chunk = chunk.astype(np.float32)
+    meta = CHUNK_META.pack(seq, DTYPE_NAMES[chunk.dtype.name], channels, samplerate, full_scale, received,
+                           math.nan if peak is None else peak, math.nan if avg is None else avg)
+    return meta, np.ascontiguousarray(chunk)
+
+
+def unpack_chunk(data: bytes) -> tuple:
+    """
+    (seq, channels, samplerate, full_scale, received, peak, avg, chunk) of a chunk slot, peak/avg may be NaN
+    """
+    seq, dtype_code, channels, samplerate, full_scale, received, peak, avg = CHUNK_META.unpack_from(data)
+    chunk = np.frombuffer(data, dtype=DTYPE_CODES[dtype_code], offset=CHUNK_META.size)
+    return seq, channels, samplerate, full_scale, received, peak, avg, chunk
+
+
+class WorkerRecord:
+    """
+    Feature record read back from the worker, same interface as feature_pipeline.FeatureRecord
+
+    Only has what the worker computed, anything else is None.
+    """
+    def __init__(self, values: dict):
+        self.seq = values.pop('seq')
+        self.values = values
+
+    def __getitem__(self, name: str):
+        return self.values.get(name)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.values
+
+    def get(self, name: str):
+        return self.values.get(name)
+
+    def as_dict(self, names=None) -> dict:
+        if names is None:
+            return dict(self.values)
+        return {name: self.values.get(name) for name in names}
+
+
+def run_worker(config: dict, chunks_name: str, results_name: str, slots: int, chunk_size: int,
+               result_size: int, chunk_ready, result_ready, stop):
+    """
+    Worker process main loop
+    """
+    # imported here, the pipeline (and whatever its stages import) only has to load in the worker
+    from feature_pipeline import server_pipeline
+    import librosa_analysis
+
+    chunks = SharedRing(slots, chunk_size, name=chunks_name)
+    results = SharedRing(slots, result_size, name=results_name)
+    pipeline, tempo_analyzer, _ = server_pipeline(config)
+    if tempo_analyzer is not None and config.get('ANALYSIS_WARM_UP'):
+        # before the first chunk, not in a thread: the worker has nothing else to do yet
+        librosa_analysis.warm_up(tempo_analyzer.backend)
+    # what the server needs for every chunk (peak/avg, pulse, onset) is subscribed already
+    subscribed = pipeline.subscribed()
+    extra = [name for name in config.get('ANALYSIS_WORKER_FEATURES') or pipeline.stages if name not in subscribed]
+    pipeline.subscribe(*extra)
+    names = subscribed + extra
+    next_seq = 0
+    try:
+        while not stop.is_set():
+            if not chunk_ready.acquire(timeout=0.5):
+                continue
+            while next_seq < chunks.count:
+                data = chunks.read(next_seq)
+                if data is None:
+                    # lapped by the server, skip to the oldest chunk that is still there
+                    skipped = max(chunks.count - slots, next_seq + 1) - next_seq
+                    logger.warning(f"analysis worker fell behind, skipped {skipped} chunks")
+                    next_seq += skipped
+                    continue
+                next_seq += 1
+                values = analyse(pipeline, names, data)
+                try:
+                    results.write(json.dumps(values, separators=(',', ':')).encode())
+                except ValueError as error:
+                    logger.warning(f"dropped the features of chunk {values['seq']}: {error}")
+                    continue
+                result_ready.release()
+    finally:
+        chunks.close()
+        results.close()
+
+
+def analyse(pipeline, names, data: bytes) -> dict:
+    seq, channels, samplerate, full_scale, received, peak, avg, chunk = unpack_chunk(data)
+    mono = chunk.reshape(-1, channels).mean(axis=1) if channels > 1 else chunk
+    mono = mono / full_scale if full_scale != 1.0 else mono
+    known = {'peak': peak, 'avg': avg} if not math.isnan(peak) else None
+    record = pipeline.run(seq, known, chunk=chunk, mono=mono, samplerate=samplerate, channels=channels,
+                          full_scale=full_scale, received=received)
+    pipeline.finish(record)
+    values = record.as_dict(names)
+    values['seq'] = seq
+    values['received'] = received
+    values['analysed'] = time.time()
+    return values
+
+
+class AnalysisWorker:
+    def __init__(self, config, on_record, slots: int = 64, chunk_size: int = 256 * 1024, result_size: int = 16 * 1024):
+        """
+        config: the flask config
+        on_record(record: WorkerRecord): called from the results thread for every analysed chunk, in order
+        chunk_size: most bytes of PCM in one chunk, bigger chunks are dropped
+        """
+        self.config = worker_config(config)
+        self.on_record = on_record
+        self.slots = slots
+        self.chunk_size = chunk_size
+        self.result_size = result_size
+        # spawn: the worker does not inherit the server's threads, sockets and locks
+        self.context = multiprocessing.get_context('spawn')
+        self.chunks = None
+        self.results = None
+        self.process = None
+        self.thread = None
+        self.dropped = 0
+
+    def start(self):
+        if self.process is not None:
+            return
+        self.chunks = SharedRing(self.slots, CHUNK_META.size + self.chunk_size, create=True)
+        self.results = SharedRing(self.slots, self.result_size, create=True)
+        self.chunk_ready = self.context.Semaphore(0)
+        self.result_ready = self.context.Semaphore(0)
+        self.stopping = self.context.Event()
+        self.process = self.context.Process(
+            target=run_worker,
+            args=(self.config, self.chunks.name, self.results.name, self.slots, CHUNK_META.size + self.chunk_size,
+                  self.result_size, self.chunk_ready, self.result_ready, self.stopping),
+            name="analysis worker",
+            daemon=True)
+        self.process.start()
+        self.thread = threading.Thread(target=self.read_results, name="analysis results", daemon=True)
+        self.thread.start()
+        logger.info(f"analysis worker started (pid {self.process.pid})")
+
+    def stop(self):
+        if self.process is None:
+            return
+        self.stopping.set()
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.thread.join(timeout=5)
+        self.process = None
+        for ring in (self.chunks, self.results):
+            ring.close()
+            ring.unlink()
+
+    def submit(self, chunk, seq: int, channels: int, samplerate: int, full_scale: float, received: float,
+               peak: float = None, avg: float = None) -> bool:
+        """
+        Copy a chunk into the ring for the worker, returns False if it was dropped (too big)
+
+        Called with the ingest lock held, the ring has a single writer
+        """
+        try:
+            self.chunks.write(*pack_chunk(chunk, seq, channels, samplerate, full_scale, received, peak, avg))
+        except ValueError as error:
+            self.dropped += 1
+            logger.warning(f"chunk {seq} not analysed: {error}")
+            return False
+        self.chunk_ready.release()
+        return True
+
+    def read_results(self):
+        next_seq = 0
+        while not self.stopping.is_set():
+            if not self.result_ready.acquire(timeout=0.5):
+                continue
+            while next_seq < self.results.count:
+                data = self.results.read(next_seq)
+                next_seq += 1
+                if data is None:
+                    continue
+                try:
+                    self.on_record(WorkerRecord(json.loads(data)))
+                except Exception:
+                    logger.exception("handling an analysed chunk failed")
@@ -0,0 +1,261 @@
+"""
+Async (ASGI) entry point for the server
+
+flask run (and socketio.run) use the development server: one thread per connection, which is fine
+for a couple of viewers but not for dozens of open /audio_stream connections plus several capture clients.
+
+This serves the same app on an event loop with uvicorn:
+    /audio_stream     native async, each viewer is a coroutine instead of a blocked thread
+    /audio_in/binary  native async, the capture clients' hot path skips a2wsgi (the ingest itself
+                      runs in asyncio's default thread pool, it holds ingest_lock and runs the analysis)
+    /general_changes  native async, a waiting long poll costs a coroutine instead of one of the
+                      ASGI_WSGI_WORKERS threads
+    /socket.io        the /audio websocket namespace, on python-socketio's asgi server
+    everything else   the flask app, run in a small thread pool (a2wsgi)
+HTTP/1.1 keep-alive is handled by uvicorn (ASGI_KEEP_ALIVE_SECONDS).
+
+flask_server.py is still the app and stays importable/runnable on its own, this is a second way to run it:
+    python src/asgi_server.py
+or
+    uvicorn --app-dir src asgi_server:app --host 0.0.0.0 --port 8000
+"""
+import asyncio
+import json
+import time
+from urllib.parse import parse_qs
+
+import socketio
+import uvicorn
+from a2wsgi import WSGIMiddleware
+from werkzeug.datastructures import Headers
+
+import flask_server
+from flask_server import flask_app, AUDIO_NAMESPACE
+from broadcast import AsyncSubscriber
+
+wsgi_app = WSGIMiddleware(flask_app, workers=flask_app.config['ASGI_WSGI_WORKERS'])
+# async_handlers=False: events from one client are handled in order (same as flask_server.socketio)
+# TODO: the actual CORS policy
+sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins="*", async_handlers=False)
+
+
+def encode_headers(headers: dict) -> list:
+    return [(header.lower().encode('latin-1'), value.encode('latin-1')) for header, value in headers.items()]
+
+
+async def read_body(receive) -> bytes:
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        body += message.get('body', b"")
+        if not message.get('more_body', False):
+            break
+    return bytes(body)
+
+
+def query_arg(scope, name: str, default, type):
+    """
+    Like flask's request.args.get(name, default, type): the default if it is missing or does not parse
+    """
+    values = parse_qs(scope['query_string'].decode('latin-1')).get(name)
+    if not values:
+        return default
+    try:
+        return type(values[0])
+    except ValueError:
+        return default
+
+
+async def send_json(send, status: int, data):
+    body = json.dumps(data).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': encode_headers({'Content-Type': "application/json", 'Content-Length': str(len(body))}),
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def audio_in_binary(scope, receive, send):
+    """
+    Same as flask_server.audio_in_binary
+    """
+    body = await read_body(receive)
+    start = time.perf_counter()
+    headers = Headers([(header.decode('latin-1'), value.decode('latin-1')) for header, value in scope['headers']])
+    # not on the loop, one slow chunk would hold up every viewer
+    status, response = await asyncio.to_thread(flask_server.ingest_binary_request, body, headers)
+    await send_json(send, status, response)
+    # flask's after_request does not see the native routes
+    flask_server.observe_request('/audio_in/binary', time.perf_counter() - start)
+
+
+async def audio_stream(scope, receive, send):
+    """
+    Same as flask_server.audio_stream, but a viewer costs a coroutine instead of a thread
+    """
+    loop = asyncio.get_running_loop()
+    subscriber = flask_server.audio_hub.subscribe(AsyncSubscriber(loop, flask_app.config['STREAM_QUEUE_SIZE']))
+
+    async def wait_for_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    disconnect = asyncio.ensure_future(wait_for_disconnect())
+    try:
+        headers = dict(flask_server.SSE_HEADERS)
+        headers['Content-Type'] = "text/event-stream"
+        await send({'type': 'http.response.start', 'status': 200, 'headers': encode_headers(headers)})
+        await send({'type': 'http.response.body', 'body': flask_server.SSE_RETRY, 'more_body': True})
+        while True:
+            frame = asyncio.ensure_future(subscriber.get())
+            done, _ = await asyncio.wait({frame, disconnect},
+                                         timeout=flask_app.config['STREAM_KEEPALIVE_SECONDS'],
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if disconnect in done:
+                frame.cancel()
+                break
+            if frame in done:
+                body = frame.result()
+            else:
+                frame.cancel()
+                body = flask_server.SSE_KEEPALIVE
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    finally:
+        disconnect.cancel()
+        flask_server.audio_hub.unsubscribe(subscriber)
+
+
+# set on every general data change by the listener registered in startup(), then replaced with a new one
+general_changed = None
+
+
+async def general_changes(scope, receive, send):
+    """
+    Same as flask_server.general_changes, but a waiting poll does not hold a thread
+    """
+    start = time.perf_counter()
+    since = query_arg(scope, 'since', 0, int)
+    timeout = min(query_arg(scope, 'timeout', flask_app.config['GENERAL_POLL_TIMEOUT'], float),
+                  flask_app.config['GENERAL_POLL_TIMEOUT'])
+    # with SHARED_STATE this reads the shared memory, which another process may be writing
+    await asyncio.to_thread(flask_server.sync_general)
+    deadline = time.monotonic() + timeout
+    while True:
+        # taken before looking at the version, a change in between still sets it
+        changed = general_changed
+        remaining = deadline - time.monotonic()
+        if flask_server.general_data.version != since or remaining <= 0:
+            break
+        try:
+            await asyncio.wait_for(changed.wait(), remaining)
+        except asyncio.TimeoutError:
+            break
+    version, changes = flask_server.general_data.changes(since)
+    await send_json(send, 200, {"version": version, "changes": changes})
+    flask_server.observe_request('/general_changes', time.perf_counter() - start)
+
+
+# routes served natively, (method, path) -> handler
+ROUTES = {
+    ('POST', '/audio_in/binary'): audio_in_binary,
+    ('GET', '/audio_stream'): audio_stream,
+    ('GET', '/general_changes'): general_changes,
+}
+
+
+async def http_app(scope, receive, send):
+    if scope['type'] == 'http':
+        handler = ROUTES.get((scope['method'], scope['path']))
+        if handler is not None:
+            return await handler(scope, receive, send)
+    return await wsgi_app(scope, receive, send)
+
+
+# websocket audio, same events as the /audio namespace in flask_server
+@sio.on('connect', namespace=AUDIO_NAMESPACE)
+async def websocket_connect(sid, environ):
+    flask_server.websocket_clients[sid] = {"load": 0.0, "slow": False}
+    flask_app.logger.info(f"audio websocket client connected: {sid}")
+
+
+@sio.on('disconnect', namespace=AUDIO_NAMESPACE)
+async def websocket_disconnect(sid, *args):
+    flask_server.websocket_clients.pop(sid, None)
+    flask_app.logger.info(f"audio websocket client disconnected: {sid}")
+
+
+@sio.on('settings', namespace=AUDIO_NAMESPACE)
+async def websocket_settings(sid, settings):
+    error = flask_server.receive_client_settings(settings)
+    if error:
+        await sio.emit('error', error, to=sid, namespace=AUDIO_NAMESPACE)
+
+
+@sio.on('audio_chunk', namespace=AUDIO_NAMESPACE)
+async def websocket_audio_chunk(sid, meta, data):
+    state = flask_server.websocket_clients.setdefault(sid, {"load": 0.0, "slow": False})
+    # async_handlers=False: the next chunk of this client waits for this one, so they are still ingested in order
+    for event, message in await asyncio.to_thread(flask_server.websocket_chunk, state, meta, data):
+        await sio.emit(event, message, to=sid, namespace=AUDIO_NAMESPACE)
+
+
+# registered with flask_server.settings_listeners while the server is running
+settings_listener = None
+# registered with flask_server.general_data.listeners while the server is running
+general_listener = None
+
+
+def startup():
+    """
+    Settings and general data are changed from flask's worker threads, hand them over to the loop
+    to push to websockets and wake up the /general_changes polls
+    """
+    global settings_listener
+    global general_listener
+    global general_changed
+    loop = asyncio.get_running_loop()
+    general_changed = asyncio.Event()
+
+    def push_settings(settings):
+        asyncio.run_coroutine_threadsafe(sio.emit('settings', settings, namespace=AUDIO_NAMESPACE), loop)
+
+    def wake_general_polls():
+        global general_changed
+        general_changed.set()
+        general_changed = asyncio.Event()
+
+    def general_data_changed(version):
+        try:
+            loop.call_soon_threadsafe(wake_general_polls)
+        except RuntimeError:
+            # the loop is closed, the server is going away
+            pass
+
+    settings_listener = push_settings
+    flask_server.settings_listeners.append(settings_listener)
+    general_listener = general_data_changed
+    flask_server.general_data.listeners.append(general_listener)
+
+
+def shutdown():
+    global settings_listener
+    global general_listener
+    if settings_listener in flask_server.settings_listeners:
+        flask_server.settings_listeners.remove(settings_listener)
+    settings_listener = None
+    if general_listener in flask_server.general_data.listeners:
+        flask_server.general_data.listeners.remove(general_listener)
+    general_listener = None
+
+
+app = socketio.ASGIApp(sio, other_asgi_app=http_app, on_startup=startup, on_shutdown=shutdown)
+
+
+if __name__ == "__main__":
+    uvicorn.run(app,
+                host=flask_app.config['ASGI_HOST'],
+                port=flask_app.config['ASGI_PORT'],
+                timeout_keep_alive=flask_app.config['ASGI_KEEP_ALIVE_SECONDS'])
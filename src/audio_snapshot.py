@@ -0,0 +1,49 @@
+"""
+Everything the routes serve about the latest chunk, in one object that is never changed
+
+The ingest path used to update audio_chunk, audio_raw_max, audio_last, audio_max_last and audio_str as
+separate globals, so a GET in another thread could get the bars of one chunk and the peak of the next.
+Now the writer builds a new AudioSnapshot per chunk and swaps it in with one assignment:
+    audio_snapshot = snapshot.replace(bars=..., features=record)
+A reader grabs the reference once and only uses that, no lock needed:
+    snapshot = audio_snapshot
+    snapshot.bars, snapshot.max_last, snapshot.features['bands']
+The chunk is made read only, the FeatureRecord only ever grows (see feature_pipeline.py).
+"""
+import numpy as np
+
+FIELDS = ("seq", "chunk", "channels", "samplerate", "full_scale", "source", "received", "captured",
+          "raw_max", "max_last", "bars", "features")
+
+
+class AudioSnapshot:
+    """
+    seq: audio_seq of the chunk (0 before the first one)
+    chunk, channels, samplerate, full_scale: the chunk as the client sent it
+    source: name of the microphone, received: unix time the chunk arrived
+    captured: unix time (client clock) its last sample was recorded, None if the client did not say
+    raw_max: peak of the chunk, max_last: loudest peak of the last AUDIO_SAVED_CHUNKS chunks
+    bars: the "####---" string, features: the chunk's FeatureRecord (None until it is analysed)
+    """
+    __slots__ = FIELDS
+
+    def __init__(self, seq: int = 0, chunk=None, channels: int = 1, samplerate: int = 48000, full_scale: float = 1.0,
+                 source: str = "", received: float = 0.0, captured: float = None, raw_max: float = 0.0,
+                 max_last: float = 0.0, bars: str = "", features=None):
+        chunk = np.zeros(0, dtype=np.float32) if chunk is None else chunk.view()
+        chunk.flags.writeable = False
+        values = (seq, chunk, channels, samplerate, full_scale, source, received, captured, raw_max, max_last, bars,
+                  features)
+        for name, value in zip(FIELDS, values):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("snapshots are never changed, make a new one with replace()")
+
+    def replace(self, **changes) -> "AudioSnapshot":
+        """
+        New snapshot with some fields changed
+        """
+        values = {name: getattr(self, name) for name in FIELDS}
+        values.update(changes)
+        return AudioSnapshot(**values)
@@ -0,0 +1,80 @@
+"""
+Frequency band analysis for the frontend visualizers
+
+Splits a chunk into num_bands log (or mel) spaced bands between fmin and fmax,
+so the low bands are bass and the high bands are treble instead of 8 equal slices of the spectrum.
+
+The window and the bin -> band index map only depend on the blocksize/samplerate/band settings,
+so they are computed once and cached (see band_layout). Per chunk the work is one rfft,
+one abs and one np.add.reduceat over the bins.
+"""
+import functools
+import numpy as np
+
+
+def hz_to_mel(hz):
+    return 2595.0 * np.log10(1.0 + np.asarray(hz) / 700.0)
+
+
+def mel_to_hz(mel):
+    return 700.0 * (10.0 ** (np.asarray(mel) / 2595.0) - 1.0)
+
+
+@functools.lru_cache(maxsize=16)
+def band_layout(blocksize: int, samplerate: int, num_bands: int = 8,
+                fmin: float = 40.0, fmax: float = 16000.0, scale: str = 'log'):
+    """
+    Precompute everything band_energies needs for a given chunk shape
+
+    Returns (window, starts, stop, counts, norm):
+    window: hann window, multiplied into the chunk before the rfft
+    starts: index of the first rfft bin of each band, for np.add.reduceat
+    stop: one past the last bin of the last band
+    counts: number of bins in each band
+    norm: scales magnitudes so a full scale sine reads as 1.0
+    """
+    assert scale in ('log', 'mel'), f"unknown band scale {scale}, expected 'log' or 'mel'"
+    freqs = np.fft.rfftfreq(blocksize, 1.0 / samplerate)
+    fmax = min(fmax, samplerate / 2)
+    fmin = min(max(fmin, freqs[1] if len(freqs) > 1 else 0.0), fmax)
+    if scale == 'log':
+        edges = np.geomspace(fmin, fmax, num_bands + 1)
+    else:
+        edges = mel_to_hz(np.linspace(hz_to_mel(fmin), hz_to_mel(fmax), num_bands + 1))
+
+    starts = np.searchsorted(freqs, edges[:-1])
+    # the low bands can be narrower than the bin spacing, give every band at least one bin
+    offsets = np.arange(num_bands)
+    starts = np.maximum.accumulate(starts - offsets) + offsets
+    starts = np.minimum(starts, len(freqs) - 1)
+    stop = min(max(int(np.searchsorted(freqs, edges[-1], side='right')), starts[-1] + 1), len(freqs))
+    counts = np.maximum(np.diff(np.append(starts, stop)), 1)
+
+    window = np.hanning(blocksize).astype(np.float32)
+    norm = 2.0 / window.sum()
+    return window, starts, stop, counts, norm
+
+
+def band_energies(chunk, samplerate: int, num_bands: int = 8, fmin: float = 40.0,
+                  fmax: float = 16000.0, scale: str = 'log', channels: int = 1):
+    """
+    Return the average magnitude of each band of chunk, lowest band first
+
+    chunk is a flat array of interleaved samples, channels > 1 gets mixed down to mono first
+    """
+    if channels > 1:
+        chunk = chunk.reshape(-1, channels).mean(axis=1)
+    window, starts, stop, counts, norm = band_layout(len(chunk), samplerate, num_bands, fmin, fmax, scale)
+    magnitude = np.abs(np.fft.rfft(chunk * window))
+    return np.add.reduceat(magnitude[:stop], starts) / counts * norm
+
+
+def bands_from_magnitude(magnitude, blocksize: int, samplerate: int, num_bands: int = 8, fmin: float = 40.0,
+                         fmax: float = 16000.0, scale: str = 'log'):
+    """
+    Same as band_energies, for a (hann windowed, normalized) magnitude spectrum that was already computed
+
+    blocksize is the length of the chunk the spectrum came from
+    """
+    _, starts, stop, counts, _ = band_layout(blocksize, samplerate, num_bands, fmin, fmax, scale)
+    return np.add.reduceat(magnitude[:stop], starts) / counts
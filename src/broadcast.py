@@ -0,0 +1,143 @@
+"""
+Broadcast hub for pushing audio features to every open viewer
+
+Instead of each tab polling /audio_in and /fft_audio, viewers subscribe to a stream (Server-Sent Events)
+and the server publishes one frame per analysed chunk.
+
+Each frame is serialized once, no matter how many subscribers there are.
+Each subscriber has a small latest-wins mailbox: if a viewer is slow, its oldest frames are
+thrown away instead of piling up on the server, visuals only care about the newest frame anyway.
+"""
+import asyncio
+import json
+import queue
+import threading
+
+
+def sse_frame(data, event: str = None, id=None) -> bytes:
+    """
+    Serialize data (anything json can handle) as one Server-Sent Events message
+    """
+    lines = []
+    if event is not None:
+        lines.append(f"event: {event}")
+    if id is not None:
+        lines.append(f"id: {id}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return ("\n".join(lines) + "\n\n").encode()
+
+
+class Subscriber:
+    def __init__(self, maxsize: int = 1):
+        self.queue = queue.Queue(maxsize)
+        # frames thrown away because the subscriber did not keep up
+        self.dropped = 0
+
+    def deliver(self, frame: bytes):
+        """
+        Put frame in the mailbox, dropping the oldest frame if it is full. Never blocks.
+        """
+        while True:
+            try:
+                self.queue.put_nowait(frame)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout: float = None) -> bytes:
+        """
+        Wait for the next frame, raises queue.Empty after timeout seconds
+        """
+        return self.queue.get(timeout=timeout)
+
+
+class AsyncSubscriber:
+    """
+    Subscriber for code running on an asyncio event loop (the asgi server)
+
+    deliver() can still be called from any thread, the frame is handed over to the loop
+    """
+    def __init__(self, loop, maxsize: int = 1):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+
+    def deliver(self, frame: bytes):
+        try:
+            self.loop.call_soon_threadsafe(self.put, frame)
+        except RuntimeError:
+            # the loop is closed, the subscriber is about to go away anyway
+            pass
+
+    def put(self, frame: bytes):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(frame)
+
+    async def get(self) -> bytes:
+        return await self.queue.get()
+
+
+class BroadcastHub:
+    def __init__(self, queue_size: int = 1):
+        self.queue_size = queue_size
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        # frames dropped by subscribers that are gone
+        self.dropped_before = 0
+
+    def __len__(self) -> int:
+        return len(self.subscribers)
+
+    def subscribe(self, subscriber=None):
+        """
+        Add a subscriber (a new Subscriber by default) and return it
+        """
+        if subscriber is None:
+            subscriber = Subscriber(self.queue_size)
+        with self.lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.discard(subscriber)
+                self.dropped_before += subscriber.dropped
+
+    def dropped(self) -> int:
+        """
+        Frames thrown away because a subscriber did not keep up, ever (including the ones that left)
+        """
+        with self.lock:
+            return self.dropped_before + sum(subscriber.dropped for subscriber in self.subscribers)
+
+    def publish(self, data, event: str = None, id=None) -> int:
+        """
+        Serialize data once and hand it to every subscriber
+
+        Returns the number of subscribers it was delivered to.
+        Nothing is serialized when nobody is listening.
+        """
+        return self.publish_many([(data, event, id)])
+
+    def publish_many(self, messages) -> int:
+        """
+        Publish several (data, event, id) messages as one delivery
+
+        They take up one slot in each mailbox, so a message that comes with a frame (an onset) is not
+        pushed out of a latest-wins mailbox by the frame it came with.
+        """
+        with self.lock:
+            subscribers = list(self.subscribers)
+        if not subscribers:
+            return 0
+        frame = b"".join(sse_frame(data, event, id) for data, event, id in messages)
+        for subscriber in subscribers:
+            subscriber.deliver(frame)
+        return len(subscribers)
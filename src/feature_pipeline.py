@@ -0,0 +1,307 @@
+"""
+Per-chunk feature extraction pipeline
+
+Features used to be computed all over the place (avg/peak in the ingest routes, bands in /fft_audio,
+pulse in librosa_analysis), each starting from the raw chunk again.
+Now every feature is a stage that declares what it needs:
+    - inputs given to run(): chunk (interleaved, as the client sent it), mono (normalized to [-1, 1]),
+      samplerate, channels, full_scale, received (unix time)
+    - intermediates shared between stages, computed at most once per chunk:
+      abs, window, spectrum (rfft of the windowed mono chunk), magnitude, power, frequencies
+    - other stages
+
+Only the stages something subscribed to are run when the chunk comes in. Any other stage is computed
+the first time somebody asks the chunk's FeatureRecord for it (once, however many people ask).
+Stateful stages (the tempo tracker, the onset detector) have to see every chunk in order,
+so they are only ever run at ingest, and only while subscribed.
+
+    pipeline = FeaturePipeline()
+    add_standard_stages(pipeline)
+    pipeline.subscribe('rms')
+    record = pipeline.run(seq, chunk=chunk, mono=mono, samplerate=48000, channels=1, full_scale=1.0)
+    pipeline.finish(record)
+    record['rms'], record['centroid']
+"""
+import functools
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+from band_analysis import bands_from_magnitude
+import librosa_analysis
+from onset_detector import OnsetDetector
+
+
+class FeatureRecord:
+    """
+    Features of one chunk
+
+    Everything goes through get(), which computes (and keeps) whatever was not computed yet.
+    The record only ever grows, readers can hold on to it without locking.
+    """
+    def __init__(self, pipeline, seq: int, inputs: dict, known: dict = None):
+        self.pipeline = pipeline
+        self.seq = seq
+        # inputs and intermediates
+        self.inputs = dict(inputs)
+        # stage results
+        self.values = dict(known or {})
+        self.lock = threading.RLock()
+
+    def __getitem__(self, name: str):
+        return self.get(name)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.values
+
+    def get(self, name: str):
+        if name in self.values:
+            return self.values[name]
+        if name in self.inputs:
+            return self.inputs[name]
+        with self.lock:
+            if name in self.values:
+                return self.values[name]
+            if name in self.inputs:
+                return self.inputs[name]
+            if name in self.pipeline.intermediates:
+                inputs, compute = self.pipeline.intermediates[name]
+                self.inputs[name] = self.pipeline.call(name, compute, [self.get(argument) for argument in inputs])
+                return self.inputs[name]
+            if name in self.pipeline.stages:
+                inputs, compute, stateful = self.pipeline.stages[name]
+                if stateful:
+                    # only runs at ingest, nothing to give out if it was not subscribed then
+                    return None
+                self.values[name] = self.pipeline.call(name, compute, [self.get(argument) for argument in inputs])
+                return self.values[name]
+        raise KeyError(f"unknown feature {name}")
+
+    def as_dict(self, names=None) -> dict:
+        """
+        The given features (default: everything already computed) as a plain dict
+        """
+        if names is None:
+            return dict(self.values)
+        return {name: self.get(name) for name in names}
+
+
+class FeaturePipeline:
+    def __init__(self):
+        # name -> (input names, compute)
+        self.intermediates = dict()
+        # name -> (input names, compute, stateful)
+        self.stages = dict()
+        self.subscriptions = Counter()
+        self.lock = threading.Lock()
+        # observe(name, seconds) is told how long each stage/intermediate took, not including its inputs
+        self.observe = None
+
+    def add_intermediate(self, name: str, inputs: tuple, compute):
+        self.intermediates[name] = (tuple(inputs), compute)
+
+    def add_stage(self, name: str, inputs: tuple, compute, stateful: bool = False):
+        """
+        compute(*inputs) returns the value of the feature
+        """
+        self.stages[name] = (tuple(inputs), compute, stateful)
+
+    def call(self, name: str, compute, arguments: list):
+        observe = self.observe
+        if observe is None:
+            return compute(*arguments)
+        start = time.perf_counter()
+        value = compute(*arguments)
+        observe(name, time.perf_counter() - start)
+        return value
+
+    def subscribe(self, *names):
+        """
+        Run these stages on every chunk until unsubscribed (subscriptions are counted)
+        """
+        for name in names:
+            if name not in self.stages:
+                raise KeyError(f"unknown feature {name}")
+        with self.lock:
+            self.subscriptions.update(names)
+
+    def unsubscribe(self, *names):
+        with self.lock:
+            self.subscriptions.subtract(names)
+            self.subscriptions += Counter()
+
+    def subscribed(self) -> list:
+        """
+        Stages to run at ingest, in the order they were added
+        """
+        with self.lock:
+            return [name for name in self.stages if self.subscriptions[name] > 0]
+
+    def run(self, seq: int, known: dict = None, **inputs) -> FeatureRecord:
+        """
+        Build the record for a new chunk and run the subscribed stateful stages on it
+
+        These need the chunks one at a time and in order, so call it under the ingest lock,
+        then finish() for the rest.
+        known: feature values that are already known (e.g. avg/peak sent by a client), not recomputed
+        """
+        record = FeatureRecord(self, seq, inputs, known)
+        self.compute(record, stateful=True)
+        return record
+
+    def finish(self, record: FeatureRecord) -> FeatureRecord:
+        """
+        Run the subscribed stages that are not stateful, does not need the ingest lock
+        """
+        self.compute(record, stateful=False)
+        return record
+
+    def compute(self, record: FeatureRecord, stateful: bool):
+        for name in self.subscribed():
+            stage_inputs, compute, is_stateful = self.stages[name]
+            if is_stateful != stateful or name in record:
+                continue
+            if stateful:
+                record.values[name] = self.call(name, compute, [record.get(argument) for argument in stage_inputs])
+            else:
+                record.get(name)
+
+
+# intermediates
+@functools.lru_cache(maxsize=16)
+def hann(length: int):
+    return np.hanning(length).astype(np.float32)
+
+
+@functools.lru_cache(maxsize=16)
+def rfft_frequencies(length: int, samplerate: int):
+    return np.fft.rfftfreq(length, 1.0 / samplerate) if length else np.zeros(0)
+
+
+def absolute(chunk):
+    # np.abs of int16 -32768 wraps around to -32768, widen integer chunks first
+    if chunk.dtype.kind == 'i':
+        chunk = chunk.astype(np.float32)
+    return np.abs(chunk)
+
+
+def spectrum_of(mono, window):
+    return np.fft.rfft(mono * window) if len(mono) else np.zeros(0, dtype=np.complex64)
+
+
+def magnitude_of(spectrum, window):
+    # scaled so a full scale sine reads as 1.0 (same as band_analysis)
+    return np.abs(spectrum) * (2.0 / window.sum()) if len(window) else np.abs(spectrum)
+
+
+# stages
+def rms(chunk, full_scale: float) -> float:
+    if len(chunk) == 0:
+        return 0.0
+    samples = np.asarray(chunk, dtype=np.float32)
+    return float(np.sqrt(np.mean(samples * samples))) / full_scale
+
+
+def peak(absolute, full_scale: float) -> float:
+    return float(absolute.max()) / full_scale if len(absolute) else 0.0
+
+
+def average(absolute, full_scale: float) -> float:
+    return float(absolute.mean()) / full_scale if len(absolute) else 0.0
+
+
+def centroid(magnitude, frequencies) -> float:
+    """
+    "Center of mass" of the spectrum in Hz, brightness
+    """
+    total = magnitude.sum()
+    return float((frequencies * magnitude).sum() / total) if total > 0 else 0.0
+
+
+def rolloff(power, frequencies, fraction: float = 0.85) -> float:
+    """
+    Frequency below which fraction of the energy is
+    """
+    cumulative = np.cumsum(power)
+    if len(cumulative) == 0 or cumulative[-1] <= 0:
+        return 0.0
+    return float(frequencies[np.searchsorted(cumulative, fraction * cumulative[-1])])
+
+
+def flatness(power) -> float:
+    """
+    Geometric over arithmetic mean of the power spectrum: ~1 for noise, ~0 for a tone
+    """
+    if len(power) == 0:
+        return 0.0
+    power = power + 1e-12
+    return float(np.exp(np.mean(np.log(power))) / np.mean(power))
+
+
+def add_standard_stages(pipeline: FeaturePipeline):
+    """
+    The shared intermediates and the stateless features that only need them
+    """
+    pipeline.add_intermediate('abs', ('chunk',), absolute)
+    pipeline.add_intermediate('window', ('mono',), lambda mono: hann(len(mono)))
+    pipeline.add_intermediate('spectrum', ('mono', 'window'), spectrum_of)
+    pipeline.add_intermediate('magnitude', ('spectrum', 'window'), magnitude_of)
+    pipeline.add_intermediate('power', ('magnitude',), np.square)
+    pipeline.add_intermediate('frequencies', ('mono', 'samplerate'), lambda mono, samplerate: rfft_frequencies(len(mono), samplerate))
+
+    pipeline.add_stage('rms', ('chunk', 'full_scale'), rms)
+    pipeline.add_stage('peak', ('abs', 'full_scale'), peak)
+    pipeline.add_stage('avg', ('abs', 'full_scale'), average)
+    pipeline.add_stage('centroid', ('magnitude', 'frequencies'), centroid)
+    pipeline.add_stage('rolloff', ('power', 'frequencies'), rolloff)
+    pipeline.add_stage('flatness', ('power',), flatness)
+
+
+def server_pipeline(config) -> tuple:
+    """
+    The server's pipeline, built from the flask config (FFT_*, TEMPO_*, ONSET_* settings)
+
+    Used by flask_server and by the analysis worker process, which builds its own copy.
+    Returns (pipeline, tempo analyzer or None, onset detector or None)
+    """
+    pipeline = FeaturePipeline()
+    add_standard_stages(pipeline)
+    # bars and the audio stats need these for every chunk
+    pipeline.subscribe('peak', 'avg')
+
+    def bands(magnitude, mono, samplerate: int) -> list:
+        if len(mono) == 0:
+            return [0.0] * config['FFT_BANDS']
+        return bands_from_magnitude(magnitude, len(mono), samplerate,
+                                    num_bands=config['FFT_BANDS'],
+                                    fmin=config['FFT_MIN_FREQ'],
+                                    fmax=config['FFT_MAX_FREQ'],
+                                    scale=config['FFT_BAND_SCALE']).tolist()
+
+    pipeline.add_stage('bands', ('magnitude', 'mono', 'samplerate'), bands)
+
+    # tempo/beat analysis
+    # NOTE: librosa is only imported if TEMPO_BACKEND is 'librosa'
+    tempo_analyzer = None
+    if config['TEMPO_TRACKING']:
+        tempo_analyzer = librosa_analysis.Analyzer(backend=config['TEMPO_BACKEND'],
+                                                   hop_length=config['TEMPO_HOP_LENGTH'],
+                                                   min_bpm=config['TEMPO_MIN_BPM'],
+                                                   max_bpm=config['TEMPO_MAX_BPM'])
+        pipeline.add_stage('pulse', ('mono', 'samplerate'), tempo_analyzer.readData, stateful=True)
+        pipeline.subscribe('pulse')
+
+    onset_detector = None
+    if config['ONSET_DETECTION']:
+        onset_detector = OnsetDetector(median_frames=config['ONSET_MEDIAN_FRAMES'],
+                                       ratio=config['ONSET_RATIO'],
+                                       spread=config['ONSET_SPREAD'],
+                                       delta=config['ONSET_DELTA'],
+                                       min_interval=config['ONSET_MIN_INTERVAL'])
+        # shares the spectrum with the other stages, one rfft per chunk
+        pipeline.add_stage('onset', ('mono', 'samplerate', 'received', 'spectrum'), onset_detector.process,
+                           stateful=True)
+        pipeline.subscribe('onset')
+    return pipeline, tempo_analyzer, onset_detector
@@ -3,4 +3,124 @@ CELERY=dict(
     broker_url="redis://127.0.0.1",
         result_backend="redis://127.0.0.1",
         task_ignore_result=True,
-)
\ No newline at end of file
+)
+# audio
+# number of past chunks used for the "peak" sent to the frontend
+AUDIO_SAVED_CHUNKS = 5
+# seconds of samples kept in the audio history ring buffer
+AUDIO_HISTORY_SECONDS = 10
+# number of per-chunk stats (time, peak, avg) kept
+AUDIO_HISTORY_CHUNKS = 1024
+
+# fft_audio bands
+FFT_BANDS = 8
+FFT_MIN_FREQ = 40.0
+FFT_MAX_FREQ = 16000.0
+# 'log' or 'mel' spacing between FFT_MIN_FREQ and FFT_MAX_FREQ
+FFT_BAND_SCALE = 'log'
+
+# tempo/beat tracking (librosa_analysis.py)
+TEMPO_TRACKING = True
+# 'tracker' (incremental, numpy only) or 'librosa' (librosa.beat.plp, imported on first use)
+TEMPO_BACKEND = 'tracker'
+# run the backend on synthetic audio in the background at startup, so the first real chunk does not pay
+# for the librosa import/JIT
+ANALYSIS_WARM_UP = True
+# samples per onset strength value
+TEMPO_HOP_LENGTH = 512
+TEMPO_MIN_BPM = 60.0
+TEMPO_MAX_BPM = 200.0
+
+# onset ("hit") detection (onset_detector.py)
+ONSET_DETECTION = True
+# chunks the threshold is taken over, an onset has to be above median * ONSET_RATIO
+# and median + ONSET_SPREAD * median absolute deviation, plus ONSET_DELTA
+ONSET_MEDIAN_FRAMES = 32
+ONSET_RATIO = 1.5
+ONSET_SPREAD = 5.0
+ONSET_DELTA = 1e-5
+# seconds before another onset can fire
+ONSET_MIN_INTERVAL = 0.05
+# onsets kept for /onsets
+ONSET_HISTORY = 256
+
+# analysis worker process (analysis_worker.py), off by default: the analysis runs in the request that got the chunk
+ANALYSIS_WORKER = False
+# chunks/results held in the shared memory rings between the server and the worker
+ANALYSIS_WORKER_SLOTS = 64
+# biggest chunk (bytes of PCM) the worker takes, bigger chunks are not analysed
+ANALYSIS_WORKER_CHUNK_BYTES = 256 * 1024
+# features the worker computes for every chunk (None: all of them)
+ANALYSIS_WORKER_FEATURES = None
+
+# state shared between server processes (shared_state.py), off by default: one process, state in module globals
+# path of the file it is kept in, the same for every process, e.g. /dev/shm/creativity-optional-state
+SHARED_STATE = None
+# chunks kept in the shared audio ring, and the biggest chunk (bytes of PCM) it takes
+SHARED_STATE_CHUNKS = 64
+SHARED_STATE_CHUNK_BYTES = 256 * 1024
+# biggest general data / client settings (bytes of json)
+SHARED_STATE_DATA_BYTES = 256 * 1024
+# features of each chunk the other processes get (None: all of them), they have no chunk to compute the rest from
+SHARED_STATE_FEATURES = None
+# seconds between checks for chunks/settings from the other processes
+SHARED_STATE_POLL = 0.005
+
+# most seconds a /general_changes long poll waits for a change
+# NOTE: with flask run each waiting poll holds a thread for up to this long. asgi_server.py serves the
+# route on its event loop instead, so the polls do not use up the ASGI_WSGI_WORKERS threads
+GENERAL_POLL_TIMEOUT = 25.0
+# history of the numeric general data (general_history.py): values kept as written, per key
+GENERAL_HISTORY_RAW = 1024
+# (bucket seconds, buckets kept) per downsampled tier: 10 minutes of 1s, 2 hours of 10s, a day of 1min
+GENERAL_HISTORY_TIERS = [[1, 600], [10, 720], [60, 1440]]
+# most buckets one /general_history query returns
+GENERAL_HISTORY_MAX_BUCKETS = 2000
+
+# saving the general data, client settings, general history and audio stats/onsets to disk (persistence.py)
+# directory they go in, None: nothing is saved
+PERSIST_DIR = None
+# seconds between snapshots, the changes in between go in an append-only log
+PERSIST_SNAPSHOT_SECONDS = 60.0
+
+# latency tracing (see latency.py)
+# times kept per source and stage for the percentiles at /latency
+LATENCY_HISTORY = 1000
+# every n-th /audio_stream frame asks the viewer to ack it (0: never)
+LATENCY_ACK_EVERY = 10
+
+# /audio_stream
+# features (see feature_pipeline.py) added to every frame, 'bands' goes in as "frequencies"
+STREAM_FEATURES = ['bands', 'pulse']
+# frames buffered per viewer before the oldest is dropped
+STREAM_QUEUE_SIZE = 1
+# seconds between keepalive comments on an idle stream
+STREAM_KEEPALIVE_SECONDS = 15
+
+# websocket flow control
+# load is the time the server spends on a chunk divided by the length of the chunk (smoothed)
+# above FLOW_SLOW_LOAD the client is told to slow down, below FLOW_OK_LOAD it is told it can speed up again
+FLOW_SLOW_LOAD = 0.8
+FLOW_OK_LOAD = 0.5
+
+# framed TCP audio stream (stream_ingest.py), set the port to 0 to turn it off
+STREAM_INGEST_HOST = "0.0.0.0"
+STREAM_INGEST_PORT = 4242
+
+# UDP audio (udp_ingest.py), set the port to 0 to turn it off
+UDP_INGEST_HOST = "0.0.0.0"
+UDP_INGEST_PORT = 4243
+# datagrams held / seconds waited for a missing datagram before it counts as lost
+UDP_JITTER_DEPTH = 16
+UDP_JITTER_DELAY = 0.02
+# seconds without a datagram before a UDP sender is forgotten (a restarted client sends from a new port)
+UDP_IDLE_SECONDS = 5.0
+
+# asgi_server.py
+ASGI_HOST = "0.0.0.0"
+ASGI_PORT = 8000
+# seconds an idle keep-alive connection is kept open
+ASGI_KEEP_ALIVE_SECONDS = 75
+# threads that run the (non-async) flask routes, the long-lived ones (/audio_stream, /general_changes)
+# are native async in asgi_server.py and do not take one
+ASGI_WSGI_WORKERS = 16
@@ -7,8 +7,28 @@ NOTE: technically, the "client" application "serves" raw audio/data to this appl
 
 Technical:
 audio is posted to ip/audio_in
+audio features are pushed to viewers at ip/audio_stream (Server-Sent Events)
+tempo/beat (bpm, beat phase, pulse) is at ip/tempo
+onsets ("hits") are at ip/onsets?since=<id> and are pushed as "onset" events on ip/audio_stream
+any per-chunk feature (rms, centroid, rolloff, flatness, bands, ...) is at ip/features?names=...
+general data is posted to ip/general_in and read at ip/general_keys/<key> (ETag/304),
+ip/general_bulk reads/writes many keys in one request,
+ip/general_history/<key>?start=&end=&resolution= has min/max/mean buckets of a numeric key over time,
+ip/general_changes?since=<version> long polls for the keys that changed
+ip/latency has the per-source latency breakdown from capture to the frontend (see latency.py),
+viewers ack the frames that ask for it at ip/audio_ack
 video should be available at ip/output and ip/output/stream
 
+More than one server process: set SHARED_STATE to a file (e.g. on /dev/shm) and every process keeps the
+chunks, features, general data and client settings in it (shared_state.py). Each process still runs the
+pipeline on the chunks it receives, so a capture client should stay on one process (one connection).
+
+Metrics (request/ingest latency histograms, chunk counters, queue and buffer gauges) are at ip/metrics
+in the prometheus text format, see metrics.py. They are per process.
+
+Restarts: set PERSIST_DIR and the general data, client settings and recent audio stats are saved there
+(persistence.py) and restored on startup.
+
 
 might want to open a second port for the audio if we are *slow* because of the constant audio requests
 - this is not a concern at the moment
@@ -23,29 +43,121 @@ Tasks:
 [TODO] clean up audio handling
 [TODO] deal with keep-alive connections
 
+Audio ingest:
+/audio_in accepts the original JSON payload ({"avg", "peak", "data"})
+/audio_in/binary accepts raw PCM bytes, described by the X-Audio-* headers below,
+and wraps the body with np.frombuffer so the samples are never copied or parsed
+
 """
-from flask import Flask, render_template, request, jsonify, abort
-from werkzeug.serving import WSGIRequestHandler
+from flask import Flask, Response, render_template, request, jsonify, abort
+from flask_socketio import SocketIO, emit
+from werkzeug.serving import WSGIRequestHandler, is_running_from_reloader
 import numpy as np
 import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from ring_buffer import RingBuffer
+from audio_snapshot import AudioSnapshot
+from general_store import GeneralStore
+from general_history import GeneralHistory
+from feature_pipeline import server_pipeline
+from analysis_worker import AnalysisWorker, WorkerRecord, CHUNK_META, pack_chunk, unpack_chunk
+from shared_state import SharedState
+from persistence import Persistence
+from broadcast import BroadcastHub
+from metrics import Registry
+from latency import LatencyTracker
+import librosa_analysis
+from stream_ingest import StreamIngestServer
+from udp_ingest import UdpIngestServer
 
 
 flask_app = Flask(__name__, template_folder='.')
 flask_app.logger.setLevel(logging.DEBUG)
+flask_app.config.from_pyfile('flask_config.py')
+# any setting can be overridden with a FLASK_ prefixed environment variable, e.g. FLASK_AUDIO_HISTORY_SECONDS=30
+flask_app.config.from_prefixed_env()
+# async_handlers=False: events from one client are handled in order, otherwise audio chunks race each other
+# TODO: the actual CORS policy
+socketio = SocketIO(flask_app, cors_allowed_origins="*", async_handlers=False)
 
-audio_str = ""
-audio_raw_max = 0
-AUDIO_SAVED_CHUNKS = 5
-audio_last = []
-audio_max_last = audio_raw_max
-# TODO: find a good way to store many past chunks (preferably both push and pop are o(1))
-audio_chunk = []
+# everything the routes serve about the latest chunk, replaced as a whole once the chunk is analysed
+# read it once into a local and use that, see audio_snapshot.py
+audio_snapshot = AudioSnapshot()
+# max_last is the loudest peak of the last AUDIO_SAVED_CHUNKS chunks
+AUDIO_SAVED_CHUNKS = flask_app.config['AUDIO_SAVED_CHUNKS']
+# ingest side: samplerate/name of the mic the chunks come from now, the routes go by audio_snapshot
+audio_samplerate = 48000
+audio_source = ""
+# history of the last AUDIO_HISTORY_SECONDS of (mono) samples, reallocated if the samplerate changes
+AUDIO_HISTORY_SECONDS = flask_app.config['AUDIO_HISTORY_SECONDS']
+audio_history = RingBuffer(int(AUDIO_HISTORY_SECONDS * audio_samplerate))
+# one row per chunk: (time received, peak, avg)
+audio_stats = RingBuffer(flask_app.config['AUDIO_HISTORY_CHUNKS'], dtype=np.float64, width=3)
+# only one chunk is ingested at a time, the ring buffers have a single writer
+ingest_lock = threading.Lock()
+# every feature of a chunk goes through the pipeline and ends up in its FeatureRecord (see feature_pipeline.py)
+# the tempo analyzer and onset detector are stateful stages of it
+features, tempo_analyzer, onset_detector = server_pipeline(flask_app.config)
+# snapshots of the chunks at the analysis worker, by seq
+pending_snapshots = dict()
+# set at the bottom if ANALYSIS_WORKER is on, then the pipeline above only runs in the worker process
+analysis_worker = None
+# set at the bottom if SHARED_STATE is set, see sync_shared_state()
+shared_state = None
+# set by start_background_servers() if PERSIST_DIR is set, see capture_state()
+persistence = None
+# features of each chunk put in the shared state for the other processes (None: all of them)
+SHARED_FEATURES = flask_app.config['SHARED_STATE_FEATURES']
+# one row per onset: (id, sample, time, strength)
+ONSET_FIELDS = ("id", "sample", "time", "strength")
+audio_onsets = RingBuffer(flask_app.config['ONSET_HISTORY'], dtype=np.float64, width=len(ONSET_FIELDS))
+# features added to every /audio_stream frame
+STREAM_FEATURES = flask_app.config['STREAM_FEATURES']
+# viewers subscribed to /audio_stream
+audio_hub = BroadcastHub(flask_app.config['STREAM_QUEUE_SIZE'])
+# number of chunks received, used to tell when the audio has changed
+audio_seq = 0
+# last sequence number sent by each client, by source (every client numbers its own chunks)
+# least recently heard from first, only the newest CLIENT_SEQ_SOURCES are kept
+client_seqs = OrderedDict()
+CLIENT_SEQ_SOURCES = 64
 # TODO: gracefully handle client settings
 change_settings = False
 client_audio_settings = dict()
 
-# general data
-general_data = dict()
+# general data, versioned (see general_store.py)
+general_data = GeneralStore()
+# time series of the numeric keys, for trends (see general_history.py)
+general_history = GeneralHistory(flask_app.config['GENERAL_HISTORY_RAW'], flask_app.config['GENERAL_HISTORY_TIERS'])
+
+# metrics (see metrics.py), the ones recorded on every chunk/request are looked up once and kept
+metrics = Registry()
+# route -> histogram, filled in as routes are first used
+route_seconds = dict()
+# decode: request body to samples, analysis: feature pipeline, serialize: stream frames and shared state
+INGEST_SECONDS = {stage: metrics.histogram("audio_ingest_seconds", "Time spent on each chunk, by ingest stage", stage=stage)
+                  for stage in ("decode", "analysis", "serialize")}
+chunks_received = metrics.counter("audio_chunks_received_total", "Audio chunks ingested")
+chunks_missed = metrics.counter("audio_chunks_missed_total", "Chunks a client numbered but that never arrived")
+worker_seconds = metrics.histogram("analysis_worker_seconds", "Time from receiving a chunk to the worker finishing it")
+# stage/intermediate name -> histogram
+feature_seconds = dict()
+
+# capture to frontend latency, per source (see latency.py)
+latency = LatencyTracker(flask_app.config['LATENCY_HISTORY'])
+LATENCY_ACK_EVERY = flask_app.config['LATENCY_ACK_EVERY']
+
+# binary ingest
+# dtypes a client is allowed to send, and the value that counts as full scale for each
+BINARY_DTYPES = {
+    'float32': 1.0,
+    'int16': 32768.0,
+}
 
 
 @flask_app.route("/")
@@ -68,6 +180,8 @@ def get_audio_settings():
             for token in data['settings']:
                 client_audio_settings[token] = data[token]
             change_settings = True
+            push_settings(client_audio_settings)
+            settings_changed(push=True)
         else:
             response['message'] = "Error: settings must be a dict in a 'settings' key"
         return jsonify(response)
@@ -75,6 +189,19 @@ def get_audio_settings():
         return jsonify({"settings": client_audio_settings})
 
 
+# extra functions called with the new settings whenever they change (e.g. the asgi server's websockets)
+settings_listeners = []
+
+def push_settings(settings: dict):
+    """
+    Websocket and stream clients get new settings right away instead of on their next chunk
+    """
+    socketio.emit('settings', settings, namespace=AUDIO_NAMESPACE)
+    stream_ingest.send_settings(settings)
+    for listener in settings_listeners:
+        listener(settings)
+
+
 @flask_app.route("/audio_in", methods=['GET', 'POST'])
 def audio_in():
     """
@@ -84,49 +211,688 @@ def audio_in():
     It is also called by the frontend UI to test the dynamic site,
     although this will might change in the future.
     When compared to performance of minimal udp packets, there was only a difference of 0.01 seconds of latency (0.22 vs 0.21)
+    (/latency has the live numbers now, per stage)
 
 
     TODO: change how setting changes are communicated back to the client
     client is expecting 'settings' key that contains any updated settings
     """
-    # TODO: change this later, it is just for testing and the MVP apparently
-    global audio_str
-    global audio_source
-    global audio_chunk
-    global audio_raw_max
-    global audio_last
-    global audio_max_last
-    global AUDIO_SAVED_CHUNKS
-    global change_settings
     if request.method == 'POST':
+        start = time.perf_counter()
         data = request.json
-        audio_chunk = np.array(data['data']).reshape(-1)
-        rpeak = float(data['peak'])
-        ravg = float(data['avg'])
-        audio_raw_max = rpeak
-        # NOTE: all of this computation is better done in a celery task, but since those arent set up yet,
-        # doing basic analysis here
-        # NOTE: celery tasks may never be implemented because we no longer have a need for them (no librosa)
-        audio_last.append(rpeak)
-        if (len(audio_last) > AUDIO_SAVED_CHUNKS):
-            audio_last.pop(0)
-
-        audio_max_last = max(audio_last)
-        bars = "#" * int(50 * ravg)
-        mbars = "-" * int((50 * rpeak) - (50 * ravg))
-        audio_str = bars + mbars
-        response = {"bars": audio_str}
-
-        if change_settings:
-            response['setting_change'] = change_settings
-            change_settings = False
-        return jsonify(response)
+        chunk = np.array(data['data'])
+        INGEST_SECONDS['decode'].observe(time.perf_counter() - start)
+        channels = chunk.shape[1] if chunk.ndim == 2 else 1
+        ingest_audio(chunk.reshape(-1),
+                     peak=float(data['peak']),
+                     avg=float(data['avg']),
+                     channels=channels,
+                     source=data.get('source'),
+                     captured=data.get('capture_time'))
+        return jsonify(audio_response())
     else:
-        response = jsonify({"bars": audio_str, "peak": audio_max_last, "source": audio_source})
+        snapshot = audio_snapshot
+        response = jsonify({"bars": snapshot.bars, "peak": snapshot.max_last, "source": snapshot.source})
         # TODO: the actual CORS policy
         response.headers.add("Access-Control-Allow-Origin", "*")
         return response
 
+@flask_app.route("/audio_in/binary", methods=['POST'])
+def audio_in_binary():
+    """
+    Binary implementation of /audio_in
+
+    The body is raw interleaved PCM, described by headers:
+    X-Audio-Dtype: float32 or int16 (default float32)
+    X-Audio-Channels: number of interleaved channels (default 1)
+    X-Audio-Samplerate: samples per second (default 48000)
+    X-Audio-Seq: sequence number of the chunk, used to spot dropped chunks (optional)
+    X-Audio-Source: name of the microphone (optional)
+    X-Audio-Capture-Time: unix time the last sample was recorded, for the latency breakdown (optional)
+
+    The body is wrapped with np.frombuffer, so there is no JSON encoding on the client
+    and no parsing or copying on the server. avg/peak are computed by the feature pipeline instead of by the client.
+    """
+    status, response = ingest_binary_request(request.get_data(cache=False), request.headers)
+    return jsonify(response), status
+
+def ingest_binary_request(body: bytes, headers) -> tuple:
+    """
+    Handle a /audio_in/binary request, shared with the asgi server
+
+    headers is any case-insensitive mapping (werkzeug Headers)
+    Returns (status code, response dict)
+    """
+    try:
+        channels = int(headers.get('X-Audio-Channels', 1))
+        samplerate = int(headers.get('X-Audio-Samplerate', audio_samplerate))
+        seq = headers.get('X-Audio-Seq')
+        seq = int(seq) if seq is not None else None
+        captured = headers.get('X-Audio-Capture-Time')
+        captured = float(captured) if captured is not None else None
+    except ValueError:
+        return 400, {"message": "Error: X-Audio-Channels, X-Audio-Samplerate and X-Audio-Seq must be integers, "
+                                "X-Audio-Capture-Time a number"}
+    try:
+        ingest_binary(body,
+                      dtype=headers.get('X-Audio-Dtype', 'float32'),
+                      channels=channels,
+                      samplerate=samplerate,
+                      seq=seq,
+                      source=headers.get('X-Audio-Source'),
+                      captured=captured)
+    except ValueError as error:
+        return 400, {"message": f"Error: {error}"}
+    return 200, audio_response()
+
+def ingest_binary(body: bytes, dtype: str = 'float32', channels: int = 1, samplerate: int = None,
+                  seq: int = None, source: str = None, captured: float = None):
+    """
+    Wrap raw PCM bytes with np.frombuffer (no copy) and ingest them
+
+    Used by every binary transport. Raises ValueError if the bytes do not match the description.
+    """
+    start = time.perf_counter()
+    if dtype not in BINARY_DTYPES:
+        raise ValueError(f"unsupported dtype {dtype}, expected one of {list(BINARY_DTYPES)}")
+    itemsize = np.dtype(dtype).itemsize
+    if channels < 1 or len(body) % (itemsize * channels) != 0:
+        raise ValueError(f"body of {len(body)} bytes is not a whole number of {channels} channel {dtype} frames")
+
+    chunk = np.frombuffer(body, dtype=dtype)
+    INGEST_SECONDS['decode'].observe(time.perf_counter() - start)
+    # avg/peak come from the feature pipeline
+    ingest_audio(chunk,
+                 channels=channels,
+                 full_scale=BINARY_DTYPES[dtype],
+                 samplerate=samplerate,
+                 seq=seq,
+                 source=source,
+                 captured=captured)
+
+def ingest_audio(chunk, peak: float = None, avg: float = None, channels: int = 1, full_scale: float = 1.0,
+                 samplerate: int = None, seq: int = None, source: str = None, captured: float = None):
+    """
+    Store a new audio chunk and run the feature pipeline on it
+
+    Shared by every audio transport, chunk is a flat (interleaved) array of samples
+    peak/avg are only given by clients that compute them themselves, otherwise the pipeline does
+    full_scale is the sample value that counts as 1.0 (32768 for int16), used for the history
+    seq is the client's sequence number, if it skips ahead the missing chunks are logged.
+    It is separate from audio_seq, which always counts up, because clients restart their count.
+    Each source is followed on its own, a seq that goes back means that client restarted
+    captured is the unix time (client clock) the last sample was recorded, if the client knows it
+    """
+    global audio_seq
+    with ingest_lock:
+        received = time.time()
+        chunks_received.inc()
+        if seq is not None:
+            last = client_seqs.pop(source, None)
+            if last is not None and seq > last + 1:
+                flask_app.logger.debug(f"missed {seq - last - 1} audio chunks from {source}")
+                chunks_missed.inc(seq - last - 1)
+            client_seqs[source] = seq
+            if len(client_seqs) > CLIENT_SEQ_SOURCES:
+                client_seqs.popitem(last=False)
+        mono = store_chunk(chunk, channels, full_scale, samplerate, source)
+        if shared_state is not None:
+            # the shared ring numbers the chunks, so every process agrees on the seq
+            audio_seq = share_chunk(chunk, channels, full_scale, received)
+        else:
+            audio_seq += 1
+        snapshot = AudioSnapshot(audio_seq, chunk, channels, audio_samplerate, full_scale, audio_source, received,
+                                 captured)
+        if analysis_worker is not None:
+            # copy it over to the worker and we are done, worker_record() swaps the snapshot in
+            if analysis_worker.submit(chunk, audio_seq, channels, audio_samplerate, full_scale, received, peak, avg):
+                pending_snapshots[audio_seq] = snapshot
+            return
+        known = {'peak': peak, 'avg': avg} if peak is not None and avg is not None else None
+        start = time.perf_counter()
+        record = features.run(audio_seq, known, chunk=chunk, mono=mono, samplerate=audio_samplerate,
+                              channels=channels, full_scale=full_scale, received=received)
+        analysis = time.perf_counter() - start
+        snapshot, onset = update_features(record, snapshot)
+
+    # outside the lock, the fft should not hold up the next chunk
+    start = time.perf_counter()
+    features.finish(record)
+    finished = time.perf_counter()
+    INGEST_SECONDS['analysis'].observe(analysis + finished - start)
+    track_latency(snapshot, time.time())
+    if shared_state is not None:
+        share_features(snapshot)
+    publish_features(snapshot, onset)
+    INGEST_SECONDS['serialize'].observe(time.perf_counter() - finished)
+
+def store_chunk(chunk, channels: int, full_scale: float, samplerate: int = None, source: str = None):
+    """
+    Add a chunk to the history, returns it as mono in [-1, 1]
+
+    Called with ingest_lock held
+    """
+    global audio_source
+    global audio_samplerate
+    global audio_history
+    if samplerate is not None and samplerate != audio_samplerate:
+        audio_samplerate = samplerate
+        audio_history = RingBuffer(int(AUDIO_HISTORY_SECONDS * audio_samplerate))
+    if source is not None:
+        audio_source = source
+
+    # the history is mono and normalized to [-1, 1] so it does not care what the client sent
+    mono = chunk.reshape(-1, channels).mean(axis=1) if channels > 1 else chunk
+    mono = mono / full_scale if full_scale != 1.0 else mono
+    audio_history.append(mono)
+    return mono
+
+def update_features(record, snapshot: AudioSnapshot) -> tuple:
+    """
+    Swap in the snapshot of a new chunk, completed with its features, returns (snapshot, onset)
+
+    Called with ingest_lock held
+    """
+    global audio_snapshot
+    peak = record['peak']
+    avg = record['avg']
+    audio_stats.append((snapshot.received, peak, avg))
+    onset = record['onset'] if 'onset' in features.stages else None
+    onset_row = [onset[field] for field in ONSET_FIELDS] if onset is not None else None
+    if onset_row is not None:
+        audio_onsets.append(onset_row)
+    if persistence is not None:
+        persistence.record('chunk', [snapshot.received, peak, avg, onset_row])
+
+    # NOTE: the heavy analysis can run in its own process instead (ANALYSIS_WORKER), celery was the old plan
+    recent, wrapped = audio_stats.views(AUDIO_SAVED_CHUNKS)
+    max_last = float(max(recent[:, 1].max(), wrapped[:, 1].max(initial=0)))
+    bars = "#" * int(50 * avg)
+    mbars = "-" * int((50 * peak) - (50 * avg))
+    # the one write readers can see, everything about the chunk changes at once
+    audio_snapshot = snapshot.replace(raw_max=peak, max_last=max_last, bars=bars + mbars, features=record)
+    return audio_snapshot, onset
+
+def wants_ack(seq: int) -> bool:
+    """
+    Whether the viewers are asked to ack this chunk's frame
+    """
+    return LATENCY_ACK_EVERY > 0 and seq % LATENCY_ACK_EVERY == 0
+
+def track_latency(snapshot: AudioSnapshot, analysed: float):
+    """
+    The chunk is analysed, add its times to the latency breakdown
+    """
+    frames = len(snapshot.chunk) // snapshot.channels
+    latency.chunk(snapshot.seq, snapshot.source or "unknown", frames / snapshot.samplerate, snapshot.captured,
+                  snapshot.received, analysed, ack=wants_ack(snapshot.seq) and len(audio_hub) > 0)
+
+def publish_features(snapshot: AudioSnapshot, onset):
+    """
+    Push a chunk's frame (and onset) to the /audio_stream viewers
+    """
+    if len(audio_hub) > 0:
+        frame = {"seq": snapshot.seq, "time": snapshot.received, "bars": snapshot.bars, "peak": snapshot.max_last}
+        if snapshot.captured is not None:
+            # client clock, for measuring latency on one machine (testing/transport_benchmark.py)
+            frame["captured"] = snapshot.captured
+        if wants_ack(snapshot.seq):
+            # POST {"seq"} to /audio_ack once it is drawn
+            frame["ack"] = True
+        frame.update(stream_features(snapshot.features))
+        messages = [(frame, "audio", snapshot.seq)]
+        if onset is not None:
+            # same delivery as the frame, see BroadcastHub.publish_many
+            messages.append((onset, "onset", None))
+        audio_hub.publish_many(messages)
+
+def worker_record(record):
+    """
+    The analysis worker finished a chunk (runs in AnalysisWorker's results thread)
+    """
+    with ingest_lock:
+        snapshot = pending_snapshots.pop(record.seq, None)
+        for seq in [seq for seq in pending_snapshots if seq < record.seq]:
+            # skipped by the worker, it fell behind
+            del pending_snapshots[seq]
+        if snapshot is None:
+            snapshot = audio_snapshot.replace(seq=record.seq, received=record['received'])
+        snapshot, onset = update_features(record, snapshot)
+    # waiting in the ring included, the worker's own stage timings stay in the worker process
+    worker_seconds.observe(record['analysed'] - record['received'])
+    track_latency(snapshot, record['analysed'])
+    start = time.perf_counter()
+    if shared_state is not None:
+        share_features(snapshot)
+    publish_features(snapshot, onset)
+    INGEST_SECONDS['serialize'].observe(time.perf_counter() - start)
+
+# shared state (SHARED_STATE), rings:
+#   audio: chunks in the analysis worker's slot format, chunk seq n is in slot n - 1
+#   features: {"seq", "received", "source", "pid", feature: value, ...} per chunk
+#   general: the whole general data store (GeneralStore.to_dict), one slot per change
+#   settings: {"settings", "push", "pid"}, push: send them on to the capture clients
+def share_chunk(chunk, channels: int, full_scale: float, received: float) -> int:
+    """
+    Put a chunk in the shared audio ring, returns its seq (counts up across all the processes)
+    """
+    with shared_state.writing():
+        seq = shared_state.rings['audio'].count + 1
+        meta, samples = pack_chunk(chunk, seq, channels, audio_samplerate, full_scale, received)
+        try:
+            shared_state.write('audio', meta, samples)
+        except ValueError as error:
+            # the seq is still used up, the other processes just do not get the samples
+            flask_app.logger.warning(f"chunk {seq} not shared: {error}")
+            shared_state.write('audio', meta)
+    return seq
+
+def share_features(snapshot: AudioSnapshot):
+    """
+    Put the features of a chunk in the shared state for the other processes
+    """
+    message = snapshot.features.as_dict(SHARED_FEATURES or list(features.stages))
+    message.update(seq=snapshot.seq, received=snapshot.received, source=snapshot.source, pid=os.getpid())
+    try:
+        shared_state.write_json('features', message)
+    except ValueError as error:
+        flask_app.logger.warning(f"features of chunk {snapshot.seq} not shared: {error}")
+
+def settings_changed(push: bool = False):
+    """
+    client_audio_settings changed: save them and tell the other processes
+    """
+    if persistence is not None:
+        persistence.record('settings', dict(client_audio_settings))
+    if shared_state is None:
+        return
+    try:
+        shared_state.write_json('settings', {"settings": client_audio_settings, "push": push, "pid": os.getpid()})
+    except ValueError as error:
+        flask_app.logger.warning(f"settings not shared: {error}")
+
+def mirror_features(message: dict):
+    """
+    A chunk another process got, take it and its features as if it came in here
+    """
+    global audio_seq
+    data = shared_state.read('audio', message['seq'] - 1)
+    source = message.pop('source')
+    with ingest_lock:
+        snapshot = audio_snapshot.replace(seq=message['seq'], source=source, received=message['received'])
+        if data is not None:
+            _, channels, samplerate, full_scale, _, _, _, chunk = unpack_chunk(data)
+            if len(chunk):
+                store_chunk(chunk, channels, full_scale, samplerate, source)
+                snapshot = AudioSnapshot(message['seq'], chunk, channels, samplerate, full_scale, source, message['received'])
+        audio_seq = max(audio_seq, message['seq'])
+        snapshot, onset = update_features(WorkerRecord(message), snapshot)
+    publish_features(snapshot, onset)
+
+def mirror_settings(message: dict):
+    global change_settings
+    client_audio_settings.clear()
+    client_audio_settings.update(message['settings'])
+    if persistence is not None:
+        persistence.record('settings', message['settings'])
+    if message['push']:
+        change_settings = True
+        push_settings(client_audio_settings)
+
+# how far sync_shared_state() got in each ring
+shared_seen = {'features': 0, 'settings': 0}
+
+def sync_shared_state():
+    """
+    Apply what the other processes put in the shared state since the last call
+    """
+    for name, apply in (('features', mirror_features), ('settings', mirror_settings)):
+        ring = shared_state.rings[name]
+        count = ring.count
+        for seq in range(max(shared_seen[name], count - ring.slots), count):
+            message = shared_state.read_json(name, seq)
+            if message is not None and message.pop('pid') != os.getpid():
+                apply(message)
+        shared_seen[name] = count
+    sync_general()
+
+def follow_shared_state():
+    while True:
+        time.sleep(flask_app.config['SHARED_STATE_POLL'])
+        try:
+            sync_shared_state()
+        except Exception:
+            flask_app.logger.exception("applying the shared state failed")
+
+def stream_features(record) -> dict:
+    """
+    The STREAM_FEATURES of record, as they go in an /audio_stream frame
+    """
+    frame = dict()
+    for name in STREAM_FEATURES:
+        if name not in features.stages:
+            # e.g. pulse with TEMPO_TRACKING off
+            continue
+        value = record[name]
+        if name == 'bands':
+            # what /fft_audio always called them
+            frame['frequencies'] = value
+        elif isinstance(value, dict):
+            # e.g. pulse: bpm, beat_phase, pulse, ...
+            frame.update(value)
+        elif value is not None:
+            frame[name] = value
+    return frame
+
+def audio_response() -> dict:
+    """
+    Response sent back to an audio client after every chunk
+    """
+    global change_settings
+    response = {"bars": audio_snapshot.bars}
+    if change_settings:
+        response['setting_change'] = change_settings
+        change_settings = False
+    return response
+
+# WebSocket (socket.io) audio transport
+# one persistent connection per capture client, no per-chunk request/response
+#
+# client -> server:
+#   'settings' dict: the client's settings (what it would POST to /audio_settings)
+#   'audio_chunk' (meta, data): data is raw PCM bytes, meta is {dtype, channels, samplerate, seq, source}
+#                               the same fields /audio_in/binary takes as headers
+# server -> client:
+#   'settings' dict: settings changed on the server, apply them now
+#   'flow' {"state": "slow" or "ok"}: the server is falling behind real time, send fewer chunks until "ok"
+#   'error' {"message": ...}: the last chunk could not be used
+AUDIO_NAMESPACE = '/audio'
+# sid -> {"load": smoothed (time spent per chunk / length of chunk), "slow": last flow state sent}
+websocket_clients = dict()
+
+@socketio.on('connect', namespace=AUDIO_NAMESPACE)
+def websocket_connect():
+    websocket_clients[request.sid] = {"load": 0.0, "slow": False}
+    flask_app.logger.info(f"audio websocket client connected: {request.sid}")
+
+@socketio.on('disconnect', namespace=AUDIO_NAMESPACE)
+def websocket_disconnect(*args):
+    websocket_clients.pop(request.sid, None)
+    flask_app.logger.info(f"audio websocket client disconnected: {request.sid}")
+
+@socketio.on('settings', namespace=AUDIO_NAMESPACE)
+def websocket_settings(settings):
+    error = receive_client_settings(settings)
+    if error:
+        emit('error', error)
+
+def receive_client_settings(settings) -> dict:
+    """
+    The client telling us its settings (available mics, blocksize, ...)
+
+    Returns an error message for the client if the settings are unusable
+    """
+    if not isinstance(settings, dict):
+        return {"message": "settings must be a dict"}
+    flask_app.logger.info(f"received websocket settings {settings}")
+    client_audio_settings.update(settings)
+    settings_changed()
+    return None
+
+@socketio.on('audio_chunk', namespace=AUDIO_NAMESPACE)
+def websocket_audio_chunk(meta, data):
+    state = websocket_clients.setdefault(request.sid, {"load": 0.0, "slow": False})
+    for event, message in websocket_chunk(state, meta, data):
+        emit(event, message)
+
+def websocket_chunk(state: dict, meta: dict, data: bytes) -> list:
+    """
+    One chunk of binary audio from a websocket client, see ingest_binary
+
+    Also keeps track of how long each chunk takes compared to how much audio it holds,
+    so the client can be told to slow down when the server cannot keep up.
+    Returns the (event, message) pairs to send back to the client.
+    """
+    start = time.perf_counter()
+    try:
+        dtype = meta.get('dtype', 'float32')
+        channels = int(meta.get('channels', 1))
+        samplerate = int(meta.get('samplerate', audio_samplerate))
+        ingest_binary(data,
+                      dtype=dtype,
+                      channels=channels,
+                      samplerate=samplerate,
+                      seq=meta.get('seq'),
+                      source=meta.get('source'),
+                      captured=meta.get('capture_time'))
+    except (ValueError, TypeError, AttributeError) as error:
+        return [('error', {"message": str(error)})]
+    elapsed = time.perf_counter() - start
+
+    frames = len(data) // (np.dtype(dtype).itemsize * channels)
+    if frames > 0:
+        state['load'] = 0.9 * state['load'] + 0.1 * elapsed / (frames / samplerate)
+    # some hysteresis so the client is not told to flip back and forth every chunk
+    if not state['slow'] and state['load'] > flask_app.config['FLOW_SLOW_LOAD']:
+        state['slow'] = True
+        return [('flow', {"state": "slow"})]
+    elif state['slow'] and state['load'] < flask_app.config['FLOW_OK_LOAD']:
+        state['slow'] = False
+        return [('flow', {"state": "ok"})]
+    return []
+
+# framed TCP audio transport, see stream_ingest.py for the protocol
+def stream_hello(mics: dict, settings: dict):
+    """
+    A stream client connected and sent its mics and settings
+    """
+    flask_app.logger.info(f"received stream settings {settings}")
+    client_audio_settings.update(settings)
+    if mics:
+        client_audio_settings['mics'] = mics
+    settings_changed()
+
+def stream_audio(pcm, seq: int, capture_time: float, dtype: str, channels: int, samplerate: int, source: str):
+    # a capture time of 0 means the client did not fill it in
+    ingest_binary(pcm, dtype=dtype, channels=channels, samplerate=samplerate, seq=seq, source=source,
+                  captured=capture_time or None)
+
+stream_ingest = StreamIngestServer(on_audio=stream_audio,
+                                   on_hello=stream_hello,
+                                   get_settings=lambda: client_audio_settings,
+                                   host=flask_app.config['STREAM_INGEST_HOST'],
+                                   port=flask_app.config['STREAM_INGEST_PORT'])
+
+# UDP audio transport with a jitter buffer, see udp_ingest.py
+udp_ingest = UdpIngestServer(on_audio=stream_audio,
+                             host=flask_app.config['UDP_INGEST_HOST'],
+                             port=flask_app.config['UDP_INGEST_PORT'],
+                             depth=flask_app.config['UDP_JITTER_DEPTH'],
+                             max_delay=flask_app.config['UDP_JITTER_DELAY'],
+                             idle_timeout=flask_app.config['UDP_IDLE_SECONDS'])
+
+@flask_app.route("/ingest_stats", methods=['GET'])
+def ingest_stats():
+    """
+    Per-source packet accounting for the socket transports (received, lost, stale, ...)
+    """
+    return jsonify({
+        "stream_clients": len(stream_ingest.connections),
+        "udp": udp_ingest.stats(),
+    })
+
+def observe_feature(name: str, seconds: float):
+    """
+    The feature pipeline's stage timer (FeaturePipeline.observe)
+    """
+    histogram = feature_seconds.get(name)
+    if histogram is None:
+        histogram = feature_seconds[name] = metrics.histogram(
+            "feature_seconds", "Time to compute each feature pipeline stage (without its inputs)", feature=name)
+    histogram.observe(seconds)
+
+features.observe = observe_feature
+
+def observe_request(route: str, seconds: float):
+    """
+    Count a handled request, also called by the asgi server for its native routes
+    """
+    histogram = route_seconds.get(route)
+    if histogram is None:
+        histogram = route_seconds[route] = metrics.histogram(
+            "http_request_seconds", "Time to handle a request (until the response starts for streams)", route=route)
+    histogram.observe(seconds)
+
+@flask_app.before_request
+def start_request_timer():
+    request.environ['metrics.start'] = time.perf_counter()
+
+@flask_app.after_request
+def stop_request_timer(response):
+    start = request.environ.get('metrics.start')
+    if start is not None:
+        # by rule, not by path: /general_keys/<key> is one route however many keys there are
+        observe_request(request.url_rule.rule if request.url_rule is not None else "unmatched",
+                        time.perf_counter() - start)
+    return response
+
+# read when /metrics is, nothing to keep up to date in between
+metrics.counter_function("audio_chunks_dropped_total", "Chunks thrown away before they were analysed",
+                         lambda: analysis_worker.dropped, reason="analysis_worker")
+metrics.counter_function("audio_chunks_dropped_total", "Chunks thrown away before they were analysed",
+                         lambda: udp_ingest.totals().get('lost', 0), reason="udp_lost")
+metrics.counter_function("audio_chunks_dropped_total", "Chunks thrown away before they were analysed",
+                         lambda: udp_ingest.totals().get('dropped_blocks', 0),
+                         reason="udp_incomplete")
+metrics.counter_function("audio_chunks_late_total", "UDP packets that arrived after the jitter buffer gave up on them",
+                         lambda: udp_ingest.totals().get('stale', 0))
+metrics.counter_function("stream_frames_dropped_total", "/audio_stream frames a viewer was too slow for",
+                         audio_hub.dropped)
+metrics.gauge("stream_subscribers", "Viewers subscribed to /audio_stream", lambda: len(audio_hub))
+metrics.gauge("audio_clients", "Connected capture clients, by transport",
+              lambda: len(stream_ingest.connections), transport="stream")
+metrics.gauge("audio_clients", "Connected capture clients, by transport",
+              lambda: len(websocket_clients), transport="websocket")
+metrics.gauge("audio_clients", "Connected capture clients, by transport",
+              lambda: len(udp_ingest.sources), transport="udp")
+metrics.gauge("analysis_worker_backlog", "Chunks at the analysis worker", lambda: len(pending_snapshots))
+metrics.gauge("persistence_queue", "Entries waiting to be written to the persistence log",
+              lambda: persistence.queue.qsize())
+metrics.gauge("ring_buffer_fill", "Fraction of a ring buffer in use",
+              lambda: len(audio_history) / audio_history.capacity, ring="audio_history")
+metrics.gauge("ring_buffer_fill", "Fraction of a ring buffer in use",
+              lambda: len(audio_stats) / audio_stats.capacity, ring="audio_stats")
+metrics.gauge("ring_buffer_fill", "Fraction of a ring buffer in use",
+              lambda: len(audio_onsets) / audio_onsets.capacity, ring="audio_onsets")
+metrics.counter_function("process_cpu_seconds_total", "CPU time used by this process", time.process_time)
+
+@flask_app.route("/metrics", methods=['GET'])
+def get_metrics():
+    """
+    Everything in the metrics registry, prometheus text format
+    """
+    return Response(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+@flask_app.route("/audio_ack", methods=['POST'])
+def audio_ack():
+    """
+    A viewer drew the /audio_stream frame of chunk {"seq"} (only sent for frames with "ack": true)
+
+    The body is read whatever its content type, so the frontend can send it as a simple (no preflight) request
+    """
+    data = request.get_json(force=True, silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('seq'), int):
+        return jsonify({"message": "Error: expected {\"seq\": <int>}"}), 400
+    known = latency.ack(data['seq'], time.time())
+    response = jsonify({"known": known})
+    # TODO: the actual CORS policy
+    response.headers.add("Access-Control-Allow-Origin", "*")
+    return response
+
+@flask_app.route("/latency", methods=['GET'])
+def get_latency():
+    """
+    Latency percentiles per source and stage, in seconds (see latency.py for what the stages are)
+    """
+    return jsonify(latency.breakdown())
+
+@flask_app.route("/tempo", methods=['GET'])
+def tempo():
+    """
+    Latest tempo estimate: bpm, beat_phase (0 on the beat), pulse (1 on the beat) and confidence
+    """
+    record = audio_snapshot.features
+    if 'pulse' not in features.stages or record is None or record['pulse'] is None:
+        abort(404)
+    return jsonify(record['pulse'])
+
+@flask_app.route("/onsets", methods=['GET'])
+def onsets():
+    """
+    Onsets ("hits") newer than ?since=<id>, oldest first (the last ONSET_HISTORY are kept)
+
+    Poll with since set to the "last" of the previous response. Streaming viewers get the same events
+    as "onset" events on /audio_stream, a viewer that sees a gap in the ids can catch up here.
+    """
+    since = request.args.get('since', default=0, type=int)
+    rows = audio_onsets.latest()
+    rows = rows[rows[:, 0] > since]
+    events = [dict(zip(ONSET_FIELDS, row)) for row in rows.tolist()]
+    for event in events:
+        event['id'] = int(event['id'])
+        event['sample'] = int(event['sample'])
+    return jsonify({"onsets": events, "last": max(since, int(audio_onsets.latest(1)[0, 0]) if len(audio_onsets) else 0)})
+
+@flask_app.route("/analysis_stats", methods=['GET'])
+def analysis_stats():
+    """
+    Which tempo backend is running and how long it took to get going (see librosa_analysis.timings)
+    """
+    return jsonify({
+        "backend": tempo_analyzer.backend if tempo_analyzer is not None else None,
+        "librosa_loaded": librosa_analysis.librosa is not None,
+        "timings": librosa_analysis.timings,
+    })
+
+# Server-Sent Events
+SSE_RETRY = b"retry: 1000\n\n"
+# comment line, keeps proxies from closing an idle connection
+SSE_KEEPALIVE = b": keepalive\n\n"
+SSE_HEADERS = {
+    'Cache-Control': "no-cache",
+    'X-Accel-Buffering': "no",
+    # TODO: the actual CORS policy
+    'Access-Control-Allow-Origin': "*",
+}
+
+@flask_app.route("/audio_stream", methods=['GET'])
+def audio_stream():
+    """
+    Server-Sent Events stream of the audio features, replaces polling /audio_in and /fft_audio
+
+    One "audio" event is pushed per chunk:
+    {"seq": chunk number, "time": when the server got it, "bars": ..., "peak": ..., "frequencies": [...]}
+    plus "captured" (when the client recorded it, client clock) if the client said
+
+    A viewer that falls behind only gets the newest frame (see broadcast.py)
+    """
+    def events():
+        subscriber = audio_hub.subscribe()
+        try:
+            yield SSE_RETRY
+            while True:
+                try:
+                    yield subscriber.get(timeout=flask_app.config['STREAM_KEEPALIVE_SECONDS'])
+                except queue.Empty:
+                    yield SSE_KEEPALIVE
+        finally:
+            audio_hub.unsubscribe(subscriber)
+
+    response = Response(events(), mimetype="text/event-stream")
+    for header, value in SSE_HEADERS.items():
+        response.headers[header] = value
+    return response
+
 @flask_app.route("/general_in", methods=['POST'])
 def general_in():
     """
@@ -139,25 +905,76 @@ def general_in():
     At the moment, only int is supported as a data type and
     all data is assumed to be a range between 0 and 100
     """
-    global general_data
     assert request.method == 'POST', "the route /general_in only supports POSTs"
     data = request.json
     assert 'type' in data, "request to /general_in did not specify the data type"
+    updates = dict()
     for key in data:
         if key == 'type':
             continue
-        flask_app.logger.info(f"Updating general data: {key}: {data[key]}")
-        general_data[key] = data[key]
-    response = {"message": f"received data for {key in data if key != 'type' else ''}"}
+        # debug: this is every command of every misc client, every period
+        flask_app.logger.debug(f"Updating general data: {key}: {data[key]}")
+        updates[key] = data[key]
+    try:
+        version = store_general(updates)
+    except ValueError as error:
+        return jsonify({"message": f"Error: {error}"}), 413
+    response = {"message": f"received data for {key in data if key != 'type' else ''}", "version": version}
     return jsonify(response)
 
+def store_general(updates: dict) -> int:
+    """
+    Write keys to general_data (and the shared state), returns the new version
+
+    Raises ValueError if the general data got too big for the shared state
+    """
+    general_history.record(updates, time.time())
+    if shared_state is None:
+        version = general_data.update(updates)
+    else:
+        with shared_state.writing():
+            # another process may have written since this one last looked
+            sync_general()
+            version = general_data.update(updates)
+            shared_state.write_json('general', general_data.to_dict())
+    if persistence is not None:
+        persistence.record('general', {"version": version, "values": updates})
+    return version
+
+def sync_general():
+    """
+    Take the shared general data if another process wrote a newer version
+    """
+    if shared_state is None:
+        return
+    state = shared_state.latest_json('general')
+    if state is not None and state['version'] > general_data.version:
+        version = general_data.version
+        general_data.load(state)
+        version, changes = general_data.changes(version)
+        # NOTE: timed when this process saw them, at most SHARED_STATE_POLL late
+        general_history.record(changes, time.time())
+        if persistence is not None:
+            persistence.record('general', {"version": version, "values": changes})
+
+def versioned(response, version: int):
+    """
+    Tag a response with a version as its ETag, 304 if the client sent that ETag in If-None-Match
+    """
+    response.set_etag(str(version))
+    return response.make_conditional(request)
+
 @flask_app.route("/general_keys", methods=['GET'])
 def general_keys():
     """
     Return a list of all known general_data keys
+
+    The ETag is the version of the whole store
     """
-    response = {"keys": [key for key in general_data]}
-    return jsonify(response)
+    sync_general()
+    version = general_data.version
+    response = {"keys": general_data.keys()}
+    return versioned(jsonify(response), version)
 
 @flask_app.route("/general_keys/<string:key>", methods=['GET'])
 def get_key(key):
@@ -165,31 +982,117 @@ def get_key(key):
     Return the data for a specific key
 
     This route will be used by the front-end to pull each key when it has been updated
+    The ETag is the key's version, send it back in If-None-Match to get a 304 if the key did not change
     """
+    sync_general()
     response = {}
     if key in general_data:
-        response[key] = general_data[key]
+        version, response[key] = general_data.get(key)
     else:
         abort(404)
     
+    return versioned(jsonify(response), version)
+
+@flask_app.route("/general_bulk", methods=['GET', 'POST'])
+def general_bulk():
+    """
+    Many general data keys in one request
+
+    GET ?keys=a,b,c and/or ?prefix=cpu. (everything if neither)
+        returns {"version": ..., "values": {key: value}}, keys that do not exist are left out
+        the ETag is the version of the whole store
+    POST {"values": {key: value, ...}, "type": type of the values}
+        writes them all as one version, returns {"version": ...}
+    """
+    if request.method == 'POST':
+        data = request.json
+        if not isinstance(data, dict) or not isinstance(data.get('values'), dict):
+            return jsonify({"message": "Error: expected {\"values\": {key: value, ...}, \"type\": ...}"}), 400
+        flask_app.logger.debug(f"Updating general data: {data['values']}")
+        try:
+            version = store_general(data['values'])
+        except ValueError as error:
+            return jsonify({"message": f"Error: {error}"}), 413
+        return jsonify({"version": version})
+    keys = request.args.get('keys')
+    sync_general()
+    version, values = general_data.select(keys.split(",") if keys else None, request.args.get('prefix'))
+    return versioned(jsonify({"version": version, "values": values}), version)
+
+@flask_app.route("/general_history/<string:key>", methods=['GET'])
+def get_key_history(key):
+    """
+    Trend of a numeric general data key: ?start=&end= (unix time, default the last 10 minutes)
+    in buckets of ?resolution= seconds (default 120 buckets over the range)
+
+    Returns {"key", "resolution", "time": bucket starts, "min", "max", "mean", "count"}, empty buckets are left out
+    """
+    end = request.args.get('end', default=time.time(), type=float)
+    start = request.args.get('start', default=end - 600, type=float)
+    resolution = request.args.get('resolution', default=(end - start) / 120, type=float)
+    if not end > start or not resolution > 0:
+        return jsonify({"message": "Error: expected start < end and resolution > 0"}), 400
+    if (end - start) / resolution > flask_app.config['GENERAL_HISTORY_MAX_BUCKETS']:
+        return jsonify({"message": f"Error: more than {flask_app.config['GENERAL_HISTORY_MAX_BUCKETS']} buckets, "
+                                   f"ask for a bigger resolution"}), 400
+    if key not in general_history:
+        abort(404)
+    response = general_history.query(key, start, end, resolution)
+    response.update(key=key, resolution=resolution)
     return jsonify(response)
+
+@flask_app.route("/general_changes", methods=['GET'])
+def general_changes():
+    """
+    Long poll for general data: the keys written after ?since=<version>
+
+    Returns {"version": ..., "changes": {key: value}} as soon as there is a newer version, or with no
+    changes after ?timeout= seconds (at most GENERAL_POLL_TIMEOUT). Poll again with the version it returned.
+    NOTE: a waiting poll holds a server thread here (asgi_server.py has its own that does not),
+    keep the timeout well under the proxy's idle timeout
+    """
+    since = request.args.get('since', default=0, type=int)
+    timeout = min(request.args.get('timeout', default=flask_app.config['GENERAL_POLL_TIMEOUT'], type=float),
+                  flask_app.config['GENERAL_POLL_TIMEOUT'])
+    sync_general()
+    # with SHARED_STATE the shared state thread loads the other processes' writes and wakes this up
+    general_data.wait(since, timeout)
+    version, changes = general_data.changes(since)
+    return jsonify({"version": version, "changes": changes})
     
 @flask_app.route("/fft_audio", methods=['GET'])
 def fft_audio():
     """
-    Do a FFT and return the data
-    TODO: shift array to only capture useful frequency range
-    """
-    num_motors = 8
-    if len(audio_chunk) > 0:
-        #return audio_chunk.tolist()
-        fft = np.fft.fft(audio_chunk).real
-        chunk_size = fft.size / num_motors
-        avg_chunks = np.abs(np.average(fft.reshape(-1, int(chunk_size)), axis=1))
-        normalized_chunks = avg_chunks # / avg_chunks.size
-        return jsonify({"frequencies": normalized_chunks.tolist()})
-    else:
-        return jsonify({'frequencies': [0, 0, 0, 0, 0, 0, 0, 0]})
+    Return the energy in each frequency band of the latest chunk, lowest band first
+
+    The FFT is only done once per chunk no matter how many viewers are polling (see FeatureRecord)
+    """
+    record = audio_snapshot.features
+    if record is None:
+        return jsonify({'frequencies': [0] * flask_app.config['FFT_BANDS']})
+    return jsonify({'frequencies': record['bands']})
+
+@flask_app.route("/features", methods=['GET'])
+def get_features():
+    """
+    Features of the latest chunk, ?names=rms,centroid,... (default: every feature there is)
+
+    Features nobody subscribed to are computed on the first request for each chunk.
+    "time" is when the server got the chunk, same as on /audio_stream frames
+    """
+    snapshot = audio_snapshot
+    record = snapshot.features
+    names = request.args.get('names')
+    names = names.split(",") if names else list(features.stages)
+    unknown = [name for name in names if name not in features.stages]
+    if unknown:
+        return jsonify({"error": f"unknown features {unknown}, expected some of {list(features.stages)}"}), 400
+    if record is None:
+        return jsonify({"seq": 0})
+    response = record.as_dict(names)
+    response['seq'] = record.seq
+    response['time'] = snapshot.received
+    return jsonify(response)
 
 
 @flask_app.route("/output", methods=['GET'])
@@ -224,6 +1127,104 @@ def page_not_found(error):
     return "page not found", 404
     
 
+# persistence (PERSIST_DIR)
+# log entries: 'general' {"version", "values"}, 'settings' the whole dict, 'chunk' [received, peak, avg, onset row or None]
+def capture_state() -> tuple:
+    """
+    (values, arrays) of everything that is saved, for a snapshot (runs in the persistence thread)
+    """
+    values = {"general": general_data.to_dict(), "settings": dict(client_audio_settings)}
+    with ingest_lock:
+        arrays = {"audio_stats": audio_stats.latest().copy(), "audio_onsets": audio_onsets.latest().copy()}
+    values["history"], history = general_history.state()
+    arrays.update((f"history.{name}", array) for name, array in history.items())
+    return values, arrays
+
+def restore_snapshot(values: dict, arrays: dict):
+    general_data.load(values["general"])
+    client_audio_settings.update(values["settings"])
+    audio_stats.append(arrays["audio_stats"])
+    audio_onsets.append(arrays["audio_onsets"])
+    try:
+        general_history.load(values["history"], {name[len("history."):]: array for name, array in arrays.items()
+                                                 if name.startswith("history.")})
+    except (KeyError, IndexError):
+        flask_app.logger.warning("the saved general history was kept with other GENERAL_HISTORY_TIERS, not restored")
+
+def restore_entry(kind: str, when: float, data):
+    """
+    Replay one log entry, skipping what the snapshot has already
+    """
+    if kind == 'general':
+        general_data.merge(data['values'], data['version'])
+        general_history.record({key: value for key, value in data['values'].items()
+                                if general_history.last_time(key) < when}, when)
+    elif kind == 'settings':
+        client_audio_settings.clear()
+        client_audio_settings.update(data)
+    elif kind == 'chunk':
+        received, peak, avg, onset_row = data
+        if len(audio_stats) == 0 or audio_stats.latest(1)[0, 0] < received:
+            audio_stats.append((received, peak, avg))
+        if onset_row is not None and (len(audio_onsets) == 0 or audio_onsets.latest(1)[0, 0] < onset_row[0]):
+            audio_onsets.append(onset_row)
+
+def restore_state():
+    persistence.restore(restore_snapshot, restore_entry)
+    if onset_detector is not None and len(audio_onsets):
+        # onset ids keep counting up from before the restart, pollers have a ?since= from then
+        onset_detector.count = int(audio_onsets.latest(1)[0, 0])
+
+def start_background_servers():
+    """
+    Start the listeners that run next to flask in background threads (stream and udp ingest),
+    restore the saved state and the analysis warm up
+
+    Skipped in the parent process of the debug reloader, it only watches files and restarts the
+    child process, which is the one that actually serves requests
+    """
+    global persistence
+    if flask_app.debug and not is_running_from_reloader():
+        return
+    if multiprocessing.parent_process() is not None:
+        # the analysis worker imports this module when the server was started with python src/flask_server.py
+        return
+    if flask_app.config['STREAM_INGEST_PORT']:
+        stream_ingest.start()
+    if flask_app.config['UDP_INGEST_PORT']:
+        udp_ingest.start()
+    if flask_app.config['PERSIST_DIR']:
+        # NOTE: not at import, the reloader parent would hold the lock and the serving child would record nothing
+        persistence = Persistence(flask_app.config['PERSIST_DIR'], flask_app.config['PERSIST_SNAPSHOT_SECONDS'])
+        restore_state()
+        persistence.start(capture_state)
+    if shared_state is not None:
+        threading.Thread(target=follow_shared_state, name="shared state", daemon=True).start()
+    if analysis_worker is not None:
+        # the worker warms itself up
+        analysis_worker.start()
+    elif tempo_analyzer is not None and flask_app.config['ANALYSIS_WARM_UP']:
+        librosa_analysis.start_warm_up(tempo_analyzer.backend)
+
+if flask_app.config['ANALYSIS_WORKER']:
+    analysis_worker = AnalysisWorker(flask_app.config, worker_record,
+                                     slots=flask_app.config['ANALYSIS_WORKER_SLOTS'],
+                                     chunk_size=flask_app.config['ANALYSIS_WORKER_CHUNK_BYTES'])
+
+if flask_app.config['SHARED_STATE']:
+    SHARED_DATA_BYTES = flask_app.config['SHARED_STATE_DATA_BYTES']
+    shared_state = SharedState(flask_app.config['SHARED_STATE'], {
+        'audio': (flask_app.config['SHARED_STATE_CHUNKS'], CHUNK_META.size + flask_app.config['SHARED_STATE_CHUNK_BYTES']),
+        'features': (flask_app.config['SHARED_STATE_CHUNKS'], SHARED_DATA_BYTES),
+        'general': (4, SHARED_DATA_BYTES),
+        'settings': (4, SHARED_DATA_BYTES),
+    })
+    # start from the newest chunk/settings, not the whole history
+    shared_seen = {name: max(shared_state.rings[name].count - 1, 0) for name in shared_seen}
+
+start_background_servers()
+
+
 if __name__ == "__main__":
     WSGIRequestHandler.protocol_version = "HTTP/1.1"
-    flask_app.run()
\ No newline at end of file
+    socketio.run(flask_app)
\ No newline at end of file
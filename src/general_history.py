@@ -0,0 +1,187 @@
+"""
+Per-key time series of the numeric general data, for drawing trends
+
+Every numeric value written to a key is kept in tiers of fixed size ring buffers (ring_buffer.py):
+    raw: (time, value) of the last few writes
+    downsampled tiers: one (start time, min, max, sum, count) row per bucket of e.g. 1s, 10s, 1min
+so the memory per key is fixed (a few hundred KB with the default GENERAL_HISTORY_TIERS) no matter how
+often it is written, and old data is kept at a coarser resolution instead of dropped.
+
+query(key, start, end, resolution) answers from the coarsest tier that still has the whole range at
+the requested resolution (or better), so it only touches a few rows per bucket it returns,
+however long the range is. Buckets come back as min/max/mean/count of the values in them.
+"""
+import math
+import threading
+
+import numpy as np
+
+from ring_buffer import RingBuffer
+
+
+class Series:
+    """
+    One key's history
+    """
+    def __init__(self, raw: int, tiers):
+        """
+        raw: number of raw values kept
+        tiers: (bucket seconds, buckets kept) per downsampled tier, finest first
+        """
+        self.raw = RingBuffer(raw, dtype=np.float64, width=2)
+        self.tiers = [(seconds, RingBuffer(buckets, dtype=np.float64, width=5)) for seconds, buckets in tiers]
+        # bucket each tier is filling now, [start, min, max, sum, count] (not in the ring buffer until it is done)
+        self.open = [None] * len(self.tiers)
+
+    def append(self, when: float, value: float):
+        self.raw.append((when, value))
+        for index, (seconds, ring) in enumerate(self.tiers):
+            start = math.floor(when / seconds) * seconds
+            bucket = self.open[index]
+            if bucket is not None and bucket[0] == start:
+                bucket[1] = min(bucket[1], value)
+                bucket[2] = max(bucket[2], value)
+                bucket[3] += value
+                bucket[4] += 1
+                continue
+            if bucket is not None:
+                ring.append(bucket)
+            self.open[index] = [start, value, value, value, 1]
+
+    def rows(self, tier: int, start: float, end: float):
+        """
+        Rows (start, min, max, sum, count) of a tier (-1 is raw) that start in [start, end), oldest first
+        """
+        if tier < 0:
+            parts = self.raw.views()
+        else:
+            parts = self.tiers[tier][1].views()
+        selected = []
+        for part in parts:
+            first, last = np.searchsorted(part[:, 0], (start, end))
+            selected.append(part[first:last])
+        rows = np.concatenate(selected)
+        if tier < 0:
+            values = rows[:, 1:2]
+            return np.hstack((rows[:, 0:1], values, values, values, np.ones_like(values)))
+        bucket = self.open[tier]
+        if bucket is not None and start <= bucket[0] < end:
+            rows = np.vstack((rows, bucket))
+        return rows
+
+    def covers(self, tier: int, start: float) -> bool:
+        """
+        Whether a tier (-1 is raw) still has everything since start
+        """
+        ring = self.raw if tier < 0 else self.tiers[tier][1]
+        if ring.total <= ring.capacity:
+            # nothing was overwritten yet
+            return True
+        oldest = ring.views()[0][0, 0]
+        return float(oldest) <= start
+
+
+class GeneralHistory:
+    def __init__(self, raw: int = 1024, tiers=((1, 600), (10, 720), (60, 1440))):
+        """
+        raw: values kept as they were written, per key
+        tiers: (bucket seconds, buckets kept) per downsampled tier, finest first
+            the default keeps 10 minutes of 1s buckets, 2 hours of 10s and a day of 1min
+        """
+        self.raw = raw
+        self.tiers = [tuple(tier) for tier in tiers]
+        self.series = dict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, key) -> bool:
+        return key in self.series
+
+    def last_time(self, key: str) -> float:
+        """
+        Time of the newest value of key (-inf if it has none)
+        """
+        with self.lock:
+            series = self.series.get(key)
+            if series is None or len(series.raw) == 0:
+                return -math.inf
+            return float(series.raw.latest(1)[0, 0])
+
+    def state(self) -> tuple:
+        """
+        (values, arrays) to save everything, see load()
+        """
+        with self.lock:
+            values = {"keys": list(self.series), "open": [series.open for series in self.series.values()]}
+            arrays = dict()
+            for index, series in enumerate(self.series.values()):
+                arrays[f"{index}.raw"] = series.raw.latest().copy()
+                for tier, (_, ring) in enumerate(series.tiers):
+                    arrays[f"{index}.{tier}"] = ring.latest().copy()
+            return values, arrays
+
+    def load(self, values: dict, arrays: dict):
+        """
+        Restore a state() (saved with the same tiers)
+        """
+        with self.lock:
+            self.series = dict()
+            for index, key in enumerate(values["keys"]):
+                series = Series(self.raw, self.tiers)
+                series.raw.append(arrays[f"{index}.raw"])
+                for tier, (_, ring) in enumerate(series.tiers):
+                    ring.append(arrays[f"{index}.{tier}"])
+                series.open = values["open"][index]
+                self.series[key] = series
+
+    def record(self, updates: dict, when: float):
+        """
+        Add the numeric values of updates (numbers or strings of numbers), the rest is ignored
+        """
+        with self.lock:
+            for key, value in updates.items():
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    continue
+                if not math.isfinite(value):
+                    continue
+                if key not in self.series:
+                    self.series[key] = Series(self.raw, self.tiers)
+                self.series[key].append(when, value)
+
+    def query(self, key: str, start: float, end: float, resolution: float) -> dict:
+        """
+        Buckets of resolution seconds from start to end, as columns:
+        {"time": bucket starts, "min", "max", "mean", "count"}, buckets without values are left out
+        KeyError if the key has no history
+        """
+        with self.lock:
+            series = self.series[key]
+            tier = self.pick_tier(series, start, resolution)
+            rows = series.rows(tier, start, end)
+        if len(rows) == 0:
+            return {"time": [], "min": [], "max": [], "mean": [], "count": []}
+        buckets = np.floor((rows[:, 0] - start) / resolution)
+        first = np.flatnonzero(np.diff(buckets, prepend=-1))
+        count = np.add.reduceat(rows[:, 4], first)
+        return {
+            "time": (start + buckets[first] * resolution).tolist(),
+            "min": np.minimum.reduceat(rows[:, 1], first).tolist(),
+            "max": np.maximum.reduceat(rows[:, 2], first).tolist(),
+            "mean": (np.add.reduceat(rows[:, 3], first) / count).tolist(),
+            "count": count.astype(int).tolist(),
+        }
+
+    def pick_tier(self, series: Series, start: float, resolution: float) -> int:
+        """
+        Coarsest tier with buckets no bigger than resolution that goes back to start,
+        otherwise the finest one that does (or the coarsest there is), -1 is raw
+        """
+        candidates = [-1] + list(range(len(self.tiers)))
+        covering = [tier for tier in candidates if series.covers(tier, start)]
+        fine_enough = [tier for tier in covering if tier < 0 or self.tiers[tier][0] <= resolution]
+        if fine_enough:
+            return fine_enough[-1]
+        if covering:
+            return covering[0]
+        return candidates[-1]
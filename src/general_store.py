@@ -0,0 +1,136 @@
+"""
+Versioned key/value store for the general data (/general_in)
+
+general_data used to be a plain dict, so a dashboard had to re-fetch every key to find out what changed.
+Every update now bumps the store's version, and the keys it wrote get that version:
+    - a key's version is its ETag, GET /general_keys/<key> answers 304 if the client has it already
+    - changes(since) returns just the keys written after a version the client has seen,
+      wait(since) blocks until there are some (long poll, /general_changes)
+    - listeners are called with the new version on every change, for waiters that are not threads
+      (asgi_server.py's /general_changes)
+Keys are kept in the order they were last written, so changes() only walks the keys it returns.
+"""
+import threading
+from collections import OrderedDict
+
+
+class GeneralStore:
+    def __init__(self):
+        # key -> (version, value), least recently written first
+        self.entries = OrderedDict()
+        self.version = 0
+        self.condition = threading.Condition()
+        # functions called with the new version whenever it changes, from the thread that changed it
+        self.listeners = []
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key) -> bool:
+        return key in self.entries
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self) -> list:
+        with self.condition:
+            return list(self.entries)
+
+    def get(self, key: str) -> tuple:
+        """
+        (version, value) of key, KeyError if it was never written
+        """
+        return self.entries[key]
+
+    def select(self, keys=None, prefix: str = None) -> tuple:
+        """
+        (version, {key: value}) of the given keys and/or the keys starting with prefix (everything if neither)
+
+        Keys that were never written are left out
+        """
+        with self.condition:
+            if keys is None and prefix is None:
+                return self.version, {key: value for key, (_, value) in self.entries.items()}
+            selected = dict()
+            for key in keys or []:
+                if key in self.entries:
+                    selected[key] = self.entries[key][1]
+            if prefix is not None:
+                for key, (_, value) in self.entries.items():
+                    if key.startswith(prefix):
+                        selected[key] = value
+            return self.version, selected
+
+    def update(self, updates: dict) -> int:
+        """
+        Write some keys, returns the new version
+        """
+        with self.condition:
+            if not updates:
+                return self.version
+            self.version += 1
+            for key, value in updates.items():
+                self.entries[key] = (self.version, value)
+                self.entries.move_to_end(key)
+            self.changed()
+            return self.version
+
+    def merge(self, updates: dict, version: int):
+        """
+        Apply keys written as version somewhere else (e.g. replaying a log), keys that are newer here stay
+        """
+        with self.condition:
+            for key, value in updates.items():
+                if key not in self.entries or self.entries[key][0] < version:
+                    self.entries[key] = (version, value)
+                    self.entries.move_to_end(key)
+            self.version = max(self.version, version)
+            self.changed()
+
+    def changed(self):
+        """
+        Wake up the waiters, call with the condition held
+        """
+        self.condition.notify_all()
+        for listener in self.listeners:
+            listener(self.version)
+
+    def changes(self, since: int = 0) -> tuple:
+        """
+        (version, {key: value}) of the keys written after version since, oldest first
+        """
+        with self.condition:
+            if since > self.version:
+                # the client saw a version from before a restart, it gets everything
+                since = 0
+            changed = []
+            for key in reversed(self.entries):
+                version, value = self.entries[key]
+                if version <= since:
+                    break
+                changed.append((key, value))
+            return self.version, dict(reversed(changed))
+
+    def wait(self, since: int, timeout: float) -> bool:
+        """
+        Wait up to timeout seconds for a version newer than since, returns False if there was none
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: self.version != since, timeout)
+
+    def to_dict(self) -> dict:
+        """
+        Everything, as plain json-able values (see load)
+        """
+        with self.condition:
+            return {"version": self.version,
+                    "entries": [[key, version, value] for key, (version, value) in self.entries.items()]}
+
+    def load(self, state: dict):
+        """
+        Replace the whole store with a to_dict() of another one (another process, a saved copy)
+        """
+        with self.condition:
+            self.entries = OrderedDict((key, (version, value)) for key, version, value in state['entries'])
+            self.version = state['version']
+            self.changed()
@@ -0,0 +1,98 @@
+"""
+Where the time goes between a sound and the frontend drawing it, per audio source
+
+Every chunk carries timestamps along the way:
+    captured: when its last sample was recorded (the capture client's clock, mic.latency taken off)
+    received: when the server got it
+    analysed: when the feature pipeline was done with it
+    acked: when a viewer's ack for it came back (only every LATENCY_ACK_EVERY-th frame asks for one)
+which are split into stages:
+    block: the chunk's own length, the first sample waits this long for the rest of the block
+    transport: captured -> received
+    analysis: received -> analysed
+    delivery: analysed -> acked, includes the ack's way back so it is an upper bound
+    total: the first sample being recorded -> acked, only for acked chunks with a capture time
+
+NOTE: transport (and total) compare the capture client's clock with the server's, they are only
+meaningful if both run on the same machine or sync their clocks. A negative transport time means they do not.
+
+The last `capacity` times of each stage are kept per source, breakdown() gives their percentiles.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from ring_buffer import RingBuffer
+
+STAGES = ("block", "transport", "analysis", "delivery", "total")
+PERCENTILES = (50, 90, 99)
+# chunks waiting for an ack, older ones are given up on
+PENDING_ACKS = 32
+
+
+class LatencyTracker:
+    def __init__(self, capacity: int = 1000):
+        self.capacity = capacity
+        # source -> {stage: RingBuffer of seconds}
+        self.sources = dict()
+        # seq -> (source, analysed, time from the first sample to analysed or None)
+        self.pending = OrderedDict()
+        self.lock = threading.Lock()
+
+    def record(self, source: str, stage: str, seconds: float):
+        stages = self.sources.get(source)
+        if stages is None:
+            stages = self.sources[source] = {name: RingBuffer(self.capacity, dtype=np.float64) for name in STAGES}
+        stages[stage].append(seconds)
+
+    def chunk(self, seq: int, source: str, block: float, captured: float, received: float, analysed: float,
+              ack: bool = False):
+        """
+        A chunk was analysed, ack: a viewer will be asked to ack it
+        captured is None if the client did not send a capture time
+        """
+        with self.lock:
+            self.record(source, "block", block)
+            self.record(source, "analysis", analysed - received)
+            if captured is not None:
+                self.record(source, "transport", received - captured)
+            if ack:
+                self.pending[seq] = (source, analysed, analysed - captured + block if captured is not None else None)
+                while len(self.pending) > PENDING_ACKS:
+                    self.pending.popitem(last=False)
+
+    def ack(self, seq: int, now: float) -> bool:
+        """
+        A viewer drew chunk seq, returns False if the chunk is unknown (never asked for, or too old)
+
+        Every viewer that acks counts, the chunk is kept until it ages out
+        """
+        with self.lock:
+            pending = self.pending.get(seq)
+            if pending is None:
+                return False
+            source, analysed, before = pending
+            self.record(source, "delivery", now - analysed)
+            if before is not None:
+                self.record(source, "total", before + now - analysed)
+        return True
+
+    def breakdown(self) -> dict:
+        """
+        {source: {stage: {"count", "mean", "p50", "p90", "p99"}}}, in seconds, stages without times are left out
+        """
+        with self.lock:
+            times = {source: {stage: ring.latest().copy() for stage, ring in stages.items()}
+                     for source, stages in self.sources.items()}
+        result = dict()
+        for source, stages in times.items():
+            result[source] = dict()
+            for stage, values in stages.items():
+                if len(values) == 0:
+                    continue
+                summary = {"count": len(values), "mean": float(values.mean())}
+                summary.update((f"p{percentile}", float(value))
+                               for percentile, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)))
+                result[source][stage] = summary
+        return result
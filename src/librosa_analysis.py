@@ -1,32 +1,153 @@
+"""
+Beat/pulse analysis backends
+
+"tracker" is the incremental tempo tracker (tempo_tracker.py), plain numpy.
+"librosa" is the old librosa.beat.plp over the last four blocks.
+
+librosa (and numba, which it JIT compiles with) takes seconds to import and compile, so it is only
+imported the first time something actually uses the librosa backend (load_librosa).
+The numba cache goes in a persistent directory, one per python/librosa/numba version so a
+stale cache from an older install is never picked up:
+    $ANALYSIS_CACHE_DIR/numba-py311-librosa0.10.1-numba0.58.1
+ANALYSIS_CACHE_DIR defaults to ~/.cache/creativity-optional, mount a volume there in docker to keep it
+across restarts. An explicit NUMBA_CACHE_DIR still wins.
+
+warm_up() runs the backend on synthetic audio so the import and JIT are paid before the first real chunk,
+start_warm_up() does it in a background thread.
+
+How long things took (seconds) is kept in timings:
+    librosa_import: importing librosa
+    warm_up: the whole warm up, import included
+    first_feature: how long the first readData call took (what the first real chunk waited for)
+    first_feature_after: from creating the Analyzer (server startup) to its first result
+"""
+import importlib
+import logging
 import os
-from tarfile import BLOCKSIZE
-os.environ["NUMBA_CACHE_DIR"] = "/tmp"
-import librosa
-from librosa.beat import plp
+import sys
+import threading
+import time
+from importlib import metadata
+
 import numpy as np
+from ring_buffer import RingBuffer
+from tempo_tracker import TempoTracker
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("tracker", "librosa")
+timings = dict()
+librosa = None
+librosa_lock = threading.Lock()
+
+
+def package_version(name: str) -> str:
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return "none"
+
+
+def jit_cache_dir() -> str:
+    """
+    Versioned numba cache directory under ANALYSIS_CACHE_DIR
+    """
+    root = os.environ.get("ANALYSIS_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "creativity-optional"))
+    version = f"py{sys.version_info.major}{sys.version_info.minor}-librosa{package_version('librosa')}-numba{package_version('numba')}"
+    return os.path.join(root, f"numba-{version}")
+
+
+def load_librosa():
+    """
+    Import librosa the first time it is needed, later calls just return the module
+    """
+    global librosa
+    with librosa_lock:
+        if librosa is None:
+            # has to be set before numba is imported
+            os.environ.setdefault("NUMBA_CACHE_DIR", jit_cache_dir())
+            os.makedirs(os.environ["NUMBA_CACHE_DIR"], exist_ok=True)
+            start = time.perf_counter()
+            module = importlib.import_module("librosa")
+            importlib.import_module("librosa.beat")
+            timings['librosa_import'] = time.perf_counter() - start
+            logger.info(f"imported librosa in {timings['librosa_import']:.2f}s, numba cache in {os.environ['NUMBA_CACHE_DIR']}")
+            librosa = module
+    return librosa
+
+
+def warm_up(backend: str = "librosa", samplerate: int = 48000, blocksize: int = 1024, blocks: int = 8):
+    """
+    Run the backend on a few blocks of synthetic audio (clicks over noise) so the imports and JIT are done
+    """
+    start = time.perf_counter()
+    analyzer = Analyzer(backend=backend, report=False)
+    samples = np.random.default_rng(0).normal(0, 0.01, blocks * blocksize).astype(np.float32)
+    samples[::samplerate // 2] = 1.0
+    for block in range(blocks):
+        analyzer.readData(samples[block * blocksize:(block + 1) * blocksize], samplerate, blocksize)
+    timings['warm_up'] = time.perf_counter() - start
+    logger.info(f"{backend} analysis warmed up in {timings['warm_up']:.2f}s")
+
+
+def start_warm_up(backend: str = "librosa", **kwargs) -> threading.Thread:
+    thread = threading.Thread(target=warm_up, args=(backend,), kwargs=kwargs, name="analysis warm up", daemon=True)
+    thread.start()
+    return thread
+
 
 class Analyzer:
-    def __init__(self, numChannels=1):
-        self.audioChunks = np.zeros((0, numChannels))
-        self.lengths = [] #contains lengths of last eight blocks
-    
+    def __init__(self, numChannels=1, backend="tracker", hop_length=512, report=True, **tracker_settings):
+        """
+        backend:
+            "tracker": incremental tempo tracker (tempo_tracker.py), constant cost per block
+            "librosa": the old librosa.beat.plp over the last four blocks, recomputed every block
+        report: log the time to the first feature and put it in timings (off for the warm up)
+        tracker_settings: passed on to TempoTracker (min_bpm, max_bpm, ...)
+        """
+        assert backend in BACKENDS, f"unknown analysis backend {backend}, expected one of {BACKENDS}"
+        self.numChannels = numChannels
+        self.backend = backend
+        self.tracker = TempoTracker(hop_length=hop_length, **tracker_settings) if backend == "tracker" else None
+        self.audioChunks = None
+        self.lengths = [] #contains lengths of last four blocks
+        self.report = report
+        self.created = time.perf_counter()
+        self.first_feature = None
+
     def readData(self, chunk, samplerate, chunkSize = 1024):
-        # print("##############################\nLIBROSA\n##################################")
-        #append data to the collected chunks
-        self.audioChunks = np.append(self.audioChunks, chunk)
-        print(len(self.audioChunks))
-        print(len(self.lengths))
-        self.lengths.append(chunk.shape[0])
+        start = time.perf_counter()
+        chunk = np.asarray(chunk, dtype=np.float32)
+        if chunk.ndim > 1:
+            # mono mix, the tracker only cares about onsets
+            chunk = chunk.mean(axis=1)
+        if self.backend == "librosa":
+            result = self.readDataPlp(chunk, samplerate)
+        else:
+            result = self.tracker.update(chunk, samplerate)
+            result["pulse_bar"] = "=" * int(50 * result["pulse"])
+        if self.first_feature is None:
+            now = time.perf_counter()
+            self.first_feature = now - start
+            if self.report:
+                timings['first_feature'] = self.first_feature
+                timings['first_feature_after'] = now - self.created
+                logger.info(f"first {self.backend} feature took {self.first_feature:.3f}s, "
+                            f"{timings['first_feature_after']:.2f}s after startup")
+        return result
 
-        #remove oldest audio chunk data. We keep only eight newest chunks
+    def readDataPlp(self, chunk, samplerate):
+        librosa = load_librosa()
+        #keep the newest four chunks, ring buffer instead of np.append copying everything each time
+        if self.audioChunks is None:
+            self.audioChunks = RingBuffer(8 * max(len(chunk), 1))
+        self.audioChunks.append(chunk)
+        self.lengths.append(chunk.shape[0])
         if (len(self.lengths) > 4):
-            self.audioChunks = self.audioChunks[self.lengths.pop(0):]
-        
-        #feed data into librosa and get only the data pertaining to new portion
-        # print(self.lengths[-1])
-        pulses = librosa.beat.plp(y=self.audioChunks, sr=samplerate, win_length=self.lengths[-1])
-        # print(pulses)
-        # print(pulses.shape[0])
-        pulses_avg = np.average(pulses)
+            self.lengths.pop(0)
+
+        #feed data into librosa
+        pulses = librosa.beat.plp(y=self.audioChunks.latest(sum(self.lengths)), sr=samplerate, win_length=self.lengths[-1])
+        pulses_avg = float(np.average(pulses))
         pulse_bar = "=" * int(50 * pulses_avg)
-        return {"pulse": pulses_avg, "pulse_bar": pulse_bar}
\ No newline at end of file
+        return {"pulse": pulses_avg, "pulse_bar": pulse_bar}
@@ -3,12 +3,15 @@ import pyaudio
 import numpy as np
 import requests
 import json
+import sys
 
 CHUNK = 1024
 FORMAT = pyaudio.paInt16
 CHANNELS = 1
 RATE = 48000
 DOCKER_IP="http://0.0.0.0:8000/"
+# --binary sends the raw int16 buffer to /audio_in/binary instead of JSON to /audio_in
+BINARY = "--binary" in sys.argv[1:]
 
 # Find the index of the desired input device
 def find_input_device_index(p, device_name):
@@ -37,11 +40,28 @@ stream = p.open(format=FORMAT,
 
 print("* Recording")
 
+session = requests.Session()
+seq = 0
+
 try:
     while True:
         # Read audio data from the stream
         raw_data = stream.read(CHUNK, exception_on_overflow=False)
-        
+
+        if BINARY:
+            # the server wraps these bytes as-is, no conversion needed on this end
+            headers = {
+                "Content-Type": "application/octet-stream",
+                "X-Audio-Dtype": "int16",
+                "X-Audio-Channels": str(CHANNELS),
+                "X-Audio-Samplerate": str(RATE),
+                "X-Audio-Seq": str(seq),
+                "X-Audio-Source": MIC_NAME,
+            }
+            response = session.post(DOCKER_IP + "audio_in/binary", data=raw_data, headers=headers).json()
+            seq += 1
+            continue
+
         # Convert binary data to numpy array
         data = np.frombuffer(raw_data, dtype=np.int16)
 
@@ -58,7 +78,7 @@ try:
             "data": data.tolist(),
             "source": MIC_NAME
         }
-        response = requests.post(DOCKER_IP + "audio_in", json=payload).json()
+        response = session.post(DOCKER_IP + "audio_in", json=payload).json()
 
         # Print the audio data
         #print(audio_array)
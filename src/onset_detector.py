@@ -0,0 +1,133 @@
+"""
+Streaming onset ("hit") detector
+
+Lights and scenes want discrete events, not the continuous bars/bands. Per chunk:
+    1. the hann windowed spectrum of the chunk, the one the feature pipeline already has (feature_pipeline.py,
+       so the rfft is done once per chunk), computed here if the detector is used on its own
+    2. spectral flux: how much the spectrum went up since the previous chunk (kept in state)
+    3. the flux is an onset if it is well above the median of the last few chunks' flux, and above
+       the usual spread around the median (adaptive: a loud or busy song needs a bigger jump than a quiet one)
+    4. the hit is placed by looking for where the signal envelope jumps, down to the sample. The window hides
+       the end of a chunk, so a hit there mostly shows in the next chunk's flux: the end of the previous
+       chunk is searched too
+
+Events are dicts:
+    id: counts up from 1, for polling with ?since=
+    sample: sample index since the detector started (per channel)
+    time: unix time of that sample, assuming the chunk's last sample arrived when the chunk did
+    strength: how far over the threshold the flux was (1 = just over)
+"""
+import numpy as np
+from ring_buffer import RingBuffer
+
+# fraction at the end of the previous chunk that is searched for the hit as well
+TAIL = 0.25
+# the envelope is scanned in blocks this long to find the jump, then down to the sample inside the block
+ENVELOPE_BLOCK = 64
+
+
+class OnsetDetector:
+    def __init__(self, samplerate: int = 48000, median_frames: int = 32, ratio: float = 1.5,
+                 spread: float = 5.0, delta: float = 1e-5, min_interval: float = 0.05):
+        """
+        median_frames: number of past chunks the threshold is taken over
+        ratio, spread, delta: the flux has to be above both median * ratio and
+            median + spread * (median absolute deviation), plus delta
+        min_interval: seconds after an onset before the next one can fire
+        """
+        self.samplerate = samplerate
+        self.ratio = ratio
+        self.spread = spread
+        self.delta = delta
+        self.min_interval = min_interval
+        self.flux_history = RingBuffer(median_frames, dtype=np.float64)
+        self.previous_spectrum = None
+        self.window = None
+        # end of the previous chunk (see TAIL) and the envelope of the block before it,
+        # a chunk that starts loud is not a jump by itself
+        self.previous_tail = np.zeros(0, dtype=np.float32)
+        self.previous_envelope = 0.0
+        self.samples = 0
+        self.last_onset = None
+        self.count = 0
+
+    def reset(self, samplerate: int):
+        # ids keep counting up, pollers would miss events otherwise
+        count = self.count
+        self.__init__(samplerate, self.flux_history.capacity, self.ratio, self.spread, self.delta, self.min_interval)
+        self.count = count
+
+    def spectrum(self, chunk):
+        """
+        rfft of the chunk with a hann window, same as feature_pipeline.spectrum_of
+        """
+        if self.window is None or len(self.window) != len(chunk):
+            self.window = np.hanning(len(chunk)).astype(np.float32)
+        return np.fft.rfft(chunk * self.window)
+
+    def locate(self, chunk, previous_envelope: float = 0.0) -> int:
+        """
+        Index of the sample where the envelope jumps the most
+        """
+        blocks = len(chunk) // ENVELOPE_BLOCK
+        if blocks < 2:
+            return int(np.argmax(np.abs(chunk)))
+        envelope = np.abs(chunk[:blocks * ENVELOPE_BLOCK]).reshape(blocks, ENVELOPE_BLOCK).max(axis=1)
+        block = int(np.argmax(np.diff(envelope, prepend=previous_envelope)))
+        segment = np.abs(chunk[block * ENVELOPE_BLOCK:(block + 1) * ENVELOPE_BLOCK])
+        # first sample that gets halfway to the block's peak
+        return block * ENVELOPE_BLOCK + int(np.argmax(segment >= 0.5 * segment.max()))
+
+    def process(self, chunk, samplerate: int = None, received: float = None, spectrum=None):
+        """
+        Feed a chunk of mono samples, returns an event (see the module docstring) or None
+
+        received: unix time the chunk arrived, used for the event's time
+        spectrum: rfft of the hann windowed chunk if it was done already (the pipeline's 'spectrum')
+        """
+        if samplerate is not None and samplerate != self.samplerate:
+            self.reset(samplerate)
+        chunk = np.asarray(chunk, dtype=np.float32).reshape(-1)
+        start = self.samples
+        self.samples += len(chunk)
+        if len(chunk) == 0:
+            return None
+        if spectrum is None:
+            spectrum = self.spectrum(chunk)
+        # scaled by the chunk length so the flux does not depend on the block size
+        spectrum = np.abs(spectrum) / len(chunk)
+        previous, self.previous_spectrum = self.previous_spectrum, spectrum
+        tail, previous_envelope = self.previous_tail, self.previous_envelope
+        length = int(TAIL * len(chunk)) // ENVELOPE_BLOCK * ENVELOPE_BLOCK
+        self.previous_tail = chunk[len(chunk) - length:].copy()
+        before = chunk[:len(chunk) - length][-ENVELOPE_BLOCK:]
+        self.previous_envelope = float(np.abs(before).max()) if len(before) else previous_envelope
+        if previous is None or len(previous) != len(spectrum):
+            # not comparable with a different length spectrum
+            return None
+        flux = float(np.maximum(spectrum - previous, 0.0).mean())
+        history = self.flux_history.latest()
+        if len(history):
+            median = float(np.median(history))
+            deviation = float(np.median(np.abs(history - median)))
+        else:
+            median, deviation = flux, 0.0
+        threshold = max(median * self.ratio, median + self.spread * deviation) + self.delta
+        self.flux_history.append(flux)
+        if flux <= threshold:
+            return None
+
+        sample = start - len(tail) + self.locate(np.concatenate((tail, chunk)), previous_envelope)
+        if self.last_onset is not None and sample - self.last_onset < self.min_interval * self.samplerate:
+            return None
+        self.last_onset = sample
+        self.count += 1
+        event = {
+            "id": self.count,
+            "sample": sample,
+            "time": None,
+            "strength": flux / threshold,
+        }
+        if received is not None:
+            event["time"] = received - (self.samples - 1 - sample) / self.samplerate
+        return event
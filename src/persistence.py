@@ -0,0 +1,207 @@
+"""
+Saving the server state to disk so a restart comes back with it
+
+Two files in PERSIST_DIR:
+    state.snapshot  everything at one point in time, rewritten every PERSIST_SNAPSHOT_SECONDS
+    state.log       one json line per change since that snapshot: [kind, time, data]
+Changes are only queued by the request that makes them, a background thread appends them to the log,
+so a POST never waits on the disk. Compacting writes a new snapshot next to the old one, renames it over
+it and empties the log. Log entries have to be safe to apply twice: an entry can end up in the log
+while what it changed is already in the snapshot.
+
+The snapshot is laid out so it can be mmap'd on startup and the arrays used straight from the page cache:
+    magic | header length (u64) | header (json) | arrays, each 64 byte aligned
+the header has the json-able values and the dtype/shape/offset of every array.
+
+Only one process writes: with several server processes, the first one to lock the directory does,
+the others only restore from it.
+"""
+import fcntl
+import json
+import logging
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+
+import numpy as np
+
+MAGIC = b"COSNAP01"
+LENGTH = struct.Struct("<Q")
+ALIGN = 64
+
+logger = logging.getLogger(__name__)
+
+
+def write_snapshot(path: str, values: dict, arrays: dict):
+    """
+    Write a snapshot to path atomically (temporary file, fsync, rename)
+    """
+    layout = dict()
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[name] = array
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += -(-array.nbytes // ALIGN) * ALIGN
+    header = json.dumps({"values": values, "arrays": layout}, separators=(',', ':')).encode()
+    start = -(-(len(MAGIC) + LENGTH.size + len(header)) // ALIGN) * ALIGN
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as file:
+        file.write(MAGIC + LENGTH.pack(len(header)) + header)
+        for name, array in arrays.items():
+            file.seek(start + layout[name]["offset"])
+            file.write(array.data)
+        file.truncate(start + offset)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+
+def read_snapshot(path: str) -> tuple:
+    """
+    (values, arrays) of a snapshot, the arrays are read only views of the mmap'd file
+
+    Returns None if there is no snapshot, raises ValueError if the file is not one
+    """
+    try:
+        with open(path, "rb") as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):
+        # ValueError: empty file
+        return None
+    if mapped[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a snapshot")
+    length = LENGTH.unpack_from(mapped, len(MAGIC))[0]
+    header_start = len(MAGIC) + LENGTH.size
+    header = json.loads(mapped[header_start:header_start + length])
+    start = -(-(header_start + length) // ALIGN) * ALIGN
+    arrays = dict()
+    for name, layout in header["arrays"].items():
+        dtype = np.dtype(layout["dtype"])
+        count = int(np.prod(layout["shape"], dtype=np.int64))
+        array = np.frombuffer(mapped, dtype=dtype, count=count, offset=start + layout["offset"])
+        arrays[name] = array.reshape(layout["shape"])
+    return header["values"], arrays
+
+
+class Persistence:
+    def __init__(self, directory: str, snapshot_seconds: float = 60.0):
+        self.directory = directory
+        self.snapshot_seconds = snapshot_seconds
+        self.snapshot_path = os.path.join(directory, "state.snapshot")
+        self.log_path = os.path.join(directory, "state.log")
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+        self.capture = None
+        os.makedirs(directory, exist_ok=True)
+        self.lock_file = open(os.path.join(directory, "state.lock"), "w")
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self.writer = True
+        except BlockingIOError:
+            logger.info(f"another process saves the state in {directory}, this one only restores it")
+            self.writer = False
+        # seconds the last restore() took
+        self.restore_seconds = None
+
+    def record(self, kind: str, data):
+        """
+        Queue a change for the log, never blocks
+        """
+        if self.writer:
+            self.queue.put((kind, time.time(), data))
+
+    def restore(self, apply_snapshot, apply_entry):
+        """
+        Load the snapshot, then replay the log over it
+
+        apply_snapshot(values, arrays): the arrays are only valid during the call, copy what is kept
+        apply_entry(kind, time, data)
+        """
+        start = time.perf_counter()
+        try:
+            snapshot = read_snapshot(self.snapshot_path)
+        except (ValueError, KeyError, struct.error) as error:
+            # same as a torn log line: start without it rather than not start at all
+            logger.error(f"could not read the state snapshot {self.snapshot_path}, starting without it: {error!r}")
+            snapshot = None
+            if self.writer:
+                # kept for a look, the next compaction writes a good one
+                os.replace(self.snapshot_path, self.snapshot_path + ".bad")
+        if snapshot is not None:
+            apply_snapshot(*snapshot)
+        entries = 0
+        try:
+            with open(self.log_path, "rb") as log:
+                for line in log:
+                    try:
+                        kind, when, data = json.loads(line)
+                    except ValueError:
+                        # the last line of a log that was being written when the server died
+                        break
+                    apply_entry(kind, when, data)
+                    entries += 1
+        except FileNotFoundError:
+            pass
+        self.restore_seconds = time.perf_counter() - start
+        logger.info(f"restored the state from {self.directory} ({entries} log entries) "
+                    f"in {1000 * self.restore_seconds:.1f}ms")
+
+    def start(self, capture):
+        """
+        Start the background thread, capture() returns (values, arrays) of the state for a snapshot
+        """
+        if not self.writer or self.thread is not None:
+            return
+        self.capture = capture
+        self.thread = threading.Thread(target=self.run, name="persistence", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        log = open(self.log_path, "ab")
+        next_snapshot = time.monotonic() + self.snapshot_seconds
+        while True:
+            try:
+                entry = self.queue.get(timeout=max(next_snapshot - time.monotonic(), 0.0))
+                self.write(log, entry)
+                # everything else that is waiting, then one flush
+                while True:
+                    self.write(log, self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            log.flush()
+            if time.monotonic() >= next_snapshot:
+                try:
+                    self.compact(log)
+                except Exception:
+                    logger.exception("saving a snapshot of the state failed")
+                next_snapshot = time.monotonic() + self.snapshot_seconds
+
+    def write(self, log, entry):
+        try:
+            line = self.encode(entry)
+        except (TypeError, ValueError):
+            # one change that json can't take is not worth losing the thread (and every change after it) over
+            logger.exception(f"could not save a {entry[0]!r} change, it is left out of the log")
+            return
+        log.write(line)
+
+    def compact(self, log):
+        """
+        Snapshot the state and start the log over
+
+        Entries queued while capturing go in the new log, applying them again on restore is harmless
+        """
+        start = time.perf_counter()
+        values, arrays = self.capture()
+        write_snapshot(self.snapshot_path, values, arrays)
+        log.truncate(0)
+        log.seek(0)
+        logger.debug(f"saved a snapshot of the state in {1000 * (time.perf_counter() - start):.1f}ms")
+
+    @staticmethod
+    def encode(entry) -> bytes:
+        return json.dumps(entry, separators=(',', ':')).encode() + b"\n"
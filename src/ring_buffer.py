@@ -0,0 +1,88 @@
+"""
+Fixed capacity ring buffer backed by a preallocated numpy array
+
+Used by the server to keep the last few seconds of audio (and per-chunk stats)
+without the list append/pop(0) dance and without growing memory.
+
+Appending n rows costs O(n) (it is a copy into the preallocated array), independent of capacity.
+Reads return views into the buffer: the data is split in two at the wrap point,
+so views() hands back both halves and the caller decides if it needs them contiguous.
+
+NOTE: there is one writer at a time, the caller is responsible for locking around append()
+"""
+import numpy as np
+
+
+class RingBuffer:
+    def __init__(self, capacity: int, dtype=np.float32, width: int = None):
+        """
+        capacity: number of rows the buffer holds before it starts overwriting the oldest
+        width: None for a 1d buffer of samples, otherwise the number of columns in each row
+        """
+        assert capacity > 0, "ring buffer capacity must be positive"
+        shape = (capacity,) if width is None else (capacity, width)
+        self.buffer = np.zeros(shape, dtype=dtype)
+        self.capacity = capacity
+        # index the next row will be written to
+        self.head = 0
+        # number of valid rows
+        self.size = 0
+        # number of rows ever appended, handy for timestamps and "has anything changed" checks
+        self.total = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def clear(self):
+        self.head = 0
+        self.size = 0
+
+    def append(self, rows):
+        """
+        Append one row or an array of rows, overwriting the oldest rows when full
+        """
+        rows = np.asarray(rows)
+        if rows.ndim == self.buffer.ndim - 1:
+            rows = rows[np.newaxis]
+        n = len(rows)
+        self.total += n
+        if n >= self.capacity:
+            # only the newest rows fit
+            rows = rows[-self.capacity:]
+            self.buffer[:] = rows
+            self.head = 0
+            self.size = self.capacity
+            return
+        end = self.head + n
+        if end <= self.capacity:
+            self.buffer[self.head:end] = rows
+        else:
+            split = self.capacity - self.head
+            self.buffer[self.head:] = rows[:split]
+            self.buffer[:n - split] = rows[split:]
+        self.head = end % self.capacity
+        self.size = min(self.size + n, self.capacity)
+
+    def views(self, n: int = None):
+        """
+        Return the newest n rows (all of them by default), oldest first, as two views
+
+        The second view is empty unless the rows wrap around the end of the buffer.
+        Nothing is copied, so the views change when the buffer is appended to.
+        """
+        n = self.size if n is None else min(n, self.size)
+        start = (self.head - n) % self.capacity
+        if start + n <= self.capacity:
+            return self.buffer[start:start + n], self.buffer[0:0]
+        return self.buffer[start:], self.buffer[:self.head]
+
+    def latest(self, n: int = None):
+        """
+        Return the newest n rows as one array
+
+        This is a view when the rows are contiguous and a copy when they wrap
+        """
+        first, second = self.views(n)
+        if len(second) == 0:
+            return first
+        return np.concatenate((first, second))
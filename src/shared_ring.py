@@ -0,0 +1,127 @@
+"""
+Ring of fixed size slots in shared memory, for handing data between processes without pickling
+
+One process writes, any number of processes read. Each slot is guarded by a seqlock:
+    version (u64) | seq (u64) | length (u32) | data
+the writer makes version odd, writes the slot, then makes it even again. A reader copies the slot and
+checks the version did not change (and was even) while it was copying, otherwise it tries again.
+Nobody ever waits on a lock, a reader that is lapped by the writer just finds out the slot holds a newer seq.
+
+The ring header is the number of slots ever written (u64), so seq n lives in slot n % slots.
+
+NOTE: there is one writer at a time, the caller is responsible for that (same as RingBuffer)
+"""
+import struct
+import time
+from multiprocessing import shared_memory
+
+HEADER = struct.Struct("<Q")
+SLOT_HEADER = struct.Struct("<QQI")
+# a reader gives up on a slot that is being written for this long (the writer died halfway)
+READ_TIMEOUT = 0.1
+
+
+class SharedRing:
+    def __init__(self, slots: int, slot_size: int, name: str = None, create: bool = False, buffer=None):
+        """
+        slots: number of slots, slot_size: most bytes one slot can hold
+        name: shared memory block to attach to (create=False) or to create (None picks a name)
+        buffer: put the ring in this (writable, shared) memoryview instead, of at least nbytes() bytes
+            e.g. part of an mmap'd file (shared_state.py), it is not cleared
+        """
+        self.slots = slots
+        self.slot_size = slot_size
+        self.stride = SLOT_HEADER.size + slot_size
+        size = self.nbytes(slots, slot_size)
+        self.shm = None
+        if buffer is not None:
+            self.buffer = buffer
+            return
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+        self.buffer = self.shm.buf
+        if create:
+            self.buffer[:size] = bytes(size)
+
+    @staticmethod
+    def nbytes(slots: int, slot_size: int) -> int:
+        """
+        Bytes a ring of this size takes
+        """
+        return HEADER.size + slots * (SLOT_HEADER.size + slot_size)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name if self.shm is not None else None
+
+    @property
+    def count(self) -> int:
+        """
+        Number of slots ever written, the next write gets this seq
+        """
+        return HEADER.unpack_from(self.buffer, 0)[0]
+
+    def offset(self, seq: int) -> int:
+        return HEADER.size + (seq % self.slots) * self.stride
+
+    def write(self, *parts) -> int:
+        """
+        Write the concatenation of parts (bytes-like) into the next slot, returns its seq
+        """
+        length = sum(len(memoryview(part).cast('B')) for part in parts)
+        if length > self.slot_size:
+            raise ValueError(f"{length} bytes do not fit in a {self.slot_size} byte slot")
+        seq = self.count
+        offset = self.offset(seq)
+        version = SLOT_HEADER.unpack_from(self.buffer, offset)[0]
+        SLOT_HEADER.pack_into(self.buffer, offset, version + 1, seq, length)
+        position = offset + SLOT_HEADER.size
+        for part in parts:
+            part = memoryview(part).cast('B')
+            self.buffer[position:position + len(part)] = part
+            position += len(part)
+        SLOT_HEADER.pack_into(self.buffer, offset, version + 2, seq, length)
+        HEADER.pack_into(self.buffer, 0, seq + 1)
+        return seq
+
+    def read(self, seq: int):
+        """
+        Copy of the data written as seq, or None if it was overwritten already (or not written yet)
+        """
+        offset = self.offset(seq)
+        deadline = None
+        while True:
+            version, slot_seq, length = SLOT_HEADER.unpack_from(self.buffer, offset)
+            if version % 2 == 0:
+                if slot_seq != seq or version == 0:
+                    return None
+                data = bytes(self.buffer[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + length])
+                if SLOT_HEADER.unpack_from(self.buffer, offset)[0] == version:
+                    return data
+            # the writer is in this slot right now
+            if deadline is None:
+                deadline = time.monotonic() + READ_TIMEOUT
+            elif time.monotonic() > deadline:
+                return None
+
+    def latest(self):
+        """
+        (seq, data) of the newest slot, or None if nothing was written yet
+        """
+        while True:
+            count = self.count
+            if count == 0:
+                return None
+            data = self.read(count - 1)
+            if data is not None:
+                return count - 1, data
+            if self.count == count:
+                return None
+
+    def close(self):
+        self.buffer = None
+        if self.shm is not None:
+            self.shm.close()
+
+    def unlink(self):
+        if self.shm is not None:
+            self.shm.unlink()
@@ -0,0 +1,128 @@
+"""
+Server state shared between processes, kept in one mmap'd file
+
+Everything flask_server.py knows lives in module globals, so with more than one server process a chunk
+POSTed to one process was invisible to a GET on another. With SHARED_STATE set, every process opens the
+same file (put it on a tmpfs, e.g. /dev/shm) and what has to be seen everywhere goes through it:
+the audio chunks, the features of each chunk, the general data and the client settings.
+
+The file holds named SharedRings (shared_ring.py), one after the other:
+    magic | number of rings | (name, slots, slot_size) per ring | the rings
+Readers never lock: every slot is a seqlock. Writers from all processes take the writer lock,
+an flock on the file plus a thread lock (flock does not keep out threads of the same process).
+
+The first process to open the file lays it out, the others check they agree on the layout.
+A file left over from a run with different sizes is an error, delete it (it is only a cache of the state).
+
+NOTE: unix only (fcntl), same as the docker image
+"""
+import contextlib
+import fcntl
+import json
+import mmap
+import os
+import struct
+import threading
+
+from shared_ring import SharedRing
+
+MAGIC = b"COSTATE1"
+HEADER = struct.Struct("<8sI")
+RING_HEADER = struct.Struct("<16sQQ")
+
+
+class SharedState:
+    def __init__(self, path: str, rings: dict):
+        """
+        path: file the state is kept in, created if it does not exist
+        rings: name -> (slots, slot_size), every process has to pass the same
+        """
+        self.path = path
+        layout = HEADER.pack(MAGIC, len(rings))
+        for name, (slots, slot_size) in rings.items():
+            layout += RING_HEADER.pack(name.encode(), slots, slot_size)
+        size = len(layout) + sum(SharedRing.nbytes(slots, slot_size) for slots, slot_size in rings.values())
+
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self.thread_lock = threading.RLock()
+        self.depth = 0
+        with self.writing():
+            existing = os.fstat(self.fd).st_size
+            if existing == 0:
+                # ftruncate fills with zeros, which is an empty ring
+                os.ftruncate(self.fd, size)
+                os.pwrite(self.fd, layout, 0)
+            matches = existing == 0 or (existing == size and os.pread(self.fd, len(layout), 0) == layout)
+        if not matches:
+            os.close(self.fd)
+            raise ValueError(f"{path} holds shared state with a different layout, delete it or use another path")
+        self.mmap = mmap.mmap(self.fd, size)
+        self.buffer = memoryview(self.mmap)
+
+        self.rings = dict()
+        offset = len(layout)
+        for name, (slots, slot_size) in rings.items():
+            end = offset + SharedRing.nbytes(slots, slot_size)
+            self.rings[name] = SharedRing(slots, slot_size, buffer=self.buffer[offset:end])
+            offset = end
+        # name -> (seq, value) of the last json read, most reads are of a value that did not change
+        self.cache = dict()
+
+    @contextlib.contextmanager
+    def writing(self):
+        """
+        Hold the writer lock, can be nested (e.g. around a read-modify-write of a json value)
+        """
+        with self.thread_lock:
+            self.depth += 1
+            if self.depth == 1:
+                fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                self.depth -= 1
+                if self.depth == 0:
+                    fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def write(self, name: str, *parts) -> int:
+        """
+        Write the parts into ring name, returns the seq it got
+        """
+        with self.writing():
+            return self.rings[name].write(*parts)
+
+    def read(self, name: str, seq: int):
+        return self.rings[name].read(seq)
+
+    def write_json(self, name: str, value) -> int:
+        return self.write(name, json.dumps(value, separators=(',', ':')).encode())
+
+    def read_json(self, name: str, seq: int):
+        data = self.read(name, seq)
+        return json.loads(data) if data is not None else None
+
+    def latest_json(self, name: str, default=None):
+        """
+        Newest json value in ring name, default if nothing was written yet
+
+        Decoded once per value, the same object is handed out until a new one is written (do not change it)
+        """
+        ring = self.rings[name]
+        count = ring.count
+        cached = self.cache.get(name)
+        if cached is not None and cached[0] == count - 1:
+            return cached[1]
+        latest = ring.latest()
+        if latest is None:
+            return default
+        seq, data = latest
+        value = json.loads(data)
+        self.cache[name] = (seq, value)
+        return value
+
+    def close(self):
+        for ring in self.rings.values():
+            ring.close()
+        self.buffer.release()
+        self.mmap.close()
+        os.close(self.fd)
@@ -0,0 +1,291 @@
+"""
+Framed streaming audio ingest over TCP
+
+This is the low-overhead path server_tasks.py was meant to be: one long-lived socket per capture client,
+no HTTP request per chunk. It replaces the old socket code there, which opened the listener inside a
+celery worker_ready hook and assumed every recv() returned exactly one message.
+
+TCP is a byte stream, so every message is length-prefixed and reassembled by FrameDecoder
+no matter how the bytes are split up between recv() calls.
+
+Every frame starts with a 10 byte header (little endian):
+    magic b"COAS" | protocol version (u8) | frame type (u8) | payload length (u32)
+
+Frame types:
+    HELLO    client -> server, json {"mics": {id: name}, "settings": {...}}, must be the first frame
+    WELCOME  server -> client, json {"version": PROTOCOL_VERSION, "settings": {...}}, reply to HELLO
+    AUDIO    client -> server, AUDIO_HEADER followed by raw interleaved PCM:
+             seq (u32) | capture time (f64, unix seconds) | dtype code (u8) | channels (u8) | samplerate (u32)
+    SETTINGS server -> client, json, the audio settings were changed on the server
+    ERROR    server -> client, json {"message": ...}, sent right before the server closes the connection
+
+A client speaking another protocol version gets an ERROR frame and is disconnected.
+
+The listener runs an asyncio event loop in a background thread of the server process and hands
+every chunk to the same ingest code as /audio_in (see flask_server.start_background_servers).
+"""
+import abc
+import asyncio
+import json
+import logging
+import struct
+import threading
+
+MAGIC = b"COAS"
+PROTOCOL_VERSION = 1
+HEADER = struct.Struct("<4sBBI")
+AUDIO_HEADER = struct.Struct("<IdBBI")
+HELLO, WELCOME, AUDIO, SETTINGS, ERROR = range(1, 6)
+DTYPE_CODES = {1: 'float32', 2: 'int16'}
+DTYPE_NAMES = {name: code for code, name in DTYPE_CODES.items()}
+# upper bound on a single frame, way more than any sensible chunk of audio
+MAX_PAYLOAD = 4 * 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def encode_frame(frame_type: int, payload: bytes = b"") -> bytes:
+    return HEADER.pack(MAGIC, PROTOCOL_VERSION, frame_type, len(payload)) + payload
+
+
+def encode_json_frame(frame_type: int, data) -> bytes:
+    return encode_frame(frame_type, json.dumps(data).encode())
+
+
+def encode_audio_frame(pcm: bytes, seq: int, capture_time: float, dtype: str = 'float32',
+                       channels: int = 1, samplerate: int = 48000) -> bytes:
+    header = AUDIO_HEADER.pack(seq, capture_time, DTYPE_NAMES[dtype], channels, samplerate)
+    return encode_frame(AUDIO, header + bytes(pcm))
+
+
+def decode_audio_payload(payload: bytes):
+    """
+    Split an AUDIO payload into (meta, pcm)
+
+    pcm is a memoryview of payload, nothing is copied
+    """
+    if len(payload) < AUDIO_HEADER.size:
+        raise ProtocolError(f"audio frame of {len(payload)} bytes is shorter than its header")
+    seq, capture_time, dtype_code, channels, samplerate = AUDIO_HEADER.unpack_from(payload)
+    if dtype_code not in DTYPE_CODES:
+        raise ProtocolError(f"unknown dtype code {dtype_code}")
+    meta = {
+        'seq': seq,
+        'capture_time': capture_time,
+        'dtype': DTYPE_CODES[dtype_code],
+        'channels': channels,
+        'samplerate': samplerate,
+    }
+    return meta, memoryview(payload)[AUDIO_HEADER.size:]
+
+
+class FrameDecoder:
+    """
+    Reassembly buffer: feed it whatever recv() returned, get back every complete frame
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data: bytes):
+        """
+        Add data to the buffer and return a list of (frame type, payload) for the complete frames
+
+        Raises ProtocolError if the stream is not (or is no longer) made of our frames
+        """
+        self.buffer += data
+        frames = []
+        offset = 0
+        while len(self.buffer) - offset >= HEADER.size:
+            magic, version, frame_type, length = HEADER.unpack_from(self.buffer, offset)
+            if magic != MAGIC:
+                raise ProtocolError("bad magic, this is not a creativity-optional audio stream")
+            if version != PROTOCOL_VERSION:
+                raise ProtocolError(f"unsupported protocol version {version}, the server speaks version {PROTOCOL_VERSION}")
+            if length > MAX_PAYLOAD:
+                raise ProtocolError(f"frame of {length} bytes is too large")
+            end = offset + HEADER.size + length
+            if len(self.buffer) < end:
+                # the rest of this frame has not arrived yet
+                break
+            frames.append((frame_type, bytes(self.buffer[offset + HEADER.size:end])))
+            offset = end
+        del self.buffer[:offset]
+        return frames
+
+
+class SequenceTracker:
+    """
+    Keep track of sequence numbers: count the frames that never showed up and refuse old/repeated ones
+    """
+    def __init__(self):
+        self.last = None
+        self.received = 0
+        self.lost = 0
+        self.stale = 0
+
+    def update(self, seq: int) -> bool:
+        """
+        Returns True if seq is new and should be used
+        """
+        if self.last is not None and seq <= self.last:
+            self.stale += 1
+            return False
+        if self.last is not None:
+            self.lost += seq - self.last - 1
+        self.last = seq
+        self.received += 1
+        return True
+
+
+class IngestProtocol(asyncio.Protocol):
+    def __init__(self, server):
+        self.server = server
+        self.decoder = FrameDecoder()
+        self.sequence = SequenceTracker()
+        self.transport = None
+        self.greeted = False
+        self.source = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.peer = transport.get_extra_info('peername')
+        self.server.connections.add(self)
+        logger.info(f"stream client connected from {self.peer}")
+
+    def connection_lost(self, exc):
+        self.server.connections.discard(self)
+        logger.info(f"stream client {self.peer} disconnected: {self.sequence.received} chunks, "
+                    f"{self.sequence.lost} lost, {self.sequence.stale} stale")
+
+    def send_error(self, message: str):
+        logger.warning(f"closing stream from {self.peer}: {message}")
+        self.transport.write(encode_json_frame(ERROR, {"message": message}))
+        self.transport.close()
+
+    def data_received(self, data):
+        try:
+            frames = self.decoder.feed(data)
+            for frame_type, payload in frames:
+                self.handle_frame(frame_type, payload)
+        except ProtocolError as error:
+            self.send_error(str(error))
+        except ValueError as error:
+            # json errors end up here
+            self.send_error(f"malformed frame: {error}")
+
+    def handle_frame(self, frame_type: int, payload: bytes):
+        if not self.greeted:
+            if frame_type != HELLO:
+                raise ProtocolError("the first frame has to be HELLO")
+            hello = json.loads(payload)
+            settings = hello.get('settings', {})
+            self.source = settings.get('source')
+            self.server.on_hello(hello.get('mics', {}), settings)
+            self.greeted = True
+            self.transport.write(encode_json_frame(WELCOME, {
+                "version": PROTOCOL_VERSION,
+                "settings": self.server.get_settings(),
+            }))
+        elif frame_type == AUDIO:
+            meta, pcm = decode_audio_payload(payload)
+            if not self.sequence.update(meta['seq']):
+                return
+            try:
+                self.server.on_audio(pcm, source=self.source, **meta)
+            except ValueError as error:
+                # a bad chunk is not worth dropping the connection over
+                logger.warning(f"dropped chunk {meta['seq']} from {self.peer}: {error}")
+        else:
+            raise ProtocolError(f"unexpected frame type {frame_type}")
+
+
+class IngestListener(abc.ABC):
+    """
+    A listener running its own asyncio event loop in a background thread of the server process,
+    subclasses open their socket in listen() (StreamIngestServer here, UdpIngestServer in udp_ingest.py)
+    """
+    # name of the background thread
+    thread_name = "ingest"
+
+    def __init__(self, on_audio, host: str, port: int):
+        self.on_audio = on_audio
+        self.host = host
+        self.port = port
+        self.loop = None
+        self.server = None
+        self.ready = threading.Event()
+
+    def start(self):
+        """
+        Start listening in a background thread, returns once the socket is bound
+        """
+        if self.loop is not None:
+            return None
+        thread = threading.Thread(target=self.run, name=self.thread_name, daemon=True)
+        thread.start()
+        self.ready.wait()
+        return thread
+
+    @abc.abstractmethod
+    async def listen(self):
+        """
+        Open the listening socket, returns the port it is bound to
+        """
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            # port 0 picks a free port, report the real one
+            self.port = self.loop.run_until_complete(self.listen())
+            logger.info(f"{type(self).__name__} listening on {self.host}:{self.port}")
+        except OSError as error:
+            logger.error(f"{type(self).__name__} could not listen on {self.host}:{self.port}: {error}")
+            self.loop.close()
+            self.loop = None
+            return
+        finally:
+            self.ready.set()
+        self.loop.run_forever()
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.server.close)
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+class StreamIngestServer(IngestListener):
+    thread_name = "stream-ingest"
+
+    def __init__(self, on_audio, on_hello=None, get_settings=None, host: str = "0.0.0.0", port: int = 4242):
+        """
+        on_audio(pcm, seq, capture_time, dtype, channels, samplerate, source): called for every new chunk
+        on_hello(mics, settings): called when a client connects
+        get_settings(): settings sent back to a client in WELCOME
+        """
+        super().__init__(on_audio, host, port)
+        self.on_hello = on_hello or (lambda mics, settings: None)
+        self.get_settings = get_settings or dict
+        self.connections = set()
+
+    async def listen(self):
+        self.server = await self.loop.create_server(lambda: IngestProtocol(self), self.host, self.port)
+        return self.server.sockets[0].getsockname()[1]
+
+    def send_settings(self, settings: dict):
+        """
+        Push new settings to every connected client, safe to call from any thread
+        """
+        if self.loop is None or not self.connections:
+            return
+        frame = encode_json_frame(SETTINGS, settings)
+        self.loop.call_soon_threadsafe(self.broadcast, frame)
+
+    def broadcast(self, frame: bytes):
+        for connection in list(self.connections):
+            if connection.greeted:
+                connection.transport.write(frame)
@@ -0,0 +1,151 @@
+"""
+Incremental tempo/beat tracker
+
+Analyzer.readData used to append every block to the audio history (copying all of it) and rerun
+librosa.beat.plp over the whole window, so the cost of every chunk grew with the window.
+This does a constant amount of work per hop instead:
+    1. onset strength: spectral flux between this hop's (log) spectrum and the previous one
+    2. the onset strength goes into a ring buffer that only needs to be max_lag long
+    3. the autocorrelation of the onset strength for every lag in the tempo range is updated with the
+       new value and decayed, so old beats fade out instead of having to be recomputed
+    4. the best lag (weighted towards ~120 bpm) is the tempo, halved if there are beats halfway as well,
+       a phase accumulator running at that tempo is nudged towards onsets to follow the beat
+
+Outputs:
+    bpm: beats per minute
+    beat_phase: 0 on the beat, counting up to 1 right before the next one
+    pulse: 1 on the beat, falling to 0 halfway between beats (smooth, good for driving visuals)
+    confidence: how much the chosen lag stands out, 0 to 1
+"""
+import numpy as np
+from ring_buffer import RingBuffer
+
+
+class TempoTracker:
+    def __init__(self, samplerate: int = 48000, hop_length: int = 512, min_bpm: float = 60.0,
+                 max_bpm: float = 200.0, prior_bpm: float = 120.0, memory_seconds: float = 6.0):
+        """
+        hop_length: samples per onset strength value
+        memory_seconds: roughly how long a beat keeps influencing the tempo estimate
+        """
+        self.samplerate = samplerate
+        self.hop_length = hop_length
+        self.settings = (min_bpm, max_bpm, prior_bpm, memory_seconds)
+        self.frame_rate = samplerate / hop_length
+        self.min_lag = max(1, int(np.floor(60.0 * self.frame_rate / max_bpm)))
+        self.max_lag = int(np.ceil(60.0 * self.frame_rate / min_bpm))
+        self.lags = np.arange(self.min_lag, self.max_lag + 1)
+        # lag 0 is the energy, used for the confidence
+        self.acf_lags = np.arange(0, self.max_lag + 1)
+        # log-normal prior over tempo, same idea as librosa's tempo estimate, stops it from jumping an octave
+        self.prior = np.exp(-0.5 * (np.log2(60.0 * self.frame_rate / self.lags / prior_bpm)) ** 2)
+        self.decay = np.exp(-1.0 / (memory_seconds * self.frame_rate))
+        # the onset strength is normalized over a shorter window, it has to follow the music getting louder/quieter
+        self.normalize_rate = 1.0 - np.exp(-1.0 / self.frame_rate)
+
+        # spectral flux uses frames of two hops, hann windowed
+        self.window = np.hanning(2 * hop_length).astype(np.float32)
+        self.previous_spectrum = None
+        # samples left over from the last chunk that did not fill a hop, plus the hop before them
+        self.pending = np.zeros(0, dtype=np.float32)
+        self.last_hop = np.zeros(hop_length, dtype=np.float32)
+
+        self.onsets = RingBuffer(len(self.acf_lags))
+        self.onset_mean = None
+        self.onset_var = 1e-6
+        self.acf = np.zeros(len(self.acf_lags))
+        self.period = 60.0 * self.frame_rate / prior_bpm
+        self.phase = 0.0
+        self.confidence = 0.0
+
+    def onset_strength(self, frames):
+        """
+        Spectral flux of each frame (rows of frames) against the frame before it
+        """
+        spectrum = np.log1p(100.0 * np.abs(np.fft.rfft(frames * self.window, axis=1)))
+        previous = self.previous_spectrum if self.previous_spectrum is not None else spectrum[0]
+        flux = np.diff(spectrum, axis=0, prepend=previous[np.newaxis])
+        self.previous_spectrum = spectrum[-1]
+        return np.maximum(flux, 0.0).mean(axis=1)
+
+    def update(self, chunk, samplerate: int = None) -> dict:
+        """
+        Feed a chunk of mono samples and return the current tempo estimate
+        """
+        if samplerate is not None and samplerate != self.samplerate:
+            # lags are counted in hops, everything has to start over
+            self.__init__(samplerate, self.hop_length, *self.settings)
+        signal = np.concatenate((self.pending, np.asarray(chunk, dtype=np.float32).reshape(-1)))
+        hops = len(signal) // self.hop_length
+        self.pending = signal[hops * self.hop_length:]
+        if hops > 0:
+            signal = np.concatenate((self.last_hop, signal[:hops * self.hop_length]))
+            self.last_hop = signal[-self.hop_length:]
+            frames = np.lib.stride_tricks.sliding_window_view(signal, 2 * self.hop_length)[::self.hop_length]
+            for onset in self.onset_strength(frames):
+                self.add_onset(onset)
+        return self.state()
+
+    def add_onset(self, onset: float):
+        """
+        One new onset strength value: O(max_lag) no matter how much audio came before it
+        """
+        # normalize with a running mean/variance so quiet and loud songs behave the same
+        rate = self.normalize_rate
+        if self.onset_mean is None:
+            self.onset_mean = onset
+        self.onset_mean += rate * (onset - self.onset_mean)
+        self.onset_var += rate * ((onset - self.onset_mean) ** 2 - self.onset_var)
+        value = (onset - self.onset_mean) / np.sqrt(self.onset_var + 1e-12)
+        self.onsets.append(value)
+
+        if len(self.onsets) == len(self.acf_lags):
+            history = self.onsets.latest()
+            # history[-1 - lag] is the onset lag hops ago
+            # only onsets count, the quiet between them is not evidence of anything
+            history = np.maximum(history, 0.0)
+            self.acf *= self.decay
+            self.acf += history[-1] * history[-1 - self.acf_lags]
+            self.update_tempo()
+
+        # follow the beat: advance the phase by one hop, pull it towards 0 on strong onsets
+        self.phase = (self.phase + 1.0 / self.period) % 1.0
+        if value > 1.5:
+            error = self.phase if self.phase < 0.5 else self.phase - 1.0
+            self.phase = (self.phase - 0.2 * error) % 1.0
+
+    def update_tempo(self):
+        # a tempo that falls between two lags splits its peak across them, smooth so it can still win
+        smoothed = np.convolve(self.acf, (0.25, 0.5, 0.25), mode='same')
+        weighted = np.maximum(smoothed[self.lags], 0.0) * self.prior
+        best = int(np.argmax(weighted))
+        if weighted[best] <= 0 or self.acf[0] <= 0:
+            self.confidence = 0.0
+            return
+        # parabolic interpolation between the neighbouring lags for sub-hop resolution
+        lag = float(self.lags[best])
+        if 0 < best < len(weighted) - 1:
+            left, middle, right = weighted[best - 1:best + 2]
+            denominator = left - 2 * middle + right
+            if denominator != 0:
+                lag += 0.5 * (left - right) / denominator
+        # a beat every lag also repeats every 2 * lag, so the peak at 2 * lag can win (75 bpm for a 150 bpm track)
+        # if there is a peak halfway as well, the faster tempo is the real one
+        half = lag / 2
+        if half >= self.min_lag:
+            below = int(np.floor(half))
+            halfway = self.acf[below] + (self.acf[below + 1] if half != below else 0.0)
+            if halfway >= 0.5 * self.acf[int(round(lag))]:
+                lag = half
+        self.period = lag
+        # 1 when the onsets repeat exactly every period, ~0 for noise (where every lag looks the same)
+        floor = self.acf[self.lags].mean()
+        self.confidence = float(np.clip((smoothed[int(round(lag))] - floor) / (self.acf[0] - floor + 1e-12), 0.0, 1.0))
+
+    def state(self) -> dict:
+        return {
+            "bpm": float(60.0 * self.frame_rate / self.period),
+            "beat_phase": float(self.phase),
+            "pulse": float(0.5 * (1.0 + np.cos(2 * np.pi * self.phase))),
+            "confidence": self.confidence,
+        }
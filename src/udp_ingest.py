@@ -0,0 +1,313 @@
+"""
+UDP audio ingest with a jitter buffer
+
+testing/local_audio_udp.py was called UDP but used a TCP socket. With real UDP, one late packet does not
+hold up everything behind it (no head-of-line blocking), at the cost of packets arriving late,
+out of order, twice, or not at all. The jitter buffer sorts that out:
+    - packets are held for a short time (UDP_JITTER_DELAY) and released in sequence order
+    - packets that arrive after their turn has passed are dropped (stale)
+    - packets that never show up are given up on and counted as lost
+
+A capture block does not fit under the MTU, so each block is split into fragments, one per datagram.
+Every datagram starts with a 29 byte header (little endian):
+    magic b"COAU" | version (u8) | seq (u32) | block (u32) | fragment (u8) | fragments (u8)
+    | dtype code (u8) | channels (u8) | samplerate (u32) | capture time (f64, unix seconds)
+followed by raw interleaved PCM.
+seq counts datagrams and is what the jitter buffer orders by, block counts capture blocks.
+A block missing a fragment is dropped instead of being patched up.
+
+UDP is one way, settings changes do not reach UDP clients (use the tcp or websocket transport for that).
+"""
+import asyncio
+import logging
+import socket
+import struct
+import time
+
+from stream_ingest import DTYPE_CODES, DTYPE_NAMES, IngestListener, ProtocolError
+
+MAGIC = b"COAU"
+PROTOCOL_VERSION = 1
+HEADER = struct.Struct("<4sBIIBBBBId")
+# stay well under the 1472 bytes that fit in one ethernet frame
+MAX_DATAGRAM = 1400
+# a seq this far behind means the client restarted, not that the packet is late
+RESTART_WINDOW = 1000
+# how often buffered packets are checked when nothing new arrives
+FLUSH_INTERVAL = 0.005
+# kernel receive buffer, the default is small enough to overflow while a block is being analysed
+RECEIVE_BUFFER = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+def encode_datagrams(pcm: bytes, seq: int, block: int, capture_time: float, dtype: str = 'float32',
+                     channels: int = 1, samplerate: int = 48000, max_size: int = MAX_DATAGRAM) -> list:
+    """
+    Split one block of PCM into datagrams numbered from seq, fragments end on a frame boundary
+    """
+    frame_size = struct.calcsize('f' if dtype == 'float32' else 'h') * channels
+    fragment_size = (max_size - HEADER.size) // frame_size * frame_size
+    pcm = memoryview(pcm).cast('B')
+    fragments = max(1, -(-len(pcm) // fragment_size))
+    datagrams = []
+    for fragment in range(fragments):
+        header = HEADER.pack(MAGIC, PROTOCOL_VERSION, seq + fragment, block, fragment, fragments,
+                             DTYPE_NAMES[dtype], channels, samplerate, capture_time)
+        datagrams.append(header + pcm[fragment * fragment_size:(fragment + 1) * fragment_size])
+    return datagrams
+
+
+def decode_datagram(data: bytes):
+    """
+    Split a datagram into (meta, pcm), pcm is a memoryview of data
+    """
+    if len(data) < HEADER.size:
+        raise ProtocolError(f"datagram of {len(data)} bytes is shorter than its header")
+    magic, version, seq, block, fragment, fragments, dtype_code, channels, samplerate, capture_time = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ProtocolError("bad magic, this is not a creativity-optional audio datagram")
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"unsupported protocol version {version}, the server speaks version {PROTOCOL_VERSION}")
+    if dtype_code not in DTYPE_CODES or fragment >= fragments:
+        raise ProtocolError("malformed datagram header")
+    meta = {
+        'seq': seq,
+        'block': block,
+        'fragment': fragment,
+        'fragments': fragments,
+        'dtype': DTYPE_CODES[dtype_code],
+        'channels': channels,
+        'samplerate': samplerate,
+        'capture_time': capture_time,
+    }
+    return meta, memoryview(data)[HEADER.size:]
+
+
+class JitterBuffer:
+    def __init__(self, depth: int = 16, max_delay: float = 0.02):
+        """
+        depth: packets held while waiting for a missing one before giving up on it
+        max_delay: seconds a packet is held while waiting for a missing one before giving up on it
+        """
+        self.depth = depth
+        self.max_delay = max_delay
+        # seq -> (arrival time, packet)
+        self.packets = dict()
+        self.next_seq = None
+        self.highest = None
+        self.received = 0
+        self.lost = 0
+        self.stale = 0
+        self.duplicates = 0
+        self.reordered = 0
+
+    def stats(self) -> dict:
+        return {
+            'received': self.received,
+            'lost': self.lost,
+            'stale': self.stale,
+            'duplicates': self.duplicates,
+            'reordered': self.reordered,
+            'buffered': len(self.packets),
+        }
+
+    def push(self, seq: int, packet, now: float):
+        """
+        Add a packet that arrived at time now
+        """
+        if self.next_seq is None:
+            self.next_seq = seq
+        elif seq < self.next_seq:
+            if self.next_seq - seq > RESTART_WINDOW:
+                self.packets.clear()
+                self.next_seq = seq
+                self.highest = None
+            else:
+                # too late, we already moved past it
+                self.stale += 1
+                return
+        if seq in self.packets:
+            self.duplicates += 1
+            return
+        if self.highest is not None and seq < self.highest:
+            self.reordered += 1
+        self.highest = seq if self.highest is None else max(self.highest, seq)
+        self.received += 1
+        self.packets[seq] = (now, packet)
+
+    def pop_ready(self, now: float) -> list:
+        """
+        Return the packets that are ready, in sequence order
+
+        A gap is waited on until the packet after it has been held for max_delay,
+        or until more than depth packets are waiting, then the missing packets count as lost
+        """
+        ready = []
+        while self.packets:
+            if self.next_seq in self.packets:
+                ready.append(self.packets.pop(self.next_seq)[1])
+                self.next_seq += 1
+                continue
+            oldest = min(self.packets)
+            if len(self.packets) > self.depth or now - self.packets[oldest][0] >= self.max_delay:
+                self.lost += oldest - self.next_seq
+                self.next_seq = oldest
+                continue
+            break
+        return ready
+
+
+class BlockAssembler:
+    """
+    Put the fragments of each block back together, in the order the jitter buffer releases them
+    """
+    def __init__(self):
+        self.block = None
+        self.meta = None
+        self.parts = None
+        self.complete = 0
+        self.incomplete = 0
+
+    def add(self, meta: dict, pcm):
+        """
+        Returns (meta of the first fragment, pcm of the whole block) once a block is complete, otherwise None
+        """
+        if meta['block'] != self.block:
+            if self.parts is not None:
+                # the rest of the previous block never came
+                self.incomplete += 1
+            self.block = meta['block']
+            self.meta = meta
+            self.parts = []
+        if self.parts is None:
+            # this block is already complete or broken
+            return None
+        if meta['fragment'] != len(self.parts):
+            self.parts = None
+            self.incomplete += 1
+            return None
+        self.parts.append(pcm)
+        if len(self.parts) < meta['fragments']:
+            return None
+        data = self.parts[0] if len(self.parts) == 1 else b"".join(self.parts)
+        self.parts = None
+        self.complete += 1
+        return self.meta, data
+
+
+class UdpSource:
+    def __init__(self, name: str, depth: int, max_delay: float):
+        self.name = name
+        self.jitter = JitterBuffer(depth, max_delay)
+        self.assembler = BlockAssembler()
+        # time.monotonic() of the last datagram, a client that restarts comes back from a new port
+        self.last_seen = time.monotonic()
+
+    def stats(self) -> dict:
+        stats = self.jitter.stats()
+        stats['blocks'] = self.assembler.complete
+        stats['dropped_blocks'] = self.assembler.incomplete
+        return stats
+
+
+class UdpIngestProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server):
+        self.server = server
+
+    def datagram_received(self, data, addr):
+        try:
+            meta, pcm = decode_datagram(data)
+        except ProtocolError as error:
+            self.server.malformed += 1
+            logger.debug(f"ignoring datagram from {addr}: {error}")
+            return
+        source = self.server.sources.get(addr)
+        if source is None:
+            source = UdpSource(f"{addr[0]}:{addr[1]}", self.server.depth, self.server.max_delay)
+            self.server.sources[addr] = source
+            logger.info(f"udp audio from {source.name}")
+        now = time.monotonic()
+        source.last_seen = now
+        source.jitter.push(meta['seq'], (meta, pcm), now)
+        self.server.release(source, now)
+
+
+class UdpIngestServer(IngestListener):
+    thread_name = "udp-ingest"
+
+    def __init__(self, on_audio, host: str = "0.0.0.0", port: int = 4243, depth: int = 16, max_delay: float = 0.02,
+                 idle_timeout: float = 5.0):
+        """
+        on_audio(pcm, seq, capture_time, dtype, channels, samplerate, source): called for every complete block,
+        seq is the block number
+        idle_timeout: seconds without a datagram before a source is forgotten
+        """
+        super().__init__(on_audio, host, port)
+        self.depth = depth
+        self.max_delay = max_delay
+        self.idle_timeout = idle_timeout
+        # (host, port) -> UdpSource
+        self.sources = dict()
+        # summed stats of the sources that were forgotten, so totals() only counts up
+        self.stats_before = dict()
+        self.malformed = 0
+
+    def stats(self) -> dict:
+        return {source.name: source.stats() for source in list(self.sources.values())}
+
+    def totals(self) -> dict:
+        """
+        stats() summed over every source ever seen, including the forgotten ones
+        """
+        totals = dict(self.stats_before)
+        for stats in self.stats().values():
+            for name, value in stats.items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
+
+    async def listen(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)
+            sock.bind((self.host, self.port))
+        except OSError:
+            sock.close()
+            raise
+        self.server, _ = await self.loop.create_datagram_endpoint(lambda: UdpIngestProtocol(self), sock=sock)
+        self.loop.call_later(FLUSH_INTERVAL, self.flush)
+        return self.server.get_extra_info('sockname')[1]
+
+    def flush(self):
+        """
+        Release packets that stopped waiting for a missing one, even if nothing new arrived
+        """
+        now = time.monotonic()
+        for addr, source in list(self.sources.items()):
+            if now - source.last_seen > self.idle_timeout:
+                self.forget(addr)
+            elif source.jitter.packets:
+                self.release(source, now)
+        self.loop.call_later(FLUSH_INTERVAL, self.flush)
+
+    def forget(self, addr):
+        """
+        Drop a source that went quiet, its counts are kept for totals()
+        """
+        source = self.sources.pop(addr)
+        for name, value in source.stats().items():
+            if name != 'buffered':
+                self.stats_before[name] = self.stats_before.get(name, 0) + value
+        logger.info(f"udp audio from {source.name} stopped")
+
+    def release(self, source: UdpSource, now: float):
+        for meta, pcm in source.jitter.pop_ready(now):
+            block = source.assembler.add(meta, pcm)
+            if block is None:
+                continue
+            meta, data = block
+            try:
+                self.on_audio(data, seq=meta['block'], capture_time=meta['capture_time'], dtype=meta['dtype'],
+                              channels=meta['channels'], samplerate=meta['samplerate'], source=source.name)
+            except ValueError as error:
+                logger.warning(f"dropped block {meta['block']} from {source.name}: {error}")
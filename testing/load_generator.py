@@ -0,0 +1,300 @@
+"""
+Load generator for the server's ingest path
+
+Plays the part of several capture clients and a crowd of viewers at once, without a sound card,
+so server configurations (ANALYSIS_WORKER, asgi vs flask, blocksizes, ...) can be compared on any linux box:
+    - N capture clients POST chunks to /audio_in/binary (or /audio_in as JSON with --json), each paced like
+      a real mic (blocksize / samplerate seconds per chunk, --speed to go faster, 0 for as fast as possible)
+    - M viewers either stream /audio_stream or poll /features
+The audio is synthetic (a tone, noise and a click every half second) or a WAV file (--wav), looped.
+
+Reports:
+    chunks/s: what the server counted (audio_chunks_received_total on /metrics), and what the clients sent
+    POST latency: p50/p99/max of the time each chunk's request took
+    viewer staleness: how old the newest chunk was when a viewer got it (frame "time" is the server's
+        receive time, so this is only right if the load generator runs on the server's machine)
+    server CPU: process_cpu_seconds_total on /metrics over the run (one server process)
+
+usage:
+python testing/load_generator.py [-ip http://127.0.0.1:8000/] [--clients 4] [--viewers 16] [--poll]
+    [--poll-interval 0.05] [-b 1024] [--samplerate 48000] [--channels 1] [--speed 1] [--duration 30]
+    [--json] [--wav file.wav]
+
+Only needs numpy and requests.
+"""
+import json
+import logging
+import sys
+import threading
+import time
+import wave
+
+import numpy as np
+import requests
+
+logging.basicConfig(format='[%(levelname)s] %(message)s')
+logging.getLogger().setLevel(logging.INFO)
+
+DEFAULTS = {
+    'ip': "http://127.0.0.1:8000/",
+    'clients': 4,
+    'viewers': 16,
+    'poll': False,
+    'poll_interval': 0.05,
+    'blocksize': 1024,
+    'samplerate': 48000,
+    'channels': 1,
+    'speed': 1.0,
+    'duration': 30.0,
+    'json': False,
+    'wav': None,
+}
+# seconds of synthetic audio, looped
+SYNTHETIC_SECONDS = 4.0
+
+
+def usage(return_val: int):
+    print(__doc__)
+    sys.exit(return_val)
+
+
+def synthetic_audio(samplerate: int, channels: int) -> np.ndarray:
+    """
+    A 440 Hz tone with some noise and a click every half second, (frames, channels) float32
+    """
+    t = np.arange(int(SYNTHETIC_SECONDS * samplerate)) / samplerate
+    mono = 0.3 * np.sin(2 * np.pi * 440 * t) + 0.05 * np.random.default_rng(0).standard_normal(len(t))
+    click = np.exp(-np.arange(int(0.01 * samplerate)) / (0.002 * samplerate))
+    for start in range(0, len(t) - len(click), samplerate // 2):
+        mono[start:start + len(click)] += 0.6 * click
+    return np.repeat(mono[:, None], channels, axis=1).astype(np.float32)
+
+
+def read_wav(path: str) -> tuple:
+    """
+    (samples as (frames, channels) float32 in [-1, 1], samplerate) of a 16 or 32 bit PCM wav file
+    """
+    with wave.open(path, 'rb') as file:
+        width = file.getsampwidth()
+        if width not in (2, 4):
+            raise ValueError(f"{path}: only 16 and 32 bit PCM is supported, not {8 * width} bit")
+        dtype = np.int16 if width == 2 else np.int32
+        samples = np.frombuffer(file.readframes(file.getnframes()), dtype=dtype)
+        samples = samples.reshape(-1, file.getnchannels()) / float(np.iinfo(dtype).max + 1)
+        return samples.astype(np.float32), file.getframerate()
+
+
+def percentile(values, q: float):
+    return float(np.percentile(values, q)) if len(values) else float('nan')
+
+
+def capture_client(index: int, audio: np.ndarray, options: dict, stop: threading.Event, result: dict):
+    """
+    Send the audio in blocks until stop is set, noting how long each request took
+    """
+    session = requests.Session()
+    blocksize = options['blocksize']
+    interval = blocksize / options['samplerate'] / options['speed'] if options['speed'] > 0 else 0.0
+    source = f"load-{index}"
+    # spread the clients out over one interval, they would not all be in lockstep for real
+    next_send = time.perf_counter() + interval * index / max(options['clients'], 1)
+    position = 0
+    seq = 0
+    while not stop.is_set():
+        delay = next_send - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        elif interval > 0 and delay < -interval:
+            # more than a block behind, a real mic would have dropped audio by now
+            result['late'] += 1
+        next_send += interval
+        if position + blocksize > len(audio):
+            position = 0
+        block = audio[position:position + blocksize]
+        position += blocksize
+        start = time.perf_counter()
+        try:
+            if options['json']:
+                absolute = np.abs(block)
+                response = session.post(options['ip'] + "audio_in", json={
+                    "avg": float(absolute.mean()), "peak": float(absolute.max()), "data": block.tolist(),
+                    "source": source, "capture_time": time.time()})
+            else:
+                response = session.post(options['ip'] + "audio_in/binary", data=block.tobytes(), headers={
+                    "Content-Type": "application/octet-stream",
+                    "X-Audio-Channels": str(block.shape[1]),
+                    "X-Audio-Samplerate": str(options['samplerate']),
+                    "X-Audio-Seq": str(seq),
+                    "X-Audio-Source": source,
+                    "X-Audio-Capture-Time": repr(time.time()),
+                })
+            response.raise_for_status()
+        except requests.exceptions.RequestException as error:
+            result['errors'] += 1
+            logging.debug(f"client {index}: {error}")
+            # do not spin on a dead server
+            time.sleep(0.1)
+            continue
+        result['latencies'].append(time.perf_counter() - start)
+        seq += 1
+
+
+def stream_viewer(index: int, options: dict, stop: threading.Event, result: dict):
+    """
+    Read /audio_stream like the frontend does, noting how old each frame is when it arrives
+    """
+    while not stop.is_set():
+        try:
+            # the server sends a keepalive every 15 s when there is no audio
+            with requests.get(options['ip'] + "audio_stream", stream=True, timeout=(5, 30)) as response:
+                event = None
+                for line in response.iter_lines():
+                    if stop.is_set():
+                        return
+                    if line.startswith(b"event: "):
+                        event = line[len(b"event: "):]
+                    elif line.startswith(b"data: ") and event == b"audio":
+                        frame = json.loads(line[len(b"data: "):])
+                        result['staleness'].append(time.time() - frame['time'])
+                        result['frames'] += 1
+        except requests.exceptions.RequestException as error:
+            if stop.is_set():
+                return
+            result['errors'] += 1
+            logging.debug(f"viewer {index}: {error}")
+            time.sleep(0.1)
+
+
+def poll_viewer(index: int, options: dict, stop: threading.Event, result: dict):
+    """
+    Poll /features like the old frontend polled /audio_in, counting each new chunk once
+    """
+    session = requests.Session()
+    last_seq = None
+    while not stop.wait(options['poll_interval']):
+        try:
+            frame = session.get(options['ip'] + "features", params={"names": "peak"}).json()
+        except (requests.exceptions.RequestException, ValueError):
+            result['errors'] += 1
+            continue
+        if frame.get('seq') != last_seq and 'time' in frame:
+            last_seq = frame['seq']
+            result['staleness'].append(time.time() - frame['time'])
+            result['frames'] += 1
+
+
+def read_metrics(ip: str) -> dict:
+    """
+    The unlabeled metrics on /metrics, {} if the server does not have the endpoint
+    """
+    try:
+        text = requests.get(ip + "metrics", timeout=5).text
+    except requests.exceptions.RequestException:
+        return {}
+    values = dict()
+    for line in text.splitlines():
+        if line and not line.startswith("#") and "{" not in line:
+            name, value = line.split(" ", 1)
+            values[name] = float(value)
+    return values
+
+
+def parse_args(args: list) -> dict:
+    options = dict(DEFAULTS)
+    while args:
+        next = args.pop(0)
+        try:
+            if next == '-ip':
+                options['ip'] = args.pop(0)
+            elif next == '--clients':
+                options['clients'] = int(args.pop(0))
+            elif next == '--viewers':
+                options['viewers'] = int(args.pop(0))
+            elif next == '--poll':
+                options['poll'] = True
+            elif next == '--poll-interval':
+                options['poll_interval'] = float(args.pop(0))
+            elif next == '-b' or next == '--blocksize':
+                options['blocksize'] = int(args.pop(0))
+            elif next == '--samplerate':
+                options['samplerate'] = int(args.pop(0))
+            elif next == '--channels':
+                options['channels'] = int(args.pop(0))
+            elif next == '--speed':
+                options['speed'] = float(args.pop(0))
+            elif next == '--duration':
+                options['duration'] = float(args.pop(0))
+            elif next == '--json':
+                options['json'] = True
+            elif next == '--wav':
+                options['wav'] = args.pop(0)
+            else:
+                usage(1)
+        except (IndexError, ValueError):
+            logging.error(f"failed to parse command line arguments - bad value for {next}")
+            usage(1)
+    if not options['ip'].endswith("/"):
+        options['ip'] += "/"
+    return options
+
+
+def report(options: dict, clients: list, viewers: list, before: dict, after: dict, elapsed: float):
+    latencies = [latency for result in clients for latency in result['latencies']]
+    staleness = [age for result in viewers for age in result['staleness']]
+    frames = sum(result['frames'] for result in viewers)
+    print(f"{options['clients']} clients ({'json' if options['json'] else 'binary'}, blocksize {options['blocksize']}, "
+          f"{options['samplerate']} Hz, speed {options['speed']}), {options['viewers']} "
+          f"{'polling' if options['poll'] else 'streaming'} viewers, {elapsed:.1f} s")
+    print(f"chunks sent:        {len(latencies)} ({len(latencies) / elapsed:.1f}/s), "
+          f"{sum(result['errors'] for result in clients)} errors, {sum(result['late'] for result in clients)} late")
+    if 'audio_chunks_received_total' in after:
+        received = after['audio_chunks_received_total'] - before.get('audio_chunks_received_total', 0)
+        print(f"server chunks/s:    {received / elapsed:.1f}")
+    print(f"POST latency:       p50 {1000 * percentile(latencies, 50):.2f} ms, p99 {1000 * percentile(latencies, 99):.2f} ms, "
+          f"max {1000 * max(latencies, default=float('nan')):.2f} ms")
+    if viewers:
+        print(f"viewer frames:      {frames / elapsed / len(viewers):.1f}/s per viewer, "
+              f"{sum(result['errors'] for result in viewers)} errors")
+        print(f"viewer staleness:   p50 {1000 * percentile(staleness, 50):.2f} ms, "
+              f"p99 {1000 * percentile(staleness, 99):.2f} ms")
+    if 'process_cpu_seconds_total' in after:
+        cpu = after['process_cpu_seconds_total'] - before.get('process_cpu_seconds_total', 0)
+        print(f"server CPU:         {100 * cpu / elapsed:.0f}% of one core")
+    else:
+        print("server CPU:         unknown (no /metrics)")
+
+
+def main():
+    options = parse_args(sys.argv[1:])
+    if options['wav']:
+        audio, options['samplerate'] = read_wav(options['wav'])
+    else:
+        audio = synthetic_audio(options['samplerate'], options['channels'])
+
+    stop = threading.Event()
+    clients = [{'latencies': [], 'errors': 0, 'late': 0} for _ in range(options['clients'])]
+    viewers = [{'staleness': [], 'frames': 0, 'errors': 0} for _ in range(options['viewers'])]
+    viewer = poll_viewer if options['poll'] else stream_viewer
+    threads = [threading.Thread(target=viewer, args=(index, options, stop, result), daemon=True)
+               for index, result in enumerate(viewers)]
+    threads += [threading.Thread(target=capture_client, args=(index, audio, options, stop, result), daemon=True)
+                for index, result in enumerate(clients)]
+
+    before = read_metrics(options['ip'])
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    try:
+        stop.wait(options['duration'])
+    except KeyboardInterrupt:
+        pass
+    stop.set()
+    elapsed = time.perf_counter() - start
+    after = read_metrics(options['ip'])
+    for thread in threads:
+        thread.join(timeout=2)
+    report(options, clients, viewers, before, after, elapsed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+"""
+Transport benchmark: the same synthetic audio through every transport the capture client has, over loopback
+
+The senders are the real ones from local_application/local_audio_client.py (TRANSPORTS: json, binary,
+websocket, tcp, udp), each run in its own process so its CPU time and socket bytes can be counted alone.
+One viewer streams /audio_stream in this process. Frames carry the time the client recorded the chunk
+("captured"), so the latency is from the client sending the chunk to the viewer getting its frame,
+analysis and the UDP jitter buffer included.
+
+Per transport:
+    delivered: frames the viewer got / chunks sent (websocket flow control and UDP loss show up here)
+    latency p50/p99, jitter (mean change in latency from one chunk to the next)
+    client CPU: CPU time of the sender process per chunk (encoding, syscalls, the library's own threads)
+    server CPU: process_cpu_seconds_total on /metrics per chunk (the viewer's share is in there for every transport)
+    bytes/chunk: what the sender process passed to + got from its sockets (counted by wrapping the socket
+        methods), so HTTP headers and socket.io framing count, TCP/UDP/IP headers do not
+
+usage:
+python testing/transport_benchmark.py [--transports json,binary,websocket,tcp,udp] [-b 1024] [--samplerate 48000]
+    [--chunks 500] [--speed 1] [-ip http://127.0.0.1:8000/ --stream-port 4242 --udp-port 4243]
+
+Without -ip it starts its own server (src/asgi_server.py) on free ports and stops it at the end.
+Needs numpy, requests and python-socketio[client] (the client's requirements).
+"""
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import requests
+
+from load_generator import synthetic_audio
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLIENT_DIR = os.path.join(REPO, "local_application")
+DEFAULTS = {
+    'ip': None,
+    'stream_port': 4242,
+    'udp_port': 4243,
+    'transports': ['json', 'binary', 'websocket', 'tcp', 'udp'],
+    'blocksize': 1024,
+    'samplerate': 48000,
+    'chunks': 500,
+    'speed': 1.0,
+}
+# chunks sent before measuring, connections are opened and the server warms up
+WARM_UP_CHUNKS = 20
+# seconds to wait for the last frames after the last chunk (the UDP jitter buffer holds some back)
+SETTLE_SECONDS = 0.5
+
+logging.basicConfig(format='[%(levelname)s] %(message)s')
+logging.getLogger().setLevel(logging.INFO)
+
+
+def usage(return_val: int):
+    print(__doc__)
+    sys.exit(return_val)
+
+
+def count_socket_bytes(counter: list):
+    """
+    Add the bytes sent/received through any socket in this process to counter[0] from now on
+
+    Only done in the sender process. /proc/self/io would be simpler but does not see send()/recv()
+    """
+    def sent(method):
+        def wrapper(self, data, *args, **kwargs):
+            result = method(self, data, *args, **kwargs)
+            # sendall returns None
+            counter[0] += memoryview(data).nbytes if result is None else result
+            return result
+        return wrapper
+
+    def received(method, size):
+        def wrapper(self, *args, **kwargs):
+            result = method(self, *args, **kwargs)
+            counter[0] += size(result)
+            return result
+        return wrapper
+
+    for name in ('send', 'sendall', 'sendto'):
+        setattr(socket.socket, name, sent(getattr(socket.socket, name)))
+    socket.socket.recv = received(socket.socket.recv, len)
+    socket.socket.recv_into = received(socket.socket.recv_into, lambda size: size)
+    socket.socket.recvfrom = received(socket.socket.recvfrom, lambda result: len(result[0]))
+
+
+def send_chunks(transport: str, options: dict, results):
+    """
+    Sender process: warm up, then send options['chunks'] chunks paced like a mic, put the counts in results
+    """
+    sys.path.insert(0, CLIENT_DIR)
+    import local_audio_client as client
+    logging.getLogger().setLevel(logging.WARNING)
+    counter = [0]
+    count_socket_bytes(counter)
+
+    settings = {
+        'loopback': False,
+        'blocksize': options['blocksize'],
+        'samplerate': options['samplerate'],
+        'mics': {},
+        'source': f"benchmark-{transport}",
+        'transport': transport,
+        'stream_port': options['stream_port'],
+        'udp_port': options['udp_port'],
+    }
+    post_chunk = client.TRANSPORTS[transport]
+    audio = synthetic_audio(options['samplerate'], 1)
+    blocksize = options['blocksize']
+    blocks = [audio[start:start + blocksize] for start in range(0, len(audio) - blocksize + 1, blocksize)]
+    interval = blocksize / options['samplerate'] / options['speed'] if options['speed'] > 0 else 0.0
+
+    for seq in range(WARM_UP_CHUNKS):
+        post_chunk(blocks[seq % len(blocks)], options['ip'], settings, seq, time.time())
+        time.sleep(interval)
+    start = time.time()
+    bytes_before = counter[0]
+    cpu_before = time.process_time()
+    next_send = time.perf_counter()
+    for seq in range(WARM_UP_CHUNKS, WARM_UP_CHUNKS + options['chunks']):
+        delay = next_send - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        next_send += interval
+        post_chunk(blocks[seq % len(blocks)], options['ip'], settings, seq, time.time())
+    cpu = time.process_time() - cpu_before
+    sent = counter[0] - bytes_before
+    if client.websocket is not None:
+        client.websocket.disconnect()
+    if client.stream is not None:
+        client.stream.close()
+    results.put({"start": start, "cpu": cpu, "bytes": sent})
+
+
+def stream_frames(ip: str, frames: list, stop: threading.Event):
+    """
+    Viewer thread: (captured, arrival) of every audio frame that has a capture time
+    """
+    with requests.get(ip + "audio_stream", stream=True, timeout=(5, 30)) as response:
+        event = None
+        for line in response.iter_lines():
+            if stop.is_set():
+                return
+            if line.startswith(b"event: "):
+                event = line[len(b"event: "):]
+            elif line.startswith(b"data: ") and event == b"audio":
+                frame = json.loads(line[len(b"data: "):])
+                if 'captured' in frame:
+                    frames.append((frame['captured'], time.time()))
+
+
+def server_cpu(ip: str) -> float:
+    try:
+        text = requests.get(ip + "metrics", timeout=5).text
+    except requests.exceptions.RequestException:
+        return None
+    for line in text.splitlines():
+        if line.startswith("process_cpu_seconds_total "):
+            return float(line.split(" ", 1)[1])
+    return None
+
+
+def free_port(kind) -> int:
+    with socket.socket(socket.AF_INET, kind) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(options: dict):
+    """
+    Run src/asgi_server.py on free ports, returns the process once it answers
+    """
+    port = free_port(socket.SOCK_STREAM)
+    options['stream_port'] = free_port(socket.SOCK_STREAM)
+    options['udp_port'] = free_port(socket.SOCK_DGRAM)
+    options['ip'] = f"http://127.0.0.1:{port}/"
+    env = dict(os.environ,
+               FLASK_ASGI_HOST="127.0.0.1", FLASK_ASGI_PORT=str(port),
+               FLASK_STREAM_INGEST_HOST="127.0.0.1", FLASK_STREAM_INGEST_PORT=str(options['stream_port']),
+               FLASK_UDP_INGEST_HOST="127.0.0.1", FLASK_UDP_INGEST_PORT=str(options['udp_port']))
+    server = subprocess.Popen([sys.executable, os.path.join(REPO, "src", "asgi_server.py")], env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while server_cpu(options['ip']) is None:
+        if server.poll() is not None or time.monotonic() > deadline:
+            server.kill()
+            raise RuntimeError("the server did not start, try running src/asgi_server.py yourself")
+        time.sleep(0.2)
+    return server
+
+
+def benchmark(transport: str, options: dict) -> dict:
+    frames = []
+    stop = threading.Event()
+    viewer = threading.Thread(target=stream_frames, args=(options['ip'], frames, stop), daemon=True)
+    viewer.start()
+    # let the viewer subscribe before the first chunk
+    time.sleep(0.2)
+    cpu_before = server_cpu(options['ip'])
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    sender = context.Process(target=send_chunks, args=(transport, options, results))
+    sender.start()
+    result = results.get()
+    sender.join()
+    time.sleep(SETTLE_SECONDS)
+    cpu_after = server_cpu(options['ip'])
+    stop.set()
+
+    latencies = np.array([arrival - captured for captured, arrival in frames if captured >= result['start']])
+    chunks = options['chunks']
+    return {
+        "transport": transport,
+        "delivered": len(latencies) / chunks,
+        "p50": np.percentile(latencies, 50) if len(latencies) else np.nan,
+        "p99": np.percentile(latencies, 99) if len(latencies) else np.nan,
+        "jitter": np.abs(np.diff(latencies)).mean() if len(latencies) > 1 else np.nan,
+        "client_cpu": result['cpu'] / chunks,
+        "server_cpu": (cpu_after - cpu_before) / chunks if cpu_before is not None and cpu_after is not None else np.nan,
+        "bytes": result['bytes'] / chunks,
+    }
+
+
+def print_table(options: dict, rows: list):
+    print(f"{options['chunks']} chunks of {options['blocksize']} float32 samples at {options['samplerate']} Hz, "
+          f"speed {options['speed']}")
+    print(f"{'transport':<10} {'delivered':>9} {'p50 ms':>8} {'p99 ms':>8} {'jitter ms':>9} "
+          f"{'client µs':>9} {'server µs':>9} {'bytes':>8}")
+    for row in rows:
+        print(f"{row['transport']:<10} {100 * row['delivered']:>8.0f}% {1000 * row['p50']:>8.2f} "
+              f"{1000 * row['p99']:>8.2f} {1000 * row['jitter']:>9.2f} {1e6 * row['client_cpu']:>9.0f} "
+              f"{1e6 * row['server_cpu']:>9.0f} {row['bytes']:>8.0f}")
+
+
+def parse_args(args: list) -> dict:
+    options = dict(DEFAULTS)
+    while args:
+        next = args.pop(0)
+        try:
+            if next == '-ip':
+                options['ip'] = args.pop(0)
+            elif next == '--stream-port':
+                options['stream_port'] = int(args.pop(0))
+            elif next == '--udp-port':
+                options['udp_port'] = int(args.pop(0))
+            elif next == '--transports':
+                options['transports'] = args.pop(0).split(",")
+            elif next == '-b' or next == '--blocksize':
+                options['blocksize'] = int(args.pop(0))
+            elif next == '--samplerate':
+                options['samplerate'] = int(args.pop(0))
+            elif next == '--chunks':
+                options['chunks'] = int(args.pop(0))
+            elif next == '--speed':
+                options['speed'] = float(args.pop(0))
+            else:
+                usage(1)
+        except (IndexError, ValueError):
+            logging.error(f"failed to parse command line arguments - bad value for {next}")
+            usage(1)
+    unknown = set(options['transports']) - set(DEFAULTS['transports'])
+    if unknown:
+        logging.error(f"unknown transports {sorted(unknown)}, expected some of {DEFAULTS['transports']}")
+        usage(1)
+    if options['ip'] is not None and not options['ip'].endswith("/"):
+        options['ip'] += "/"
+    return options
+
+
+def main():
+    options = parse_args(sys.argv[1:])
+    server = start_server(options) if options['ip'] is None else None
+    rows = []
+    try:
+        for transport in options['transports']:
+            logging.info(f"benchmarking {transport}")
+            rows.append(benchmark(transport, options))
+    finally:
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                # uvicorn waits for the viewers' streams to close
+                server.kill()
+    print_table(options, rows)
+
+
+if __name__ == "__main__":
+    main()